@@ -0,0 +1,341 @@
+"""Benchmark startup and endpoints of brain-cockpit.
+
+Generates a synthetic dataset (see ``generate_dataset.py``),
+or uses an existing config, then measures the time taken and
+peak memory used by the server to start, with an empty cache folder
+and with the cache folder filled by a previous startup,
+and the latency of every features and alignments endpoint
+through the Flask test client.
+Results are written as JSON so that runs can be compared
+across versions.
+
+Usage::
+
+    python api/benchmarks/bench_endpoints.py \\
+        --subjects 10 --contrasts 50 --mesh fsaverage7 --alignments 2 \\
+        --output results.json
+    python api/benchmarks/bench_endpoints.py --config /path/to/config.yaml
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+from brain_cockpit import BrainCockpit, __version__
+from brain_cockpit.utils import copy_config
+
+sys.path.append(str(Path(__file__).parent))
+
+from generate_dataset import (  # noqa: E402
+    add_dataset_arguments,
+    generate_dataset,
+    get_dataset_kwargs,
+)
+
+
+def get_peak_rss():
+    """Return peak resident memory of the current process, in bytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is given in bytes on macOS, and in kilobytes elsewhere
+    return peak_rss if sys.platform == "darwin" else 1024 * peak_rss
+
+
+def run_startup(config_path, queue):
+    """Start brain-cockpit and report time taken and peak memory."""
+    start = time.perf_counter()
+    BrainCockpit(config_path=config_path)
+    queue.put(
+        {
+            "seconds": time.perf_counter() - start,
+            "peak_rss_mb": get_peak_rss() / 1024**2,
+        }
+    )
+
+
+def measure_startup(config_path):
+    """Measure startup in a fresh process, so that memory is not shared."""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=run_startup, args=(config_path, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+
+    return result
+
+
+def list_requests(bc, rng, n_requests):
+    """List requests sent to each endpoint, with random parameters.
+
+    Returns
+    -------
+    requests: dict
+        Lists of (method, url, kwargs) of test client requests,
+        indexed by route template
+    """
+    requests = defaultdict(list)
+
+    def add(route, url, method="GET", **kwargs):
+        requests[route].append((method, url, kwargs))
+
+    for dataset_id, dataset in bc.datasets.features.items():
+        prefix = f"/datasets/{dataset_id}"
+        mesh = dataset.meshes[0]
+        n_subjects = len(dataset.subjects)
+        n_contrasts = len(dataset.tasks_contrasts)
+        n_vertices = bc.features_stores[dataset_id].get_n_vertices(
+            mesh, "left"
+        )
+        mesh_query = {"meshSupport": mesh, "hemi": "left"}
+        mesh_types = dataset.config.get("mesh_types", dict())
+        if "default" in mesh_types:
+            mesh_query["meshType"] = mesh_types["default"]
+
+        for _ in range(n_requests):
+            hemi = rng.choice(["left", "right", "both"])
+            subject_index = int(rng.integers(n_subjects))
+            contrast_index = int(rng.integers(n_contrasts))
+            voxel_index = int(rng.integers(n_vertices))
+
+            for endpoint in ["info", "subjects", "contrast_labels"]:
+                add(f"{prefix}/{endpoint}", f"{prefix}/{endpoint}")
+            add(
+                f"{prefix}/mesh_url",
+                f"{prefix}/mesh_url",
+                query_string={"subject": subject_index, **mesh_query},
+            )
+            add(
+                f"{prefix}/contrast",
+                f"{prefix}/contrast",
+                query_string={
+                    "mesh": mesh,
+                    "subject_index": subject_index,
+                    "contrast_index": contrast_index,
+                    "hemi": hemi,
+                    "format": "f32",
+                },
+            )
+            add(
+                f"{prefix}/contrast_mean",
+                f"{prefix}/contrast_mean",
+                query_string={
+                    "mesh": mesh,
+                    "contrast_index": contrast_index,
+                    "hemi": hemi,
+                    "format": "f32",
+                },
+            )
+            add(
+                f"{prefix}/voxel_fingerprint",
+                f"{prefix}/voxel_fingerprint",
+                query_string={
+                    "mesh": mesh,
+                    "subject_index": subject_index,
+                    "voxel_index": voxel_index,
+                    "hemi": "left",
+                },
+            )
+            add(
+                f"{prefix}/voxel_fingerprint_mean",
+                f"{prefix}/voxel_fingerprint_mean",
+                query_string={
+                    "mesh": mesh,
+                    "voxel_index": voxel_index,
+                    "hemi": "left",
+                },
+            )
+            add(
+                f"{prefix}/voxel_fingerprints",
+                f"{prefix}/voxel_fingerprints",
+                method="POST",
+                json={
+                    "mesh": mesh,
+                    "hemi": "left",
+                    "voxel_indices": (
+                        rng.integers(n_vertices, size=100).astype(int).tolist()
+                    ),
+                    "roi_mean": True,
+                },
+            )
+
+            mesh_url = bc.app.test_client().get(
+                f"{prefix}/mesh_url",
+                query_string={"subject": subject_index, **mesh_query},
+            )
+            if mesh_url.status_code == 200:
+                add(
+                    f"{prefix}/mesh/<path:path>",
+                    f"{prefix}/mesh/{mesh_url.get_json()}",
+                )
+
+    features_dataset_id = next(iter(bc.datasets.features), None)
+    for dataset_id, dataset in bc.datasets.alignments.items():
+        prefix = f"/alignments/{dataset_id}"
+        n_models = len(dataset.df)
+
+        for _ in range(n_requests):
+            model_id = int(rng.integers(n_models))
+            role = rng.choice(["source", "target"])
+
+            add(f"{prefix}/models", f"{prefix}/models")
+            add(
+                f"{prefix}/<int:model_id>/info",
+                f"{prefix}/{model_id}/info",
+            )
+            add(
+                f"{prefix}/single_voxel",
+                f"{prefix}/single_voxel",
+                query_string={
+                    "model_id": model_id,
+                    "voxel": int(rng.integers(100)),
+                    "role": role,
+                    "format": "f32",
+                },
+            )
+            add(
+                f"{prefix}/voxels",
+                f"{prefix}/voxels",
+                method="POST",
+                json={
+                    "model_id": model_id,
+                    "role": role,
+                    "voxel_indices": list(range(10)),
+                    "top_k": 100,
+                },
+            )
+            if features_dataset_id is not None:
+                features_dataset = bc.datasets.features[features_dataset_id]
+                add(
+                    f"{prefix}/project_contrast",
+                    f"{prefix}/project_contrast",
+                    query_string={
+                        "model_id": model_id,
+                        "dataset": features_dataset_id,
+                        "subject_index": int(
+                            rng.integers(len(features_dataset.subjects))
+                        ),
+                        "contrast_index": int(
+                            rng.integers(len(features_dataset.tasks_contrasts))
+                        ),
+                        "mesh": features_dataset.meshes[0],
+                        "hemi": "left",
+                        "role": role,
+                        "format": "f32",
+                    },
+                )
+
+    return requests
+
+
+def measure_endpoints(bc, requests):
+    """Send requests to each endpoint and summarize their latency."""
+    client = bc.app.test_client()
+    results = dict()
+    for route, route_requests in requests.items():
+        latencies, sizes, n_errors = [], [], 0
+        for method, url, kwargs in route_requests:
+            start = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            data = response.get_data()
+            latencies.append(time.perf_counter() - start)
+            sizes.append(len(data))
+            n_errors += response.status_code >= 400
+
+        latencies_ms = 1000 * np.array(latencies)
+        results[route] = {
+            "n_requests": len(latencies),
+            "n_errors": int(n_errors),
+            "p50_ms": float(np.percentile(latencies_ms, 50)),
+            "p99_ms": float(np.percentile(latencies_ms, 99)),
+            "mean_ms": float(np.mean(latencies_ms)),
+            "max_ms": float(np.max(latencies_ms)),
+            "mean_bytes": float(np.mean(sizes)),
+        }
+
+    return results
+
+
+def run_benchmarks(config_path, n_requests=50, seed=0):
+    """Run all benchmarks for a config and return their results.
+
+    The config should set a cache folder, which should be empty
+    so that the first startup loads all datasets from their files.
+    """
+    startup = {
+        "cold": measure_startup(config_path),
+        "warm": measure_startup(config_path),
+    }
+
+    bc = BrainCockpit(config_path=config_path)
+    rng = np.random.default_rng(seed)
+    endpoints = measure_endpoints(bc, list_requests(bc, rng, n_requests))
+
+    return {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "startup": startup,
+        "serving_peak_rss_mb": get_peak_rss() / 1024**2,
+        "endpoints": endpoints,
+    }
+
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+parser.add_argument(
+    "--config",
+    type=str,
+    default=None,
+    help=(
+        "Benchmark the datasets of this config "
+        "rather than a synthetic dataset"
+    ),
+)
+add_dataset_arguments(parser)
+parser.add_argument(
+    "--requests",
+    type=int,
+    default=50,
+    help="Number of requests sent to each endpoint",
+)
+parser.add_argument(
+    "--output",
+    type=str,
+    default=None,
+    help="Path to the JSON file in which results are written",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.config is not None:
+            # Benchmark with an empty cache folder
+            config_path = copy_config(
+                args.config, tmp_dir, cache_folder=str(Path(tmp_dir) / "cache")
+            )
+            dataset = None
+        else:
+            config_path = generate_dataset(tmp_dir, **get_dataset_kwargs(args))
+            dataset = get_dataset_kwargs(args)
+
+        results = run_benchmarks(
+            config_path, n_requests=args.requests, seed=args.seed
+        )
+        results["config"] = args.config
+        results["dataset"] = dataset
+
+    output = json.dumps(results, indent=2)
+    if args.output is not None:
+        Path(args.output).write_text(output)
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
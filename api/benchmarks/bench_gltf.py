@@ -0,0 +1,221 @@
+"""Benchmark GLTF conversion of surface meshes.
+
+Compares the time taken by ``compute_gltf_from_gifti``
+with that of its former implementation, which packed values
+one by one with ``struct``, and checks that both implementations
+write exactly the same files.
+
+Usage::
+
+    python api/benchmarks/bench_gltf.py --fsaverage fsaverage7
+    python api/benchmarks/bench_gltf.py --mesh /path/to/mesh.gii
+"""
+
+import argparse
+import operator
+import os
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+from brain_cockpit.scripts.gifti_to_gltf import (
+    compute_gltf_from_gifti,
+    read_freesurfer,
+    read_gii,
+)
+from gltflib import (
+    GLTF,
+    Accessor,
+    AccessorType,
+    Asset,
+    Attributes,
+    Buffer,
+    BufferTarget,
+    BufferView,
+    ComponentType,
+    FileResource,
+    GLTFModel,
+    Mesh,
+    Node,
+    Primitive,
+    Scene,
+)
+
+DUMMY_MESH = (
+    Path(__file__).parent.parent
+    / "tests"
+    / "dummy_data"
+    / "features_dataset"
+    / "meshes"
+    / "pial_left.gii.gz"
+)
+
+
+def legacy_compute_gltf_from_gifti(mesh_path, output_folder, output_filename):
+    """Former implementation of ``compute_gltf_from_gifti``."""
+    mesh_output_folder = Path(output_folder)
+    if not os.path.exists(mesh_output_folder):
+        os.mkdir(mesh_output_folder)
+
+    vertices, triangles = [], []
+    if mesh_path[-3:] == "gii" or mesh_path[-6:] == "gii.gz":
+        vertices, triangles = read_gii(mesh_path)
+    else:
+        vertices, triangles = read_freesurfer(mesh_path)
+
+    vertices = vertices.tolist()
+    triangles = triangles.tolist()
+
+    vertex_bytearray = bytearray()
+    for vertex in vertices:
+        for value in vertex:
+            vertex_bytearray.extend(struct.pack("f", value))
+
+    mins = [
+        min([operator.itemgetter(i)(vertex) for vertex in vertices])
+        for i in range(3)
+    ]
+    maxs = [
+        max([operator.itemgetter(i)(vertex) for vertex in vertices])
+        for i in range(3)
+    ]
+
+    triangles_bytearray = bytearray()
+    for triangle in triangles:
+        for vertex_index in triangle:
+            triangles_bytearray.extend(struct.pack("I", vertex_index))
+
+    model = GLTFModel(
+        asset=Asset(version="2.0"),
+        scenes=[Scene(nodes=[0])],
+        nodes=[Node(mesh=0)],
+        meshes=[
+            Mesh(
+                primitives=[
+                    Primitive(attributes=Attributes(POSITION=0), indices=1)
+                ]
+            )
+        ],
+        buffers=[
+            Buffer(
+                byteLength=len(vertex_bytearray),
+                uri=f"vertices_{output_filename}.bin",
+            ),
+            Buffer(
+                byteLength=len(triangles_bytearray),
+                uri=f"triangles_{output_filename}.bin",
+            ),
+        ],
+        bufferViews=[
+            BufferView(
+                buffer=0,
+                byteOffset=0,
+                byteLength=len(vertex_bytearray),
+                target=BufferTarget.ARRAY_BUFFER.value,
+            ),
+            BufferView(
+                buffer=1,
+                byteOffset=0,
+                byteLength=len(triangles_bytearray),
+                target=BufferTarget.ELEMENT_ARRAY_BUFFER.value,
+            ),
+        ],
+        accessors=[
+            Accessor(
+                bufferView=0,
+                byteOffset=0,
+                componentType=ComponentType.FLOAT.value,
+                count=len(vertices),
+                type=AccessorType.VEC3.value,
+                min=mins,
+                max=maxs,
+            ),
+            Accessor(
+                bufferView=1,
+                byteOffset=0,
+                componentType=ComponentType.UNSIGNED_INT.value,
+                count=3 * len(triangles),
+                type=AccessorType.SCALAR.value,
+            ),
+        ],
+    )
+
+    vertices_resource = FileResource(
+        f"vertices_{output_filename}.bin", data=vertex_bytearray
+    )
+    triangles_resource = FileResource(
+        f"triangles_{output_filename}.bin", data=triangles_bytearray
+    )
+    gltf = GLTF(model=model, resources=[vertices_resource, triangles_resource])
+    gltf.export(os.path.join(mesh_output_folder, f"{output_filename}.gltf"))
+
+
+def time_conversion(func, mesh_path, output_folder, repeat):
+    """Return best time taken by ``func`` to convert a mesh."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(str(mesh_path), str(output_folder), "mesh")
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+
+def compare_outputs(folder_a, folder_b):
+    """Return names of files which differ between two output folders."""
+    names = sorted(os.listdir(folder_a))
+    assert names == sorted(os.listdir(folder_b)), "Output files differ"
+
+    return [
+        name
+        for name in names
+        if (Path(folder_a) / name).read_bytes()
+        != (Path(folder_b) / name).read_bytes()
+    ]
+
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+parser.add_argument(
+    "--mesh",
+    type=str,
+    default=None,
+    help="Path to a gifti or freesurfer mesh",
+)
+parser.add_argument(
+    "--fsaverage",
+    type=str,
+    default=None,
+    help="Benchmark the pial mesh of this fsaverage resolution instead",
+)
+parser.add_argument("--repeat", type=int, default=3)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if args.fsaverage is not None:
+        from nilearn import datasets
+
+        mesh_path = datasets.fetch_surf_fsaverage(args.fsaverage)["pial_left"]
+    else:
+        mesh_path = args.mesh or DUMMY_MESH
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_folder = Path(tmp_dir) / "legacy"
+        folder = Path(tmp_dir) / "vectorized"
+
+        legacy_time = time_conversion(
+            legacy_compute_gltf_from_gifti, mesh_path, legacy_folder, 1
+        )
+        new_time = time_conversion(
+            compute_gltf_from_gifti, mesh_path, folder, args.repeat
+        )
+        different_files = compare_outputs(legacy_folder, folder)
+
+    print(f"Mesh: {mesh_path}")
+    print(f"Legacy conversion: {legacy_time:.3f}s")
+    print(f"Vectorized conversion: {new_time:.3f}s")
+    print(f"Speedup: {legacy_time / new_time:.1f}x")
+    if len(different_files) > 0:
+        raise SystemExit(f"Outputs differ: {', '.join(different_files)}")
+    print("Outputs are identical byte for byte")
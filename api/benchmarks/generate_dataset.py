@@ -0,0 +1,352 @@
+"""Generate a synthetic brain-cockpit dataset.
+
+Writes icosahedral meshes with as many vertices as fsaverage meshes
+(from 642 vertices for fsaverage3 to 163842 for fsaverage7),
+random contrast maps for all subjects, and optionally
+alignments between subjects with random sparse transport plans,
+together with a brain-cockpit config serving them.
+
+Usage::
+
+    python api/benchmarks/generate_dataset.py /tmp/synthetic \\
+        --subjects 10 --contrasts 50 --mesh fsaverage5 --alignments 4
+"""
+
+import argparse
+import gzip
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+import yaml
+from brain_cockpit.transport_plan import TransportPlan
+from scipy import sparse
+
+FEATURES_DATASET_ID = "synthetic"
+ALIGNMENTS_DATASET_ID = "synthetic_alignments"
+
+# Order of the icosahedron subdivision with as many vertices
+# as each fsaverage mesh
+FSAVERAGE_ORDERS = {
+    "fsaverage3": 3,
+    "fsaverage4": 4,
+    "fsaverage5": 5,
+    "fsaverage6": 6,
+    "fsaverage7": 7,
+    "fsaverage": 7,
+}
+
+# Number of contrasts of each synthetic task
+CONTRASTS_PER_TASK = 10
+
+
+def create_icosphere(order, radius=100):
+    """Create a sphere by subdividing an icosahedron ``order`` times.
+
+    Returns
+    -------
+    vertices: np.ndarray of size (10 * 4**order + 2, 3)
+    triangles: np.ndarray of size (20 * 4**order, 3)
+    """
+    t = (1 + 5**0.5) / 2
+    vertices = np.array(
+        [
+            [-1, t, 0],
+            [1, t, 0],
+            [-1, -t, 0],
+            [1, -t, 0],
+            [0, -1, t],
+            [0, 1, t],
+            [0, -1, -t],
+            [0, 1, -t],
+            [t, 0, -1],
+            [t, 0, 1],
+            [-t, 0, -1],
+            [-t, 0, 1],
+        ]
+    )
+    triangles = np.array(
+        [
+            [0, 11, 5],
+            [0, 5, 1],
+            [0, 1, 7],
+            [0, 7, 10],
+            [0, 10, 11],
+            [1, 5, 9],
+            [5, 11, 4],
+            [11, 10, 2],
+            [10, 7, 6],
+            [7, 1, 8],
+            [3, 9, 4],
+            [3, 4, 2],
+            [3, 2, 6],
+            [3, 6, 8],
+            [3, 8, 9],
+            [4, 9, 5],
+            [2, 4, 11],
+            [6, 2, 10],
+            [8, 6, 7],
+            [9, 8, 1],
+        ]
+    )
+
+    for _ in range(order):
+        # Add a vertex in the middle of each edge,
+        # and split each triangle into 4 triangles
+        edges = np.sort(
+            np.concatenate(
+                [
+                    triangles[:, [0, 1]],
+                    triangles[:, [1, 2]],
+                    triangles[:, [2, 0]],
+                ]
+            ),
+            axis=1,
+        )
+        unique_edges, inverse = np.unique(edges, axis=0, return_inverse=True)
+        a, b, c = triangles.T
+        ab, bc, ca = inverse.reshape(3, -1) + len(vertices)
+        vertices = np.concatenate(
+            [vertices, vertices[unique_edges].mean(axis=1)]
+        )
+        triangles = np.concatenate(
+            [
+                np.stack([a, ab, ca], axis=1),
+                np.stack([b, bc, ab], axis=1),
+                np.stack([c, ca, bc], axis=1),
+                np.stack([ab, bc, ca], axis=1),
+            ]
+        )
+
+    vertices = radius * vertices / np.linalg.norm(vertices, axis=1)[:, None]
+
+    return vertices.astype(np.float32), triangles.astype(np.int32)
+
+
+def save_mesh(path, vertices, triangles):
+    """Save mesh in a gzipped gifti file."""
+    img = nib.gifti.GiftiImage(
+        darrays=[
+            nib.gifti.GiftiDataArray(
+                vertices, intent="NIFTI_INTENT_POINTSET", datatype="float32"
+            ),
+            nib.gifti.GiftiDataArray(
+                triangles, intent="NIFTI_INTENT_TRIANGLE", datatype="int32"
+            ),
+        ]
+    )
+    with gzip.open(path, "wb") as f:
+        f.write(img.to_xml())
+
+
+def save_map(path, values):
+    """Save map in a gifti file."""
+    img = nib.gifti.GiftiImage(
+        darrays=[nib.gifti.GiftiDataArray(values, datatype="float32")]
+    )
+    nib.save(img, path)
+
+
+def create_transport_plan(n_vertices, n_per_row, rng):
+    """Create random sparse transport plan between meshes of a given size.
+
+    Each source vertex is mapped onto ``n_per_row`` random target vertices.
+    """
+    rows = np.repeat(np.arange(n_vertices), n_per_row)
+    columns = rng.integers(n_vertices, size=n_vertices * n_per_row)
+    values = rng.random(n_vertices * n_per_row, dtype=np.float32)
+    pi = sparse.coo_matrix(
+        (values, (rows, columns)), shape=(n_vertices, n_vertices)
+    ).tocsr()
+
+    return TransportPlan(pi / pi.sum())
+
+
+def generate_dataset(
+    output_folder,
+    n_subjects=2,
+    n_contrasts=4,
+    mesh="fsaverage3",
+    n_alignments=0,
+    n_per_row=32,
+    cache=True,
+    seed=0,
+):
+    """Write a synthetic dataset and a config serving it.
+
+    Parameters
+    ----------
+    output_folder: str or pathlib.Path
+    n_subjects: int
+    n_contrasts: int
+        Number of contrasts of each subject,
+        grouped in tasks of ``CONTRASTS_PER_TASK`` contrasts
+    mesh: str
+        Name of the fsaverage mesh whose number of vertices is used
+    n_alignments: int
+        Number of alignments between consecutive subjects
+    n_per_row: int
+        Number of non-zero values in each row of transport plans
+    cache: bool
+        Whether the config sets a cache folder
+    seed: int
+
+    Returns
+    -------
+    config_path: pathlib.Path
+        Path to the config serving the dataset
+    """
+    output_folder = Path(output_folder).absolute()
+    features_folder = output_folder / "features"
+    (features_folder / "meshes").mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    vertices, triangles = create_icosphere(FSAVERAGE_ORDERS[mesh])
+    n_vertices = len(vertices)
+    mesh_paths = {
+        "lh": Path("meshes") / "pial_left.gii.gz",
+        "rh": Path("meshes") / "pial_right.gii.gz",
+    }
+    save_mesh(features_folder / mesh_paths["lh"], vertices, triangles)
+    # Mirror left hemisphere, keeping triangles oriented outwards
+    save_mesh(
+        features_folder / mesh_paths["rh"],
+        vertices * np.array([-1, 1, 1], dtype=np.float32),
+        triangles[:, ::-1],
+    )
+
+    subjects = [f"sub-{i:02d}" for i in range(1, n_subjects + 1)]
+    rows = []
+    for subject in subjects:
+        (features_folder / subject).mkdir(exist_ok=True)
+        for contrast_index in range(n_contrasts):
+            task = f"task{contrast_index // CONTRASTS_PER_TASK:02d}"
+            contrast = f"contrast{contrast_index:03d}"
+            for side, mesh_path in mesh_paths.items():
+                map_path = Path(subject) / f"{task}_{contrast}_{side}.gii"
+                save_map(
+                    features_folder / map_path,
+                    rng.standard_normal(n_vertices, dtype=np.float32),
+                )
+                rows.append(
+                    {
+                        "path": str(map_path),
+                        "subject": subject,
+                        "task": task,
+                        "contrast": contrast,
+                        "side": side,
+                        "mesh": mesh,
+                        "mesh_path": str(mesh_path),
+                    }
+                )
+    pd.DataFrame(rows).to_csv(
+        features_folder / "dataset.csv", index_label="index"
+    )
+
+    config = {
+        "cache_folder": str(output_folder / "cache") if cache else None,
+        "features": {
+            "datasets": {
+                FEATURES_DATASET_ID: {
+                    "name": "Synthetic features",
+                    "path": str(features_folder / "dataset.csv"),
+                    "unit": "z-score",
+                }
+            }
+        },
+    }
+
+    if n_alignments > 0:
+        alignments_folder = output_folder / "alignments"
+        (alignments_folder / "models").mkdir(parents=True, exist_ok=True)
+        (alignments_folder / "meshes").mkdir(exist_ok=True)
+        save_mesh(alignments_folder / mesh_paths["lh"], vertices, triangles)
+        rows = []
+        for i in range(n_alignments):
+            model_path = Path("models") / f"alignment{i}.npz"
+            create_transport_plan(n_vertices, n_per_row, rng).save(
+                alignments_folder / model_path
+            )
+            rows.append(
+                {
+                    "name": f"alignment{i}",
+                    "source_subject": subjects[i % n_subjects],
+                    "target_subject": subjects[(i + 1) % n_subjects],
+                    "source_mesh": str(mesh_paths["lh"]),
+                    "target_mesh": str(mesh_paths["lh"]),
+                    "alignment": str(model_path),
+                }
+            )
+        pd.DataFrame(rows).to_csv(
+            alignments_folder / "dataset.csv", index=False
+        )
+        config["alignments"] = {
+            "datasets": {
+                ALIGNMENTS_DATASET_ID: {
+                    "name": "Synthetic alignments",
+                    "path": str(alignments_folder / "dataset.csv"),
+                }
+            }
+        }
+
+    config_path = output_folder / "config.yaml"
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f, sort_keys=False)
+
+    return config_path
+
+
+def add_dataset_arguments(parser):
+    """Add arguments describing a synthetic dataset to a parser."""
+    parser.add_argument("--subjects", type=int, default=2)
+    parser.add_argument("--contrasts", type=int, default=4)
+    parser.add_argument(
+        "--mesh",
+        type=str,
+        default="fsaverage3",
+        choices=list(FSAVERAGE_ORDERS),
+        help="fsaverage mesh whose number of vertices is used",
+    )
+    parser.add_argument(
+        "--alignments",
+        type=int,
+        default=0,
+        help="Number of alignments between subjects",
+    )
+    parser.add_argument(
+        "--per-row",
+        type=int,
+        default=32,
+        help="Number of non-zero values in each row of transport plans",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def get_dataset_kwargs(args):
+    """Return arguments of ``generate_dataset`` given parsed arguments."""
+    return {
+        "n_subjects": args.subjects,
+        "n_contrasts": args.contrasts,
+        "mesh": args.mesh,
+        "n_alignments": args.alignments,
+        "n_per_row": args.per_row,
+        "seed": args.seed,
+    }
+
+
+parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+parser.add_argument("output_folder", type=str)
+add_dataset_arguments(parser)
+parser.add_argument(
+    "--no-cache",
+    action="store_true",
+    help="Do not set a cache folder in the generated config",
+)
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    config_path = generate_dataset(
+        args.output_folder, cache=not args.no_cache, **get_dataset_kwargs(args)
+    )
+    print(f"Config: {config_path}")
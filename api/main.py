@@ -1,6 +1,7 @@
 import argparse
 
 from brain_cockpit import BrainCockpit
+from brain_cockpit.prefork import create_socket, serve_prefork
 from waitress import serve
 
 PORT = 5000
@@ -41,12 +42,31 @@ parser.add_argument(
     help="Number of threads",
 )
 
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    required=False,
+    help=(
+        "Number of worker processes in production, "
+        "forked once datasets are loaded so that they share them"
+    ),
+)
+
 if __name__ == "__main__":
     args = parser.parse_args()
 
     bc = BrainCockpit(config_path=args.config)
 
-    if args.env == "prod":
+    if args.env == "prod" and args.workers > 1:
+        # Serve flask app through several waitress processes
+        serve_prefork(
+            bc.app,
+            create_socket("0.0.0.0", args.port or PORT),
+            workers=args.workers,
+            threads=args.threads or THREADS,
+        )
+    elif args.env == "prod":
         # In production, serve flask app through waitress
         serve(
             bc.app,
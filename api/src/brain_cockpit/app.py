@@ -3,12 +3,15 @@ from pathlib import Path
 import numpy as np
 import orjson
 
+from brain_cockpit import http_caching, metrics, profiling
+from brain_cockpit.datasets import DatasetRegistry
 from brain_cockpit.endpoints import (
     alignments_explorer,
     features_explorer,
     server,
 )
-from brain_cockpit.utils import console, load_config
+from brain_cockpit.responses import ARRAY_HEADERS
+from brain_cockpit.utils import console, create_cache, load_config
 from flask import Flask
 from flask.json.provider import JSONProvider
 from flask_cors import CORS
@@ -38,15 +41,38 @@ class BrainCockpit:
         self.config_path = Path(config_path)
         self.config = load_config(config_path=config_path)
 
-        _ = CORS(self.app)
+        # Read dataset descriptions once for all endpoints
+        self.datasets = DatasetRegistry(
+            self.config, config_path=self.config_path
+        )
+
+        # Expose headers describing binary arrays to the front-end
+        _ = CORS(self.app, expose_headers=ARRAY_HEADERS)
+        # Metrics hooks are registered first
+        # so that they time other hooks as well
+        metrics.init_app(self)
+        http_caching.init_app(self)
+        profiling.init_app(self)
+
+        # Cache shared by all datasets whose maps are loaded lazily
+        self.maps_cache = create_cache(self.config, "lazy_loading_budget_mb")
+
+        # Stores of features datasets, indexed by dataset id
+        self.features_stores = dict()
+
+        # Cache of transport plans shared by all alignment datasets
+        self.models_cache = create_cache(
+            self.config, "alignment_models_budget_mb"
+        )
 
         console.print(
             "Brain-cockpit is loading data and setting API endpoints..."
         )
 
-        server.create_all_endpoints(self)
-        features_explorer.create_all_endpoints(self)
-        alignments_explorer.create_all_endpoints(self)
+        with profiling.profile_startup(self):
+            server.create_all_endpoints(self)
+            features_explorer.create_all_endpoints(self)
+            alignments_explorer.create_all_endpoints(self)
 
         console.print(
             "[green]Your brain-cockpit instance is up and running![/green]🚀"
@@ -0,0 +1,288 @@
+"""Command line interface of brain-cockpit.
+
+Commands are meant to be run once, offline,
+to prepare data served by brain-cockpit.
+"""
+
+import argparse
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from rich.table import Table
+
+from brain_cockpit.datasets import DatasetRegistry
+from brain_cockpit.endpoints.alignments_explorer import (
+    get_converted_model_path,
+    get_model_path,
+    load_transport_plan,
+)
+from brain_cockpit.endpoints.features_explorer import (
+    load_store,
+    prune_maps_cache,
+)
+from brain_cockpit.profiling import profile_startup
+from brain_cockpit.scripts.gifti_to_gltf import create_dataset_glft_files
+from brain_cockpit.utils import (
+    ByteLRUCache,
+    console,
+    get_cache_folder,
+    get_dataset_option,
+    get_progress,
+    load_config,
+    load_dataset_description,
+)
+
+
+class BuildContext:
+    """Config and datasets of a brain-cockpit instance, without its app.
+
+    It holds the attributes of ``BrainCockpit``
+    which are needed to prepare datasets.
+
+    Parameters
+    ----------
+    config_path: str or pathlib.Path
+        Path to brain-cockpit config
+    n_workers: int or None
+        Number of processes used to prepare data,
+        overriding ``loading_workers`` in the config if set
+    """
+
+    def __init__(self, config_path, n_workers=None):
+        self.config_path = Path(config_path)
+        self.config = load_config(config_path=config_path, verbose=True)
+        if n_workers is not None:
+            self.config["loading_workers"] = n_workers
+        self.datasets = DatasetRegistry(
+            self.config, config_path=self.config_path
+        )
+        # Stores of lazy datasets reference this cache,
+        # but their maps are not decoded through it when building
+        self.maps_cache = ByteLRUCache()
+
+
+@contextmanager
+def timed(timings, *labels):
+    """Append labels and duration of the enclosed block to ``timings``."""
+    start = time.perf_counter()
+    yield
+    timings.append((*labels, time.perf_counter() - start))
+
+
+def list_alignment_models(config_path, dataset_ids=None):
+    """List paths to models of alignment datasets of a config."""
+    config = load_config(config_path=config_path)
+    datasets = config.get("alignments", dict()).get("datasets", dict())
+
+    model_paths = []
+    for dataset_id, dataset in datasets.items():
+        if dataset_ids is not None and dataset_id not in dataset_ids:
+            continue
+
+        df, dataset_path = load_dataset_description(
+            config_path=config_path, dataset_path=dataset["path"]
+        )
+        model_paths.extend(
+            get_model_path(dataset_path, model_path)
+            for model_path in df["alignment"]
+        )
+
+    return model_paths
+
+
+def convert_alignments(args):
+    """Convert alignment models into sparse transport plans."""
+    model_paths = list(map(Path, args.models))
+    if args.config is not None:
+        model_paths.extend(
+            list_alignment_models(args.config, dataset_ids=args.dataset)
+        )
+
+    with get_progress(console=console) as progress:
+        task = progress.add_task(
+            "Convert alignment models", total=len(model_paths)
+        )
+        for model_path in model_paths:
+            output_path = get_converted_model_path(model_path)
+            is_converted = (
+                output_path.exists()
+                and output_path.stat().st_mtime >= model_path.stat().st_mtime
+            )
+            if model_path.suffix == ".npz" or (
+                is_converted and not args.force
+            ):
+                progress.update(task, advance=1)
+                continue
+
+            plan = load_transport_plan(model_path).sparsify(
+                threshold=args.threshold, max_per_row=args.max_per_row
+            )
+            plan.save(output_path)
+            console.log(
+                f"Saved {output_path} "
+                f"({plan.pi.nnz} non-zero values, "
+                f"{plan.nbytes / 1024**2:.1f} MB)"
+            )
+            progress.update(task, advance=1)
+
+
+def build(args):
+    """Prepare meshes and maps of all datasets of a config.
+
+    GLTF files and cached maps are written where the server
+    looks for them, so that starting the server afterwards
+    only reads these files.
+
+    Returns
+    -------
+    timings: list of (kind, dataset_id, stage, seconds)
+    """
+    timings = []
+    with timed(timings, "", "", "Read dataset descriptions"):
+        bc = BuildContext(args.config, n_workers=args.workers)
+
+    with profile_startup(bc, "build"):
+        build_datasets(bc, timings)
+
+    table = Table("Kind", "Dataset", "Stage", "Time (s)")
+    for *labels, seconds in timings:
+        table.add_row(*labels, f"{seconds:.2f}")
+    console.print(table)
+
+    return timings
+
+
+def build_datasets(bc, timings):
+    """Prepare meshes and maps of all datasets, timing each stage."""
+    cache_folder = get_cache_folder(bc)
+    if cache_folder is None:
+        console.log(
+            "cache_folder is not set in config, only meshes are prepared",
+            style="yellow",
+        )
+
+    for dataset_id, dataset in bc.datasets.features.items():
+        with timed(timings, "features", dataset_id, "Meshes"):
+            create_dataset_glft_files(
+                bc, dataset.config, dataset.get_mesh_paths()
+            )
+
+        if cache_folder is None:
+            continue
+
+        # Only statistics across subjects are cached for lazy datasets
+        with timed(timings, "features", dataset_id, "Maps"):
+            load_store(
+                bc,
+                dataset_id,
+                dataset.df,
+                dataset.config["path"],
+                lazy=get_dataset_option(
+                    bc, dataset.config, "lazy_loading", False
+                ),
+                vertex_major=get_dataset_option(
+                    bc, dataset.config, "vertex_major", False
+                ),
+            )
+
+    if cache_folder is not None:
+        with timed(timings, "features", "", "Prune cached maps"):
+            prune_maps_cache(bc)
+
+    for dataset_id, dataset in bc.datasets.alignments.items():
+        with timed(timings, "alignments", dataset_id, "Meshes"):
+            create_dataset_glft_files(
+                bc, dataset.config, dataset.get_mesh_paths()
+            )
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="brain-cockpit", description="Brain-cockpit utilities"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser(
+        "convert-alignments",
+        help=(
+            "Convert pickled alignment models into sparse .npz files, "
+            "stored next to them and used by the server instead"
+        ),
+    )
+    convert_parser.add_argument(
+        "models",
+        type=str,
+        nargs="*",
+        help="Paths to pickled alignment models",
+    )
+    convert_parser.add_argument(
+        "--config",
+        type=str,
+        default=None,
+        help="Convert all models of alignment datasets of this config",
+    )
+    convert_parser.add_argument(
+        "--dataset",
+        type=str,
+        action="append",
+        default=None,
+        help="Only convert models of these alignment datasets",
+    )
+    convert_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0,
+        help=(
+            "Drop values smaller than this fraction "
+            "of the largest value of their row"
+        ),
+    )
+    convert_parser.add_argument(
+        "--max-per-row",
+        type=int,
+        default=None,
+        help="Only keep this number of largest values in each row",
+    )
+    convert_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Convert models even if they were already converted",
+    )
+    convert_parser.set_defaults(func=convert_alignments)
+
+    build_parser = subparsers.add_parser(
+        "build",
+        help=(
+            "Prepare meshes and maps of all datasets of a config "
+            "ahead of time, so that the server starts from cached files"
+        ),
+    )
+    build_parser.add_argument(
+        "--config",
+        type=str,
+        required=True,
+        help="Path to brain-cockpit server config file",
+    )
+    build_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help=(
+            "Number of processes used to prepare data "
+            "(defaults to loading_workers in the config, "
+            "-1 uses all available cores)"
+        ),
+    )
+    build_parser.set_defaults(func=build)
+
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Registry of datasets served by brain-cockpit.
+
+Dataset descriptions (CSV files) are read and parsed once at startup,
+and shared by all endpoints.
+"""
+
+import copy
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from brain_cockpit.endpoints.features_explorer import (
+    parse_metadata,
+    side_to_hemi,
+)
+from brain_cockpit.utils import load_dataset_description
+
+# Options of the config which only concern the server,
+# and are not sent to clients
+SERVER_OPTIONS = [
+    "cache_folder",
+    "loading_workers",
+    "lazy_loading_budget_mb",
+    "alignment_models_budget_mb",
+    "http",
+    "profiling",
+]
+
+
+class Dataset:
+    """Dataset described by a CSV file.
+
+    Parameters
+    ----------
+    id: str
+        Id of the dataset in the config
+    config: dict
+        Options of the dataset in the config
+    config_path: str or pathlib.Path
+        Path to brain-cockpit config, from which relative
+        dataset paths are resolved
+    """
+
+    def __init__(self, id, config, config_path=None):
+        self.id = id
+        self.config = config
+        self.df, self.path = load_dataset_description(
+            config_path=config_path, dataset_path=config["path"]
+        )
+
+    def get_info(self):
+        """Return information about this dataset served in /config."""
+        return {"n_files": len(self.df)}
+
+    def get_mesh_paths(self):
+        """Return paths to all meshes referenced in this dataset."""
+        return []
+
+
+class FeaturesDataset(Dataset):
+    """Features dataset, whose metadata is parsed once."""
+
+    def __init__(self, id, config, config_path=None):
+        super().__init__(id, config, config_path=config_path)
+        (
+            self.meshes,
+            self.subjects,
+            self.tasks_contrasts,
+            self.sides,
+        ) = parse_metadata(self.df)
+
+        # Mesh of each (subject, mesh, side),
+        # used rather than filtering the DataFrame at each request
+        self.mesh_paths = {
+            (subject, mesh, side): mesh_path
+            for subject, mesh, side, mesh_path in self.df.drop_duplicates(
+                ["subject", "mesh", "side"]
+            )[["subject", "mesh", "side", "mesh_path"]].itertuples(index=False)
+        }
+
+    def get_mesh_paths(self):
+        return list(map(Path, np.unique(self.df["mesh_path"])))
+
+    def get_info(self):
+        return {
+            "subjects": self.subjects,
+            "meshes": self.meshes,
+            "sides": list(map(side_to_hemi, self.sides)),
+            **super().get_info(),
+        }
+
+
+class AlignmentsDataset(Dataset):
+    """Alignments dataset, whose models map a source onto a target mesh."""
+
+    def get_mesh_paths(self):
+        return list(
+            map(
+                Path,
+                np.unique(
+                    pd.concat([self.df["source_mesh"], self.df["target_mesh"]])
+                ),
+            )
+        )
+
+
+class DatasetRegistry:
+    """All features and alignments datasets of a config.
+
+    Parameters
+    ----------
+    config: dict
+        Brain-cockpit config
+    config_path: str or pathlib.Path
+        Path to brain-cockpit config
+    """
+
+    def __init__(self, config, config_path=None):
+        self.config = config
+        self.features = {
+            dataset_id: FeaturesDataset(
+                dataset_id, dataset, config_path=config_path
+            )
+            for dataset_id, dataset in _get_datasets(config, "features")
+        }
+        self.alignments = {
+            dataset_id: AlignmentsDataset(
+                dataset_id, dataset, config_path=config_path
+            )
+            for dataset_id, dataset in _get_datasets(config, "alignments")
+        }
+
+    def get_server_config(self):
+        """Return config sent to clients.
+
+        It is completed with information about each dataset,
+        and doesn't contain server-side options (``SERVER_OPTIONS``)
+        such as the cache folder or the profiling token.
+        """
+        json_config = copy.deepcopy(self.config)
+        for option in SERVER_OPTIONS:
+            json_config.pop(option, None)
+
+        for kind, datasets in [
+            ("features", self.features),
+            ("alignments", self.alignments),
+        ]:
+            for dataset_id, dataset in datasets.items():
+                json_config[kind]["datasets"][dataset_id].update(
+                    dataset.get_info()
+                )
+
+        return json_config
+
+
+def _get_datasets(config, kind):
+    """Return (id, options) of datasets of a given kind in config."""
+    return ((config.get(kind) or dict()).get("datasets") or dict()).items()
@@ -4,20 +4,133 @@ import os
 import pickle
 from pathlib import Path
 
-import nibabel as nib
 import numpy as np
-import pandas as pd
 from flask import jsonify, request, send_from_directory
 
-from brain_cockpit.scripts.gifti_to_gltf import create_dataset_glft_files
-from brain_cockpit.utils import console, load_dataset_description
+from brain_cockpit import http_caching, utils
+from brain_cockpit.responses import array_response
+from brain_cockpit.scripts.gifti_to_gltf import (
+    create_dataset_glft_files,
+    get_mesh_format,
+)
+from brain_cockpit.transport_plan import ROLES, TransportPlan, top_k
+from brain_cockpit.utils import console, get_progress
+
+# Maximum number of voxels whose maps are returned
+# by a single request to the voxels endpoint
+MAX_TRANSPORTED_VOXELS = 128
+
+
+def get_model_path(dataset_path, model_path):
+    """Return path to an alignment model referenced in a dataset."""
+    model_path = Path(model_path)
+    if not model_path.is_absolute():
+        model_path = Path(dataset_path).parent / model_path
+
+    return model_path
+
+
+def get_converted_model_path(model_path):
+    """Return path of the .npz file converted from a pickled model."""
+    return Path(model_path).with_suffix(".npz")
+
+
+def resolve_model_file(model_path):
+    """Return file from which an alignment model should be loaded.
+
+    Models converted with ``brain-cockpit convert-alignments``
+    are stored next to their pickle in .npz files,
+    which are preferred as long as they are more recent than the pickle.
+    """
+    model_path = Path(model_path)
+    converted_path = get_converted_model_path(model_path)
+    if (
+        model_path.suffix != ".npz"
+        and converted_path.exists()
+        and (
+            not model_path.exists()
+            or converted_path.stat().st_mtime >= model_path.stat().st_mtime
+        )
+    ):
+        return converted_path
+
+    return model_path
+
+
+def load_transport_plan(model_path):
+    """Load transport plan of an alignment model.
+
+    Plans saved in .npz files are memory-mapped,
+    while other files are unpickled, which requires
+    the library used to compute them (such as fugw).
+    """
+    if Path(model_path).suffix == ".npz":
+        return TransportPlan.load(model_path)
+
+    with open(model_path, "rb") as f:
+        model = pickle.load(f)
+
+    return TransportPlan.from_model(model)
+
+
+def get_transport_plan(bc, model_path):
+    """Return transport plan of an alignment model.
+
+    Plans are loaded on first access and held in a cache
+    shared by all alignment datasets, whose size is bounded
+    by ``alignment_models_budget_mb``.
+    """
+    model_path = resolve_model_file(model_path).absolute()
+    return bc.models_cache.get_or_compute(
+        str(model_path), lambda: load_transport_plan(model_path)
+    )
+
+
+def transported_maps_response(maps, k=None):
+    """Serialize maps of transported voxels.
+
+    If ``k`` is None, dense maps are returned.
+    Otherwise, only the indices and weights of the ``k`` vertices
+    with largest weights are returned.
+    """
+    if k is None:
+        return array_response(maps)
+
+    indices, weights = top_k(maps, k)
+    return top_k_response(indices, weights)
+
+
+def top_k_response(indices, weights):
+    """Serialize indices and weights of vertices with largest weights."""
+    if isinstance(indices, list):
+        indices = [i.tolist() for i in indices]
+        weights = [w.tolist() for w in weights]
+    else:
+        indices = indices.tolist()
+        weights = weights.tolist()
+
+    return jsonify({"indices": indices, "weights": weights})
 
 
 def create_endpoints_one_alignment_dataset(bc, id, dataset):
     """Create all API endpoints for exploring a given Alignments dataset."""
-    df, dataset_path = load_dataset_description(
-        config_path=bc.config_path, dataset_path=dataset["path"]
-    )
+    df = bc.datasets.alignments[id].df
+    dataset_path = bc.datasets.alignments[id].path
+
+    mesh_format = get_mesh_format(bc, dataset)
+
+    if utils.get_dataset_option(
+        bc, dataset, "preload_alignment_models", False
+    ):
+        with get_progress(console=console) as progress:
+            task = progress.add_task(
+                f"Preload alignment models of {id}", total=len(df)
+            )
+            for model_path in df["alignment"]:
+                get_transport_plan(
+                    bc, get_model_path(dataset_path, model_path)
+                )
+                progress.update(task, advance=1)
 
     # ROUTES
     # Define endpoints
@@ -27,6 +140,32 @@ def create_endpoints_one_alignment_dataset(bc, id, dataset):
         f"/alignments/{id}/<int:model_id>/mesh/<path:path>"
     )
     align_single_voxel_endpoint = f"/alignments/{id}/single_voxel"
+    align_voxels_endpoint = f"/alignments/{id}/voxels"
+    project_contrast_endpoint = f"/alignments/{id}/project_contrast"
+
+    # Responses of these endpoints only change with the dataset,
+    # so that clients can reuse them as long as its version is unchanged
+    http_caching.register_versioned_endpoints(
+        bc,
+        [
+            alignment_models_endpoint,
+            alignment_model_info_endpoint,
+            align_single_voxel_endpoint,
+        ],
+        http_caching.get_config_version(
+            utils.compute_dataset_version(
+                df,
+                [
+                    resolve_model_file(
+                        get_model_path(dataset_path, model_path)
+                    )
+                    for model_path in df["alignment"]
+                ],
+            ),
+            dataset,
+            mesh_format=mesh_format,
+        ),
+    )
 
     @bc.app.route(
         alignment_models_endpoint,
@@ -45,12 +184,12 @@ def create_endpoints_one_alignment_dataset(bc, id, dataset):
         df_row = df.iloc[model_id].copy()
         df_row["source_mesh"] = str(
             Path(os.path.splitext(df_row["source_mesh"])[0]).with_suffix(
-                ".gltf"
+                f".{mesh_format}"
             )
         )
         df_row["target_mesh"] = str(
             Path(os.path.splitext(df_row["target_mesh"])[0]).with_suffix(
-                ".gltf"
+                f".{mesh_format}"
             )
         )
         # return jsonify(df_row.to_json())
@@ -71,7 +210,11 @@ def create_endpoints_one_alignment_dataset(bc, id, dataset):
         )
         absolute_folder = Path("/") / mesh_path.parent
         if (relative_folder / mesh_path.name).exists():
-            return send_from_directory(relative_folder, mesh_path.name)
+            # Flask resolves relative folders from the package folder,
+            # hence the folder is made absolute
+            return send_from_directory(
+                relative_folder.absolute(), mesh_path.name
+            )
         elif (absolute_folder / mesh_path.name).exists() and bc.config[
             "allow_very_unsafe_file_sharing"
         ]:
@@ -83,64 +226,206 @@ def create_endpoints_one_alignment_dataset(bc, id, dataset):
         methods=["GET"],
     )
     def align_single_voxel():
+        """Transport one voxel onto the mesh given by ``role``.
+
+        If ``top_k`` is set, only the indices and weights
+        of the ``top_k`` vertices with largest weights are returned.
+        """
         model_id = request.args.get("model_id", type=int)
         voxel = request.args.get("voxel", type=int)
         role = request.args.get("role", type=str)
+        k = request.args.get("top_k", default=None, type=int)
 
-        model_path = Path(df.iloc[model_id]["alignment"])
-        if not model_path.is_absolute():
-            model_path = dataset_path.parent / df.iloc[model_id]["alignment"]
-        with open(model_path, "rb") as f:
-            model = pickle.load(f)
-
-        m = None
-        if role == "target":
-            n_voxels = (
-                nib.load(
-                    dataset_path.parent / df.iloc[model_id]["source_mesh"]
-                )
-                .darrays[0]
-                .data.shape[0]
+        if role not in ROLES:
+            return jsonify(error=f"Unknown value for role: {role}"), 400
+        if model_id is None or not 0 <= model_id < len(df):
+            return jsonify(error=f"Unknown model: {model_id}"), 400
+        if k is not None and k <= 0:
+            return jsonify(error="top_k should be a positive integer"), 400
+
+        plan = get_transport_plan(
+            bc, get_model_path(dataset_path, df.iloc[model_id]["alignment"])
+        )
+        n_voxels = plan.get_n_vertices(
+            "source" if role == "target" else "target"
+        )
+        if voxel is None or not 0 <= voxel < n_voxels:
+            return jsonify(error="Indices out of range"), 400
+
+        if k is not None:
+            indices, weights = plan.transport_top_k([voxel], k, onto=role)
+            return top_k_response(indices[0], weights[0])
+
+        m = plan.transport([voxel], onto=role)[0]
+
+        return transported_maps_response(m)
+
+    @bc.app.route(
+        align_voxels_endpoint,
+        endpoint=align_voxels_endpoint,
+        methods=["POST"],
+    )
+    def align_voxels():
+        """Transport many voxels at once onto the mesh given by ``role``.
+
+        The JSON body of the request should contain ``model_id``,
+        ``role``, and either ``voxel_indices`` or ``roi_mask``,
+        a list of booleans of the same length as the mesh
+        from which voxels are transported.
+        If ``roi_mean`` is true, maps of all voxels are averaged.
+        Otherwise, at most ``MAX_TRANSPORTED_VOXELS`` voxels
+        can be transported at once.
+        If ``top_k`` is set, only the indices and weights
+        of the ``top_k`` vertices with largest weights are returned.
+        """
+        body = request.get_json(silent=True) or dict()
+        model_id = body.get("model_id", 0)
+        role = body.get("role", "target")
+        roi_mean = bool(body.get("roi_mean", False))
+        k = body.get("top_k", None)
+
+        if role not in ROLES:
+            return jsonify(error=f"Unknown value for role: {role}"), 400
+        if not isinstance(model_id, int) or not 0 <= model_id < len(df):
+            return jsonify(error=f"Unknown model: {model_id}"), 400
+        if k is not None and (not isinstance(k, int) or k <= 0):
+            return jsonify(error="top_k should be a positive integer"), 400
+
+        if "voxel_indices" in body:
+            voxel_indices = body["voxel_indices"]
+        elif "roi_mask" in body:
+            voxel_indices = np.flatnonzero(np.asarray(body["roi_mask"]))
+        else:
+            return jsonify(error="Missing voxel_indices or roi_mask"), 400
+
+        plan = get_transport_plan(
+            bc, get_model_path(dataset_path, df.iloc[model_id]["alignment"])
+        )
+        n_voxels = plan.get_n_vertices(
+            "source" if role == "target" else "target"
+        )
+        try:
+            voxel_indices = np.asarray(voxel_indices, dtype=np.int64)
+        except (TypeError, ValueError):
+            return jsonify(error="Indices should be lists of integers"), 400
+        if voxel_indices.ndim != 1 or np.any(
+            (voxel_indices < 0) | (voxel_indices >= n_voxels)
+        ):
+            return jsonify(error="Indices out of range"), 400
+
+        if roi_mean:
+            m = plan.transport_mean(voxel_indices, onto=role)
+            return transported_maps_response(m, k)
+
+        if len(voxel_indices) > MAX_TRANSPORTED_VOXELS:
+            return (
+                jsonify(
+                    error=(
+                        f"At most {MAX_TRANSPORTED_VOXELS} voxels "
+                        "can be transported at once"
+                    )
+                ),
+                400,
             )
-            input_map = np.zeros(n_voxels)
-            input_map[voxel] = 1
-
-            m = model.transform(input_map)
-        elif role == "source":
-            n_voxels = (
-                nib.load(
-                    dataset_path.parent / df.iloc[model_id]["target_mesh"]
-                )
-                .darrays[0]
-                .data.shape[0]
+
+        if k is not None:
+            indices, weights = plan.transport_top_k(
+                voxel_indices, k, onto=role
             )
-            input_map = np.zeros(n_voxels)
-            input_map[voxel] = 1
+            return top_k_response(indices, weights)
 
-            m = model.inverse_transform(input_map)
+        return transported_maps_response(
+            plan.transport(voxel_indices, onto=role)
+        )
+
+    @bc.app.route(
+        project_contrast_endpoint,
+        endpoint=project_contrast_endpoint,
+        methods=["GET"],
+    )
+    def project_contrast():
+        """Transport a contrast map of a features dataset.
 
-        return jsonify(m.tolist() if m is not None else None)
+        The map of ``contrast_index`` for ``subject_index``
+        in features dataset ``dataset`` is transported
+        onto the mesh given by ``role``. If ``contrast_index``
+        is omitted, maps of all contrasts of the subject are returned.
+        """
+        model_id = request.args.get("model_id", type=int)
+        dataset_id = request.args.get("dataset", type=str)
+        subject_index = request.args.get("subject_index", type=int)
+        contrast_index = request.args.get(
+            "contrast_index", default=None, type=int
+        )
+        mesh = request.args.get("mesh", default="fsaverage5", type=str)
+        hemi = request.args.get("hemi", default="left", type=str)
+        role = request.args.get("role", default="target", type=str)
+
+        if role not in ROLES:
+            return jsonify(error=f"Unknown value for role: {role}"), 400
+        if model_id is None or not 0 <= model_id < len(df):
+            return jsonify(error=f"Unknown model: {model_id}"), 400
+        if dataset_id not in bc.features_stores:
+            return jsonify(error=f"Unknown dataset: {dataset_id}"), 400
+
+        store = bc.features_stores[dataset_id]
+        if subject_index is None or not (
+            0 <= subject_index < store.n_subjects
+        ):
+            return jsonify(error=f"Unknown subject: {subject_index}"), 400
+        if contrast_index is not None and not (
+            0 <= contrast_index < store.n_contrasts
+        ):
+            return jsonify(error=f"Unknown contrast: {contrast_index}"), 400
+
+        model_path = get_model_path(
+            dataset_path, df.iloc[model_id]["alignment"]
+        )
+        plan = get_transport_plan(bc, model_path)
+        n_vertices = store.get_n_vertices(mesh, hemi, subject_index)
+        if n_vertices != plan.get_n_vertices(
+            "source" if role == "target" else "target"
+        ):
+            return (
+                jsonify(error="Maps and alignment model have different sizes"),
+                400,
+            )
+
+        # All contrasts of the subject are transported at once,
+        # and held in the cache of maps
+        maps = bc.maps_cache.get_or_compute(
+            (
+                "projection",
+                str(Path(model_path).absolute()),
+                dataset_id,
+                mesh,
+                hemi,
+                subject_index,
+                role,
+            ),
+            lambda: plan.transport_maps(
+                store.get_subject_maps(mesh, hemi, subject_index),
+                onto=role,
+            ).astype(np.float32),
+        )
+
+        return array_response(
+            maps if contrast_index is None else maps[contrast_index]
+        )
 
 
 def create_all_endpoints(bc):
     """Create endpoints for all available Alignments datasets."""
-    if "alignments" in bc.config and "datasets" in bc.config["alignments"]:
+    if len(bc.datasets.alignments) > 0:
         # Iterate through each alignment dataset
-        for dataset_id, dataset in bc.config["alignments"]["datasets"].items():
-            df, _ = load_dataset_description(
-                config_path=bc.config_path, dataset_path=dataset["path"]
-            )
+        for dataset_id, dataset in bc.datasets.alignments.items():
             # 1. Create GLTF files for all referenced meshes of the dataset
-            mesh_paths = list(
-                map(
-                    Path,
-                    np.unique(
-                        pd.concat([df["source_mesh"], df["target_mesh"]])
-                    ),
-                )
+            create_dataset_glft_files(
+                bc, dataset.config, dataset.get_mesh_paths()
             )
-            create_dataset_glft_files(bc, dataset, mesh_paths)
             # 2. Create API endpoints
-            create_endpoints_one_alignment_dataset(bc, dataset_id, dataset)
+            create_endpoints_one_alignment_dataset(
+                bc, dataset_id, dataset.config
+            )
     else:
         console.log("No alignment datasets to load", style="yellow")
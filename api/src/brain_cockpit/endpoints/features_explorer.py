@@ -1,7 +1,9 @@
 """Util functions to create Features Explorer endpoints."""
 
+import hashlib
 import json
 import os
+import time
 from pathlib import Path
 
 import nibabel as nib
@@ -9,9 +11,27 @@ import numpy as np
 import pandas as pd
 from flask import jsonify, request, send_from_directory
 
-from brain_cockpit import utils
-from brain_cockpit.scripts.gifti_to_gltf import create_dataset_glft_files
-from brain_cockpit.utils import console, load_dataset_description
+from brain_cockpit import http_caching, utils
+from brain_cockpit.features_store import (
+    FEATURES_STORE_VERSION,
+    STATISTICS,
+    BaseFeaturesStore,
+    FeaturesStore,
+    LazyFeaturesStore,
+)
+from brain_cockpit.responses import array_response
+from brain_cockpit.scripts.gifti_to_gltf import (
+    create_dataset_glft_files,
+    get_mesh_format,
+)
+from brain_cockpit.utils import console
+
+# Subfolder of the cache of decoded maps in which
+# each config records the maps it references
+MAPS_OWNERS_FOLDER = "owners"
+# Age (in seconds) beyond which temporary files of the cache
+# are assumed to be left by interrupted writes
+MAX_TMP_FILE_AGE = 3600
 
 # UTIL FUNCTIONS
 # These functions are useful for loading data
@@ -35,20 +55,6 @@ def side_to_hemi(hemi):
     return None
 
 
-def multiindex_to_nested_dict(df):
-    """Transform DataFrame with multiple indices to python dict."""
-    if isinstance(df.index, pd.core.indexes.multi.MultiIndex):
-        return dict(
-            (k, multiindex_to_nested_dict(df.loc[k]))
-            for k in df.index.remove_unused_levels().levels[0]
-        )
-    else:
-        d = dict()
-        for idx in df.index:
-            d[idx] = df.loc[idx, "path"]
-        return d
-
-
 def parse_metadata(df):
     """Parse metadata Dataframe.
 
@@ -83,6 +89,556 @@ def parse_metadata(df):
     return meshes, subjects, tasks_contrasts, sides
 
 
+def resolve_map_paths(paths, config_path=None, dataset_path=None):
+    """Return paths to map files referenced in a dataset CSV file.
+
+    Parameters
+    ----------
+    paths: iterable of str
+        Paths as written in the dataset CSV file
+
+    Returns
+    -------
+    resolved_paths: list of str
+    """
+    dataset_dir = Path(dataset_path).parent
+
+    # Successively try
+    # 1. absolute path to file
+    # 2. relative path from dataset folder
+    # 3. relative path from config folder
+    if dataset_dir.is_absolute():
+        base_dir = str(dataset_dir)
+    else:
+        base_dir = str(Path(config_path).parent / dataset_dir)
+
+    paths = pd.Series(paths, dtype=str)
+    return (
+        paths.where(
+            paths.str.startswith(os.sep),
+            base_dir + os.sep + paths,
+        )
+        .astype(object)
+        .tolist()
+    )
+
+
+def exist(paths):
+    """Check which files exist, listing each folder only once.
+
+    Files listed with their exact name in their folder exist,
+    unless they are symbolic links. Whether other paths exist
+    (such as symbolic links, which might be broken, or files
+    named with a different case on case-insensitive filesystems)
+    is checked individually.
+
+    Returns
+    -------
+    exists: np.ndarray of bool
+    """
+    paths = pd.Series(paths, dtype=str)
+    parts = paths.str.rpartition(os.sep)
+    folders, names = parts[0].tolist(), parts[2].tolist()
+
+    folder_contents = dict()
+    for folder in set(folders):
+        try:
+            with os.scandir(folder or os.curdir) as entries:
+                folder_contents[folder] = {
+                    entry.name for entry in entries if not entry.is_symlink()
+                }
+        except OSError:
+            folder_contents[folder] = set()
+
+    return np.fromiter(
+        (
+            name in folder_contents[folder] or os.path.exists(path)
+            for folder, name, path in zip(folders, names, paths.tolist())
+        ),
+        dtype=bool,
+        count=len(names),
+    )
+
+
+def get_dataset_cache_key(df, config_path=None, dataset_path=None):
+    """Compute a key identifying the content of a Features dataset.
+
+    The key changes whenever the dataset description changes,
+    or whenever one of the referenced map files is modified.
+    """
+    return utils.compute_dataset_version(
+        df,
+        resolve_map_paths(
+            df["path"], config_path=config_path, dataset_path=dataset_path
+        ),
+        salt=FEATURES_STORE_VERSION,
+    )
+
+
+def load_map(file_path):
+    """Load values of a gifti map as a float32 array."""
+    return np.asarray(nib.load(file_path).darrays[0].data, dtype=np.float32)
+
+
+def get_cached_map_path(file_path, maps_cache_folder):
+    """Return path at which decoded values of a map file are cached.
+
+    Cached values are identified by the resolved path, size
+    and modification time of the map file, so that they are
+    not used anymore once the file is modified.
+    """
+    stat = os.stat(file_path)
+    key = (
+        f"{FEATURES_STORE_VERSION}:{Path(file_path).resolve()}:"
+        f"{stat.st_size}:{stat.st_mtime_ns}"
+    )
+
+    return (
+        Path(maps_cache_folder)
+        / f"{hashlib.sha1(key.encode()).hexdigest()}.npy"
+    )
+
+
+def load_cached_map(job):
+    """Load values of a gifti map, using on-disk cache if available.
+
+    Parameters
+    ----------
+    job: (file_path, maps_cache_folder)
+        Path to the map file, and folder in which decoded maps
+        are cached. Maps are decoded without cache
+        if ``maps_cache_folder`` is None.
+    """
+    file_path, maps_cache_folder = job
+    if maps_cache_folder is None:
+        return load_map(file_path)
+
+    cache_path = get_cached_map_path(file_path, maps_cache_folder)
+    try:
+        return np.load(cache_path)
+    except (OSError, ValueError):
+        pass
+
+    values = load_map(file_path)
+
+    # Write to a temporary file first so that other processes
+    # never read partially written maps
+    tmp_path = cache_path.with_name(f"{cache_path.stem}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, values)
+    os.replace(tmp_path, cache_path)
+
+    return values
+
+
+def prune_cached_maps(maps_cache_folder, file_paths, owner):
+    """Remove decoded maps which ``owner`` doesn't use anymore.
+
+    Entries become stale when their map file is modified or removed.
+    Since several configs can share the same cache folder,
+    each of them (identified by ``owner``) records the entries
+    it references in ``owners/<owner>.json``. Entries which ``owner``
+    referenced previously but not anymore are removed,
+    unless another owner references them.
+    Temporary files left by interrupted writes are removed as well.
+
+    Returns
+    -------
+    n_removed: int
+        Number of removed entries
+    """
+    maps_cache_folder = Path(maps_cache_folder)
+    owners_folder = maps_cache_folder / MAPS_OWNERS_FOLDER
+    owners_folder.mkdir(parents=True, exist_ok=True)
+
+    referenced = set()
+    for file_path in file_paths:
+        try:
+            referenced.add(
+                get_cached_map_path(file_path, maps_cache_folder).name
+            )
+        except OSError:
+            pass
+
+    owned = set()
+    referenced_by_others = set()
+    for owner_path in owners_folder.glob("*.json"):
+        try:
+            with open(owner_path, "r") as f:
+                names = set(json.load(f))
+        except (OSError, ValueError):
+            continue
+        if owner_path.stem == owner:
+            owned = names
+        else:
+            referenced_by_others |= names
+
+    # Record referenced entries before removing others,
+    # so that an interrupted pruning is resumed later
+    owner_path = owners_folder / f"{owner}.json"
+    tmp_path = owner_path.with_name(f"{owner}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(sorted(referenced), f)
+    os.replace(tmp_path, owner_path)
+
+    n_removed = 0
+    for name in owned - referenced - referenced_by_others:
+        try:
+            (maps_cache_folder / name).unlink()
+            n_removed += 1
+        except OSError:
+            pass
+
+    # Temporary files which are still being written are recent
+    for tmp_path in [
+        *maps_cache_folder.glob("*.tmp"),
+        *owners_folder.glob("*.tmp"),
+    ]:
+        try:
+            if time.time() - tmp_path.stat().st_mtime > MAX_TMP_FILE_AGE:
+                tmp_path.unlink()
+        except OSError:
+            pass
+
+    return n_removed
+
+
+def prune_maps_cache(bc):
+    """Remove decoded maps of files not referenced by any dataset anymore.
+
+    Maps of lazy datasets are not cached on disk,
+    hence only files of other datasets are referenced.
+    Entries are owned by the config of ``bc``,
+    identified by its resolved path.
+    """
+    cache_folder = utils.get_cache_folder(bc)
+    if cache_folder is None or not (cache_folder / "maps").exists():
+        return
+
+    file_paths = []
+    for dataset in bc.datasets.features.values():
+        if not utils.get_dataset_option(
+            bc, dataset.config, "lazy_loading", False
+        ):
+            file_paths.extend(
+                list_map_files(
+                    dataset.df,
+                    config_path=bc.config_path,
+                    dataset_path=dataset.config["path"],
+                )[1]
+            )
+
+    owner = hashlib.sha1(
+        str(Path(bc.config_path).resolve()).encode()
+    ).hexdigest()[:16]
+    n_removed = prune_cached_maps(cache_folder / "maps", file_paths, owner)
+    if n_removed > 0:
+        console.log(f"Removed {n_removed} stale maps from cache")
+
+
+def list_map_files(df, config_path=None, dataset_path=None):
+    """List existing map files of a Features dataset.
+
+    Returns
+    -------
+    locations: list of (mesh, hemi, subject_index, contrast_index)
+        Location of each file in a ``FeaturesStore``
+    file_paths: list of pathlib.Path
+        Path to each file
+    """
+    meshes, subjects, tasks_contrasts, _ = parse_metadata(df)
+
+    # Keep the first file of each map, and turn labels
+    # into integer coordinates in a FeaturesStore.
+    # Rows with missing labels (such as NaN contrasts) are dropped
+    index = (
+        df[df["side"].isin(["lh", "rh"])]
+        .dropna(subset=["mesh", "subject", "task", "contrast"])
+        .drop_duplicates(["mesh", "subject", "task", "contrast", "side"])
+    )
+    index = pd.DataFrame(
+        {
+            "mesh": pd.Index(meshes).get_indexer(index["mesh"]),
+            "subject_index": pd.Index(subjects).get_indexer(index["subject"]),
+            "contrast_index": (
+                pd.MultiIndex.from_tuples(
+                    list(map(tuple, tasks_contrasts))
+                ).get_indexer(
+                    pd.MultiIndex.from_frame(index[["task", "contrast"]])
+                )
+            ),
+            "side": index["side"].to_numpy(),
+            "path": resolve_map_paths(
+                index["path"],
+                config_path=config_path,
+                dataset_path=dataset_path,
+            ),
+        }
+    )
+    # Labels which are not found get a negative index,
+    # which would otherwise wrap around to the last subject or contrast
+    index = index[
+        (index["mesh"] >= 0)
+        & (index["subject_index"] >= 0)
+        & (index["contrast_index"] >= 0)
+    ]
+    index = index[exist(index["path"].tolist())].sort_values(
+        ["mesh", "subject_index", "contrast_index", "side"]
+    )
+
+    locations = list(
+        zip(
+            np.asarray(meshes, dtype=object)[index["mesh"].to_numpy()],
+            index["side"].map(side_to_hemi),
+            index["subject_index"].tolist(),
+            index["contrast_index"].tolist(),
+        )
+    )
+    file_paths = list(map(Path, index["path"]))
+
+    return locations, file_paths
+
+
+def load_data(
+    df,
+    config_path=None,
+    dataset_path=None,
+    n_workers=1,
+    maps_cache_folder=None,
+):
+    """Load data used in endpoints.
+
+    Parameters
+    ----------
+    dataset_path: str
+        Path to csv file containing dataset information.
+        Each row contains information about
+        an available gifti image one will load here
+    n_workers: int
+        Number of processes used to decode gifti files
+    maps_cache_folder: str or pathlib.Path or None
+        Folder in which decoded maps are cached, so that
+        only new or modified gifti files are decoded
+        when the dataset changes
+
+    Returns
+    -------
+    store: FeaturesStore
+        Dense storage of all maps of the dataset,
+        in which missing (subject, task, contrast, side) tuples
+        are flagged as such
+    """
+    meshes, subjects, tasks_contrasts, _ = parse_metadata(df)
+    locations, file_paths = list_map_files(
+        df, config_path=config_path, dataset_path=dataset_path
+    )
+    if maps_cache_folder is not None:
+        Path(maps_cache_folder).mkdir(parents=True, exist_ok=True)
+
+    store = FeaturesStore(subjects, tasks_contrasts)
+
+    # Decode gifti files (possibly in parallel)
+    # and stream them into the store
+    with utils.get_progress(console=console) as progress:
+        task_mesh = {
+            mesh: progress.add_task(
+                f"Load maps ({mesh})",
+                total=sum(location[0] == mesh for location in locations),
+            )
+            for mesh in meshes
+        }
+        for location, values in zip(
+            locations,
+            utils.parallel_map(
+                load_cached_map,
+                [(file_path, maps_cache_folder) for file_path in file_paths],
+                n_workers=n_workers,
+            ),
+        ):
+            store.set_map(*location, values)
+            progress.update(task_mesh[location[0]], advance=1)
+
+    store.compute_aggregates()
+
+    return store
+
+
+def create_lazy_store(
+    df,
+    cache,
+    config_path=None,
+    dataset_path=None,
+    cache_prefix=None,
+    n_workers=1,
+    store_folder=None,
+    key=None,
+):
+    """Create store decoding maps of a Features dataset on first access.
+
+    Statistics of maps across subjects are computed when the store
+    is created, which requires decoding all maps once.
+    If ``store_folder`` is set, they are saved in this folder,
+    and later memory-mapped as long as ``key`` is left unchanged.
+
+    Returns
+    -------
+    store: LazyFeaturesStore
+        Store holding decoded maps in ``cache``
+    """
+    _, subjects, tasks_contrasts, _ = parse_metadata(df)
+    locations, file_paths = list_map_files(
+        df, config_path=config_path, dataset_path=dataset_path
+    )
+
+    store = LazyFeaturesStore(
+        subjects,
+        tasks_contrasts,
+        cache=cache,
+        load_map=load_map,
+        cache_prefix=cache_prefix,
+    )
+    for location, file_path in zip(locations, file_paths):
+        store.set_path(*location, file_path)
+
+    saved_store = (
+        BaseFeaturesStore.open(store_folder, key=key)
+        if store_folder is not None
+        else None
+    )
+    if saved_store is not None:
+        console.log(f"Using cache {store_folder}")
+        store.n_vertices = saved_store.n_vertices
+        store.aggregates = saved_store.aggregates
+        return store
+
+    store.compute_aggregates(n_workers=n_workers)
+    if store_folder is not None:
+        store.save(store_folder, key=key)
+
+    return store
+
+
+def get_store_folder(
+    cache_folder, dataset_id, dataset_path, config_path=None, lazy=False
+):
+    """Return folder in which the store of a Features dataset is saved.
+
+    Folders are named after the dataset id and a hash
+    of the resolved path to the dataset description,
+    so that configs sharing a cache folder don't overwrite
+    stores of different datasets with the same id.
+    Only statistics of maps are saved for lazy datasets,
+    in a separate folder.
+    """
+    dataset_path = Path(dataset_path)
+    if not dataset_path.is_absolute() and config_path is not None:
+        dataset_path = Path(config_path).parent / dataset_path
+    path_hash = hashlib.sha1(str(dataset_path.resolve()).encode()).hexdigest()[
+        :16
+    ]
+
+    return (
+        Path(cache_folder)
+        / ("features_aggregates" if lazy else "features_datasets")
+        / f"{dataset_id}-{path_hash}"
+    )
+
+
+def load_store(
+    bc,
+    dataset_id,
+    df,
+    dataset_path,
+    lazy=False,
+    vertex_major=False,
+    key=None,
+):
+    """Load Features dataset, using on-disk cache when available.
+
+    If ``cache_folder`` is set in the config, maps are saved
+    in this folder once loaded, and later memory-mapped
+    as long as the dataset is left unchanged.
+    Decoded maps of each file are cached as well,
+    so that only new or modified files are decoded
+    when the dataset changes.
+    If ``lazy`` is True, maps are instead decoded on first access
+    and held in the cache shared by all lazy datasets,
+    and only their statistics across subjects are saved.
+    If ``vertex_major`` is True, vertex-major copies of maps
+    are built (and cached) to speed up fingerprint queries.
+    ``key`` identifies the content of the dataset,
+    and is computed with ``get_dataset_cache_key`` if None.
+    """
+    cache_folder = utils.get_cache_folder(bc)
+    if key is None and cache_folder is not None:
+        key = get_dataset_cache_key(
+            df, config_path=bc.config_path, dataset_path=dataset_path
+        )
+
+    if lazy:
+        console.log(f"Maps of dataset {dataset_id} will be loaded lazily")
+        return create_lazy_store(
+            df,
+            bc.maps_cache,
+            config_path=bc.config_path,
+            dataset_path=dataset_path,
+            cache_prefix=dataset_id,
+            n_workers=utils.get_n_workers(bc),
+            store_folder=(
+                get_store_folder(
+                    cache_folder,
+                    dataset_id,
+                    dataset_path,
+                    config_path=bc.config_path,
+                    lazy=True,
+                )
+                if cache_folder is not None
+                else None
+            ),
+            key=key,
+        )
+
+    if cache_folder is None:
+        console.log("Not using cache for dataset")
+        store = load_data(
+            df,
+            config_path=bc.config_path,
+            dataset_path=dataset_path,
+            n_workers=utils.get_n_workers(bc),
+        )
+        if vertex_major:
+            store.compute_vertex_major()
+        return store
+
+    store_folder = get_store_folder(
+        cache_folder, dataset_id, dataset_path, config_path=bc.config_path
+    )
+    store = FeaturesStore.open(store_folder, key=key)
+    if store is not None and (store.has_vertex_major or not vertex_major):
+        console.log(f"Using cache {store_folder}")
+        return store
+
+    if store is None:
+        console.log(f"Building cache {store_folder}")
+        store = load_data(
+            df,
+            config_path=bc.config_path,
+            dataset_path=dataset_path,
+            n_workers=utils.get_n_workers(bc),
+            maps_cache_folder=cache_folder / "maps",
+        )
+    else:
+        console.log(f"Adding vertex-major maps to cache {store_folder}")
+
+    if vertex_major:
+        store.compute_vertex_major()
+    store.save(store_folder, key=key)
+
+    # Reopen saved arrays so that they are memory-mapped
+    # rather than held in process memory
+    return FeaturesStore.open(store_folder, key=key)
+
+
 # MAIN FUNCTION
 # This function is meant to be called from other files.
 # It loads fmri contrasts and exposes flask endpoints.
@@ -90,104 +646,53 @@ def parse_metadata(df):
 
 def create_endpoints_one_features_dataset(bc, id, dataset):
     """Create all API endpoints for exploring a given Features dataset."""
-
-    @utils.bc_cache(bc)
-    def load_data(df, config_path=None, dataset_path=None):
-        """Load data used in endpoints.
-
-        Parameters
-        ----------
-        dataset_path: str
-            Path to csv file containing dataset information.
-            Each row contains information about
-            an available gifti image one will load here
-
-        Returns
-        -------
-        data: dict
-            Dictionary d such that
-            ``d[mesh][subject][task][contrast][side]`` is
-            either a numpy array or None
-        """
-        meshes, subjects, tasks_contrasts, _ = parse_metadata(df)
-
-        # Group rows before turning the dataframe into a python dict d
-        # such that d[mesh][subject][task][contrast][side]
-        # is the path to a gifti file describing this data
-        df_grouped = df.groupby(
-            ["mesh", "subject", "task", "contrast", "side"]
-        )["path"].first()
-        paths = multiindex_to_nested_dict(df_grouped.to_frame())
-
-        config_dir = Path(config_path).parent
-        dataset_dir = Path(dataset_path).parent
-
-        # Load gifti files
-        # and populate missing (mesh, subject, task, contrast, side) tuples
-        # with None
-        data = dict()
-        with utils.get_progress(console=console) as progress:
-            task_mesh = progress.add_task(
-                "Load maps for each mesh support", total=len(meshes)
-            )
-            for mesh in meshes:
-                dsu = dict()
-                task_subject = progress.add_task(
-                    f"Load maps for each subject ({mesh})", total=len(subjects)
-                )
-                for subject in subjects:
-                    dtc = dict()
-                    for task, contrast in tasks_contrasts:
-                        dsi = dict()
-                        for side in ["lh", "rh"]:
-                            hemi = "left" if side == "lh" else "right"
-                            try:
-                                file_path = None
-
-                                # Successively try
-                                # 1. absolute path to file
-                                # 2. relative path from dataset folder
-                                # 3. relative path from config folder
-                                p = Path(
-                                    paths[mesh][subject][task][contrast][side]
-                                )
-                                if p.is_absolute():
-                                    file_path = p
-                                elif dataset_dir.is_absolute():
-                                    file_path = dataset_dir / p
-                                else:
-                                    file_path = config_dir / dataset_dir / p
-
-                                if (
-                                    file_path is not None
-                                    and file_path.exists()
-                                ):
-                                    dsi[hemi] = (
-                                        # nib.load(file_path).darrays[0].data
-                                        nib.load(file_path)
-                                    )
-                                else:
-                                    dsi[hemi] = None
-                            except KeyError:
-                                dsi[hemi] = None
-                        if task not in dtc:
-                            dtc[task] = dict()
-                        dtc[task][contrast] = dsi
-                    dsu[subject] = dtc
-                    progress.update(task_subject, advance=1)
-
-                data[mesh] = dsu
-                progress.update(task_mesh, advance=1)
-
-        return data
-
-    df, _ = load_dataset_description(
-        config_path=bc.config_path, dataset_path=dataset["path"]
-    )
-    data = load_data(
+    df = bc.datasets.features[id].df
+    version = get_dataset_cache_key(
         df, config_path=bc.config_path, dataset_path=dataset["path"]
     )
-    meshes, subjects, tasks_contrasts, sides = parse_metadata(df)
+    store = load_store(
+        bc,
+        id,
+        df,
+        dataset["path"],
+        lazy=utils.get_dataset_option(bc, dataset, "lazy_loading", False),
+        vertex_major=utils.get_dataset_option(
+            bc, dataset, "vertex_major", False
+        ),
+        key=version,
+    )
+    # Maps of this dataset can be projected through alignment models
+    bc.features_stores[id] = store
+    meshes = bc.datasets.features[id].meshes
+    subjects = bc.datasets.features[id].subjects
+    tasks_contrasts = bc.datasets.features[id].tasks_contrasts
+    sides = bc.datasets.features[id].sides
+    mesh_format = get_mesh_format(bc, dataset)
+
+    # Precompute urls of meshes of each subject
+    mesh_types = dataset.get("mesh_types", dict())
+    has_mesh_types = "default" in mesh_types and "other" in mesh_types
+    mesh_urls = dict()
+    for (subject, mesh, side), mesh_path in bc.datasets.features[
+        id
+    ].mesh_paths.items():
+        mesh_path = Path(mesh_path)
+        mesh_basename = os.path.splitext(mesh_path.name)[0]
+        mesh_path = mesh_path.parent / Path(mesh_basename).with_suffix(
+            f".{mesh_format}"
+        )
+        key = (subjects.index(subject), mesh, side_to_hemi(side))
+
+        if has_mesh_types:
+            for mesh_type in [mesh_types["default"], *mesh_types["other"]]:
+                mesh_urls[(*key, mesh_type)] = str(
+                    mesh_path.parent
+                    / str(mesh_path.name).replace(
+                        mesh_types["default"], mesh_type
+                    )
+                )
+        else:
+            mesh_urls[(*key, None)] = str(mesh_path)
 
     # ROUTES
     # Define a series of endpoints to expose contrasts, meshes, etc
@@ -199,9 +704,29 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
     meshes_endpoint = f"/datasets/{id}/mesh/<path:path>"
     fingerprint_endpoint = f"/datasets/{id}/voxel_fingerprint"
     fingerprint_mean_endpoint = f"/datasets/{id}/voxel_fingerprint_mean"
+    fingerprints_endpoint = f"/datasets/{id}/voxel_fingerprints"
     contrast_endpoint = f"/datasets/{id}/contrast"
     contrast_mean_endpoint = f"/datasets/{id}/contrast_mean"
 
+    # Responses of these endpoints only change with the dataset,
+    # so that clients can reuse them as long as its version is unchanged
+    http_caching.register_versioned_endpoints(
+        bc,
+        [
+            info_endpoint,
+            subjects_endpoint,
+            contrasts_endpoint,
+            surface_map_mesh_url_endpoint,
+            fingerprint_endpoint,
+            fingerprint_mean_endpoint,
+            contrast_endpoint,
+            contrast_mean_endpoint,
+        ],
+        http_caching.get_config_version(
+            version, dataset, mesh_format=mesh_format
+        ),
+    )
+
     @bc.app.route(info_endpoint, endpoint=info_endpoint, methods=["GET"])
     def get_info():
         dataset_info = {
@@ -257,25 +782,19 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
         mesh_type = request.args.get("meshType", type=str)
         hemi = request.args.get("hemi", type=str)
 
-        df_mesh_paths = df[
-            (df["subject"] == subjects[subject_id])
-            & (df["mesh"] == mesh_support)
-            & (df["side"] == hemi_to_side(hemi))
-        ]["mesh_path"].unique()
-        df_mesh_path_original = Path(df_mesh_paths[0])
-        df_mesh_basename = os.path.splitext(df_mesh_path_original.name)[0]
-        df_mesh_path = df_mesh_path_original.parent / Path(
-            df_mesh_basename
-        ).with_suffix(".gltf")
-
-        if "mesh_types" in dataset:
-            mesh_types = dataset["mesh_types"]
-            if "default" in mesh_types and "other" in mesh_types:
-                df_mesh_path = df_mesh_path.parent / str(
-                    df_mesh_path.name
-                ).replace(mesh_types["default"], mesh_type)
-
-        return jsonify(str(df_mesh_path))
+        url = mesh_urls.get(
+            (
+                subject_id,
+                mesh_support,
+                hemi,
+                mesh_type if has_mesh_types else None,
+            ),
+            None,
+        )
+        if url is None:
+            return jsonify(error="Unknown mesh"), 404
+
+        return jsonify(url)
 
     @bc.app.route(meshes_endpoint, endpoint=meshes_endpoint, methods=["GET"])
     def get_mesh(path):
@@ -287,7 +806,11 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
         )
         absolute_folder = Path("/") / mesh_path.parent
         if (relative_folder / mesh_path.name).exists():
-            return send_from_directory(relative_folder, mesh_path.name)
+            # Flask resolves relative folders from the package folder,
+            # hence the folder is made absolute
+            return send_from_directory(
+                relative_folder.absolute(), mesh_path.name
+            )
         elif (absolute_folder / mesh_path.name).exists() and bc.config[
             "allow_very_unsafe_file_sharing"
         ]:
@@ -302,46 +825,17 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
         voxel_index = request.args.get("voxel_index", type=int)
         hemi = request.args.get("hemi", type=str)
 
-        subject = subjects[subject_index]
-
         # Deduce hemi from voxel index when both hemispheres are displayed
         if hemi == "both":
-            d_query = df[
-                (df["mesh"] == mesh)
-                & (df["subject"] == subject)
-                & (df["side"] == "lh")
-            ]
-            if len(d_query) > 0:
-                d_row = d_query.iloc[0]
-                n_voxels_left_hemi = data[mesh][subject][d_row["task"]][
-                    d_row["contrast"]
-                ]["left"].shape[0]
-                if voxel_index >= n_voxels_left_hemi:
-                    voxel_index -= n_voxels_left_hemi
-                    hemi = "right"
-                else:
-                    hemi = "left"
-            else:
-                return jsonify(None)
-
-        # Convert fingerprint to np array
-        # so that it can easily be jsonified
-        fingerprint = np.array(
-            [
-                (
-                    data[mesh][subject][task][contrast][hemi]
-                    .darrays[0]
-                    .data[voxel_index]
-                    if data[mesh][subject][task][contrast][hemi] is not None
-                    else None
-                )
-                for task, contrast in tasks_contrasts
-            ],
-            # Force float32 to avoid json serialization error
-            dtype=np.float32,
-        )
+            hemi, voxel_index = store.split_voxel_index(
+                mesh, voxel_index, subject_index=subject_index
+            )
+            if hemi is None:
+                return array_response(None)
 
-        return jsonify(fingerprint)
+        return array_response(
+            store.get_fingerprint(mesh, hemi, subject_index, voxel_index)
+        )
 
     @bc.app.route(
         fingerprint_mean_endpoint,
@@ -352,6 +846,11 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
         mesh = request.args.get("mesh", type=str, default="fsaverage5")
         voxel_index = request.args.get("voxel_index", type=int)
         hemi = request.args.get("hemi", type=str)
+        statistic = request.args.get("statistic", default="mean", type=str)
+
+        if statistic not in STATISTICS:
+            console.log(f"Unknown statistic: {statistic}", style="red")
+            return jsonify([])
 
         # Can't return mean of meshes which are not comparable
         if mesh == "individual":
@@ -359,47 +858,78 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
         else:
             # Deduce hemi from voxel index when both hemispheres are displayed
             if hemi == "both":
-                d_query = df[(df["mesh"] == mesh) & (df["side"] == "lh")]
-                if len(d_query) > 0:
-                    d_row = d_query.iloc[0]
-                    n_voxels_left_hemi = data[mesh][d_row["subject"]][
-                        d_row["task"]
-                    ][d_row["contrast"]]["left"].shape[0]
-                    if voxel_index >= n_voxels_left_hemi:
-                        voxel_index -= n_voxels_left_hemi
-                        hemi = "right"
-                    else:
-                        hemi = "left"
-                else:
-                    return jsonify(None)
-
-            mean = np.nanmean(
-                np.vstack(
-                    [
-                        np.array(
-                            [
-                                (
-                                    data[mesh][subject][task][contrast][hemi]
-                                    .darrays[0]
-                                    .data[voxel_index]
-                                    if data[mesh][subject][task][contrast][
-                                        hemi
-                                    ]
-                                    is not None
-                                    else np.nan
-                                )
-                                for task, contrast in tasks_contrasts
-                            ]
-                        )
-                        for subject in subjects
-                    ]
-                ),
-                axis=0,
-                # Force float32 to avoid json serialization error
-                dtype=np.float32,
+                hemi, voxel_index = store.split_voxel_index(mesh, voxel_index)
+                if hemi is None:
+                    return array_response(None)
+
+            return array_response(
+                store.get_fingerprint_statistic(
+                    mesh, hemi, voxel_index, statistic=statistic
+                )
             )
 
-            return jsonify(mean)
+    @bc.app.route(
+        fingerprints_endpoint, endpoint=fingerprints_endpoint, methods=["POST"]
+    )
+    def get_voxel_fingerprints():
+        """Return fingerprints of many voxels and subjects at once.
+
+        The JSON body of the request should contain
+        ``mesh``, ``hemi``, optionally ``subject_indices``
+        (all subjects by default), and either ``voxel_indices``
+        or ``roi_mask``, a list of booleans of the same length
+        as the requested hemisphere.
+        If ``roi_mean`` is true, fingerprints are averaged
+        across voxels for each subject.
+        """
+        body = request.get_json(silent=True) or dict()
+        mesh = body.get("mesh", "fsaverage5")
+        hemi = body.get("hemi", "left")
+        subject_indices = body.get(
+            "subject_indices", list(range(len(subjects)))
+        )
+        roi_mean = bool(body.get("roi_mean", False))
+
+        if hemi not in ["left", "right", "both"]:
+            return jsonify(error=f"Unknown value for hemi: {hemi}"), 400
+
+        if "voxel_indices" in body:
+            voxel_indices = body["voxel_indices"]
+        elif "roi_mask" in body:
+            voxel_indices = np.flatnonzero(np.asarray(body["roi_mask"]))
+        else:
+            return jsonify(error="Missing voxel_indices or roi_mask"), 400
+
+        n_voxels = (
+            store.get_n_vertices(mesh, "left")
+            + store.get_n_vertices(mesh, "right")
+            if hemi == "both"
+            else store.get_n_vertices(mesh, hemi)
+        )
+        try:
+            subject_indices = np.asarray(subject_indices, dtype=np.int64)
+            voxel_indices = np.asarray(voxel_indices, dtype=np.int64)
+        except (TypeError, ValueError):
+            return jsonify(error="Indices should be lists of integers"), 400
+        if (
+            subject_indices.ndim != 1
+            or voxel_indices.ndim != 1
+            or np.any(
+                (subject_indices < 0) | (subject_indices >= len(subjects))
+            )
+            or np.any((voxel_indices < 0) | (voxel_indices >= n_voxels))
+        ):
+            return jsonify(error="Indices out of range"), 400
+
+        return array_response(
+            store.get_fingerprints(
+                mesh,
+                hemi,
+                subject_indices,
+                voxel_indices,
+                roi_mean=roi_mean,
+            )
+        )
 
     @bc.app.route(
         contrast_endpoint, endpoint=contrast_endpoint, methods=["GET"]
@@ -410,22 +940,9 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
         contrast_index = request.args.get("contrast_index", type=int)
         hemi = request.args.get("hemi", default="left", type=str)
 
-        subject = subjects[subject_index]
-        task, contrast = tasks_contrasts[contrast_index]
-
-        if hemi == "left" or hemi == "right":
-            c = data[mesh][subject][task][contrast][hemi]
-            return jsonify(c.darrays[0].data if c is not None else None)
-        elif hemi == "both":
-            cl = data[mesh][subject][task][contrast]["left"]
-            cr = data[mesh][subject][task][contrast]["right"]
-            return jsonify(
-                np.concatenate(
-                    [
-                        cl.darrays[0].data if cl is not None else None,
-                        cr.darrays[0].data if cr is not None else None,
-                    ]
-                )
+        if hemi in ["left", "right", "both"]:
+            return array_response(
+                store.get_map(mesh, hemi, subject_index, contrast_index)
             )
         else:
             console.log(f"Unknown value for hemi: {hemi}", style="yellow")
@@ -440,71 +957,16 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
         mesh = request.args.get("mesh", default="fsaverage5", type=str)
         contrast_index = request.args.get("contrast_index", type=int)
         hemi = request.args.get("hemi", default="left", type=str)
+        statistic = request.args.get("statistic", default="mean", type=str)
 
-        task, contrast = tasks_contrasts[contrast_index]
-        if hemi == "left" or hemi == "right":
-            return jsonify(
-                np.nanmean(
-                    np.vstack(
-                        # Filter out subjects for whom this contrast map
-                        # does not exist
-                        list(
-                            map(
-                                lambda x: x.darrays[0].data,
-                                filter(
-                                    lambda x: x is not None,
-                                    [
-                                        data[mesh][subject][task][contrast][
-                                            hemi
-                                        ]
-                                        for subject in subjects
-                                    ],
-                                ),
-                            )
-                        )
-                    ),
-                    axis=0,
-                    # Force float32 to avoid json serialization error
-                    dtype=np.float32,
-                )
-            )
-        elif hemi == "both":
-            return jsonify(
-                np.nanmean(
-                    np.vstack(
-                        # Filter out subjects for whom this contrast map
-                        # does not exist.
-                        # Assume that left and right hemispheres
-                        # will be missing at the same time.
-                        list(
-                            map(
-                                lambda x: [
-                                    x[0].darrays[0].data,
-                                    x[1].darrays[0].data,
-                                ],
-                                filter(
-                                    lambda x: x[0] is not None
-                                    and x[1] is not None,
-                                    [
-                                        np.concatenate(
-                                            [
-                                                data[mesh][subject][task][
-                                                    contrast
-                                                ]["left"],
-                                                data[mesh][subject][task][
-                                                    contrast
-                                                ]["right"],
-                                            ]
-                                        )
-                                        for subject in subjects
-                                    ],
-                                ),
-                            )
-                        )
-                    ),
-                    axis=0,
-                    # Force float32 to avoid json serialization error
-                    dtype=np.float32,
+        if statistic not in STATISTICS:
+            console.log(f"Unknown statistic: {statistic}", style="red")
+            return jsonify([])
+
+        if hemi in ["left", "right", "both"]:
+            return array_response(
+                store.get_map_statistic(
+                    mesh, hemi, contrast_index, statistic=statistic
                 )
             )
         else:
@@ -514,16 +976,18 @@ def create_endpoints_one_features_dataset(bc, id, dataset):
 
 def create_all_endpoints(bc):
     """Create endpoints for all available Features datasets."""
-    if "features" in bc.config and "datasets" in bc.config["features"]:
+    if len(bc.datasets.features) > 0:
         # Iterate through each surface dataset
-        for dataset_id, dataset in bc.config["features"]["datasets"].items():
-            df, _ = load_dataset_description(
-                config_path=bc.config_path, dataset_path=dataset["path"]
-            )
+        for dataset_id, dataset in bc.datasets.features.items():
             # 1. Create GLTF files for all referenced meshes of the dataset
-            mesh_paths = list(map(Path, np.unique(df["mesh_path"])))
-            create_dataset_glft_files(bc, dataset, mesh_paths)
+            create_dataset_glft_files(
+                bc, dataset.config, dataset.get_mesh_paths()
+            )
             # 2. Create API endpoints
-            create_endpoints_one_features_dataset(bc, dataset_id, dataset)
+            create_endpoints_one_features_dataset(
+                bc, dataset_id, dataset.config
+            )
+        # 3. Remove decoded maps of files which changed
+        prune_maps_cache(bc)
     else:
         console.log("No features datasets to load", style="yellow")
@@ -1,51 +1,37 @@
-import copy
+import hashlib
 
-from brain_cockpit.endpoints import features_explorer
-from brain_cockpit.utils import load_dataset_description
+from flask import jsonify
 
+from brain_cockpit import http_caching
 
-def create_all_endpoints(bc):
-    def get_json_server_config(config):
-        json_config = copy.deepcopy(config)
-        del json_config["cache_folder"]
-
-        if "features" in json_config:
-            if "datasets" in json_config["features"]:
-                for _, d in json_config["features"]["datasets"].items():
-                    df, _ = load_dataset_description(
-                        config_path=bc.config_path, dataset_path=d["path"]
-                    )
-
-                    (
-                        meshes,
-                        subjects,
-                        _,
-                        sides,
-                    ) = features_explorer.parse_metadata(df)
-                    dataset_info = {
-                        "subjects": subjects,
-                        "meshes": meshes,
-                        "sides": list(
-                            map(features_explorer.side_to_hemi, sides)
-                        ),
-                        "n_files": len(df),
-                    }
-                    d.update(dataset_info)
 
-        if "alignments" in json_config:
-            if "datasets" in json_config["alignments"]:
-                for _, d in json_config["alignments"]["datasets"].items():
-                    df, _ = load_dataset_description(
-                        config_path=bc.config_path, dataset_path=d["path"]
-                    )
-
-                    dataset_info = {
-                        "n_files": len(df),
-                    }
-                    d.update(dataset_info)
-
-        return json_config
+def create_all_endpoints(bc):
+    # The config sent to clients only changes when the server restarts,
+    # hence it is serialized once
+    config_body = bc.app.json.dumps(bc.datasets.get_server_config())
+    http_caching.register_versioned_endpoints(
+        bc,
+        ["get_config"],
+        hashlib.sha1(config_body.encode()).hexdigest(),
+    )
 
     @bc.app.route("/config", methods=["GET"])
     def get_config():
-        return get_json_server_config(bc.config)
+        return bc.app.response_class(config_body, mimetype="application/json")
+
+    @bc.app.route("/cache_stats", methods=["GET"])
+    def get_cache_stats():
+        return jsonify(
+            {
+                "maps": bc.maps_cache.stats(),
+                "alignment_models": bc.models_cache.stats(),
+            }
+        )
+
+    @bc.app.route("/metrics", methods=["GET"])
+    def get_metrics():
+        return bc.app.response_class(
+            bc.metrics.to_prometheus(),
+            mimetype="text/plain",
+            headers={"Content-Type": "text/plain; version=0.0.4"},
+        )
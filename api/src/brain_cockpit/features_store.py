@@ -0,0 +1,842 @@
+"""Storage of maps loaded from a Features dataset."""
+
+import json
+import os
+import shutil
+from itertools import groupby
+from pathlib import Path
+
+import numpy as np
+
+from brain_cockpit.utils import parallel_map
+
+HEMIS = ["left", "right"]
+
+# Version of the on-disk layout of saved stores.
+# Bumping it invalidates all existing caches.
+FEATURES_STORE_VERSION = 3
+
+MANIFEST_FILENAME = "manifest.json"
+
+# Statistics of maps across subjects which can be queried from stores
+STATISTICS = ["mean", "std", "count"]
+
+
+class BaseFeaturesStore:
+    """Read-only access to maps of a Features dataset.
+
+    This class holds which maps are available, and statistics
+    of maps across subjects, but not the maps themselves.
+    Subclasses hold maps and implement ``get_n_vertices``,
+    ``get_subject_maps``, ``get_fingerprint``, ``_get_map``
+    and ``_get_fingerprints``.
+
+    Parameters
+    ----------
+    subjects: list of str
+        Subjects of the dataset, in the order used by endpoints
+    tasks_contrasts: list of (str, str)
+        (task, contrast) tuples of the dataset,
+        in the order used by endpoints
+    """
+
+    def __init__(self, subjects, tasks_contrasts):
+        self.subjects = list(subjects)
+        self.tasks_contrasts = [tuple(tc) for tc in tasks_contrasts]
+
+        # masks[mesh][hemi] is a boolean array of shape
+        # (n_subjects, n_contrasts) which is True for available maps
+        self.masks = dict()
+        # n_vertices[mesh][hemi] is an int array of shape (n_subjects,)
+        # which is 0 for subjects without any map
+        self.n_vertices = dict()
+        # aggregates[statistic][mesh][hemi] is an array of shape
+        # (n_contrasts, n_vertices) holding the given statistic
+        # of maps across subjects
+        self.aggregates = {statistic: dict() for statistic in STATISTICS}
+
+    def _fields(self):
+        """Return all dictionaries of arrays of the store, by name."""
+        fields = {
+            "masks": self.masks,
+            "n_vertices": self.n_vertices,
+        }
+        for statistic in STATISTICS:
+            fields[f"{statistic}_aggregates"] = self.aggregates[statistic]
+
+        return fields
+
+    def _stored_arrays(self):
+        """List all arrays of the store.
+
+        Returns
+        -------
+        arrays: list of (name, mesh, hemi, array)
+        """
+        return [
+            (name, mesh, hemi, array)
+            for name, field in self._fields().items()
+            for mesh, hemis in field.items()
+            for hemi, array in hemis.items()
+        ]
+
+    def _set_stored_array(self, name, mesh, hemi, array):
+        """Set array listed by ``BaseFeaturesStore._stored_arrays``."""
+        self._fields()[name].setdefault(mesh, dict())[hemi] = array
+
+    @property
+    def n_subjects(self):
+        return len(self.subjects)
+
+    @property
+    def n_contrasts(self):
+        return len(self.tasks_contrasts)
+
+    def save(self, folder, key=None):
+        """Save store to a folder as raw arrays and a JSON manifest.
+
+        Arrays are first written to a temporary folder
+        which then replaces ``folder``, so that concurrent readers
+        never see a partially written store.
+
+        Parameters
+        ----------
+        folder: str or pathlib.Path
+            Output folder
+        key: str
+            Key identifying the content of the dataset,
+            used to invalidate the saved store when it changes
+        """
+        folder = Path(folder)
+        tmp_folder = folder.with_name(f"{folder.name}.tmp-{os.getpid()}")
+        if tmp_folder.exists():
+            shutil.rmtree(tmp_folder)
+        tmp_folder.mkdir(parents=True)
+
+        # Mesh names are not necessarily valid file names,
+        # hence files are named after the index of their mesh
+        mesh_indices = {mesh: i for i, mesh in enumerate(self.masks.keys())}
+        arrays = []
+        for name, mesh, hemi, array in self._stored_arrays():
+            filename = f"{name}_{mesh_indices[mesh]}_{hemi}.npy"
+            np.save(tmp_folder / filename, array)
+            arrays.append(
+                {
+                    "name": name,
+                    "mesh": mesh,
+                    "hemi": hemi,
+                    "filename": filename,
+                }
+            )
+
+        manifest = {
+            "version": FEATURES_STORE_VERSION,
+            "key": key,
+            "subjects": self.subjects,
+            "tasks_contrasts": self.tasks_contrasts,
+            "arrays": arrays,
+        }
+        with open(tmp_folder / MANIFEST_FILENAME, "w") as f:
+            json.dump(manifest, f)
+
+        if folder.exists():
+            shutil.rmtree(folder)
+        tmp_folder.rename(folder)
+
+    @classmethod
+    def open(cls, folder, key=None, mmap_mode="r"):
+        """Open a store previously saved with ``save``.
+
+        Parameters
+        ----------
+        folder: str or pathlib.Path
+            Folder in which the store was saved
+        key: str or None
+            If not None, the saved store is only returned
+            if it was saved with the same key
+        mmap_mode: str or None
+            Passed to ``numpy.load``. By default, maps are memory-mapped,
+            so that their pages are loaded lazily and shared
+            between processes.
+
+        Returns
+        -------
+        store: BaseFeaturesStore or None
+            None if no valid store was found in folder
+        """
+        folder = Path(folder)
+        try:
+            with open(folder / MANIFEST_FILENAME, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if manifest.get("version") != FEATURES_STORE_VERSION or (
+            key is not None and manifest.get("key") != key
+        ):
+            return None
+
+        store = cls(manifest["subjects"], manifest["tasks_contrasts"])
+        for a in manifest["arrays"]:
+            store._set_stored_array(
+                a["name"],
+                a["mesh"],
+                a["hemi"],
+                np.load(folder / a["filename"], mmap_mode=mmap_mode),
+            )
+
+        return store
+
+    def has_hemi(self, mesh, hemi):
+        return mesh in self.masks and hemi in self.masks[mesh]
+
+    def split_voxel_index(self, mesh, voxel_index, subject_index=None):
+        """Deduce hemisphere from a voxel index spanning both hemispheres.
+
+        Returns
+        -------
+        hemi: str or None
+            None if left hemisphere is not available
+        voxel_index: int
+            Index of voxel in the returned hemisphere
+        """
+        n_voxels_left_hemi = self.get_n_vertices(mesh, "left", subject_index)
+        if n_voxels_left_hemi == 0:
+            return None, voxel_index
+        if voxel_index >= n_voxels_left_hemi:
+            return "right", voxel_index - n_voxels_left_hemi
+        return "left", voxel_index
+
+    def get_map(self, mesh, hemi, subject_index, contrast_index):
+        """Return one map, or None if it is missing."""
+        if hemi == "both":
+            return self._concatenate_hemis(
+                lambda h: self.get_map(mesh, h, subject_index, contrast_index),
+                # Subjects without any map for a given hemisphere
+                # are assumed to use the largest mesh
+                lambda h: (
+                    self.get_n_vertices(mesh, h, subject_index)
+                    or self.get_n_vertices(mesh, h)
+                ),
+            )
+
+        if (
+            not self.has_hemi(mesh, hemi)
+            or not self.masks[mesh][hemi][subject_index, contrast_index]
+        ):
+            return None
+
+        return self._get_map(mesh, hemi, subject_index, contrast_index)
+
+    def get_map_statistic(self, mesh, hemi, contrast_index, statistic="mean"):
+        """Return statistic of one contrast across subjects.
+
+        Parameters
+        ----------
+        statistic: str in ``STATISTICS``
+            Either the mean, standard deviation or number
+            of available values across subjects
+
+        Returns
+        -------
+        map: numpy array or None
+            None if this contrast is missing for all subjects
+        """
+        if hemi == "both":
+            return self._concatenate_hemis(
+                lambda h: self.get_map_statistic(
+                    mesh, h, contrast_index, statistic=statistic
+                ),
+                lambda h: self.get_n_vertices(mesh, h),
+            )
+
+        if (
+            not self.has_hemi(mesh, hemi)
+            or not self.masks[mesh][hemi][:, contrast_index].any()
+        ):
+            return None
+
+        return self.aggregates[statistic][mesh][hemi][contrast_index]
+
+    def get_fingerprint_statistic(
+        self, mesh, hemi, voxel_index, statistic="mean"
+    ):
+        """Return statistic of all contrasts across subjects for one voxel.
+
+        Parameters
+        ----------
+        statistic: str in ``STATISTICS``
+            Either the mean, standard deviation or number
+            of available values across subjects
+        """
+        if not self.has_hemi(mesh, hemi):
+            return np.full(self.n_contrasts, np.nan, dtype=np.float32)
+
+        return self.aggregates[statistic][mesh][hemi][:, voxel_index]
+
+    def get_fingerprints(
+        self, mesh, hemi, subject_indices, voxel_indices, roi_mean=False
+    ):
+        """Return fingerprints of several voxels of several subjects.
+
+        Parameters
+        ----------
+        subject_indices: list of int
+        voxel_indices: list of int
+            If ``hemi`` is "both", indices of right hemisphere voxels
+            are offset by the number of voxels of the left hemisphere
+        roi_mean: bool
+            If True, fingerprints are averaged across voxels
+
+        Returns
+        -------
+        fingerprints: numpy array
+            Float32 array of shape
+            ``(n_subjects, n_voxels, n_contrasts)``,
+            or ``(n_subjects, n_contrasts)`` if ``roi_mean`` is True.
+            Missing maps yield NaN values.
+        """
+        subject_indices = np.asarray(subject_indices, dtype=np.int64)
+        voxel_indices = np.asarray(voxel_indices, dtype=np.int64)
+
+        if hemi == "both":
+            fingerprints = np.empty(
+                (len(subject_indices), len(voxel_indices), self.n_contrasts),
+                dtype=np.float32,
+            )
+            # Individual meshes can have a different number of vertices
+            # in the left hemisphere for each subject, hence voxels
+            # are split between hemispheres for each group of subjects
+            # sharing the same left hemisphere mesh size.
+            # As in ``BaseFeaturesStore.get_map``, subjects without
+            # any left hemisphere map are assumed to use the largest mesh.
+            n_voxels_left_hemi = np.array(
+                [
+                    self.get_n_vertices(mesh, "left", subject_index)
+                    or self.get_n_vertices(mesh, "left")
+                    for subject_index in subject_indices
+                ],
+                dtype=np.int64,
+            )
+            for n in np.unique(n_voxels_left_hemi):
+                rows = np.flatnonzero(n_voxels_left_hemi == n)
+                is_left = voxel_indices < n
+                fingerprints[np.ix_(rows, np.flatnonzero(is_left))] = (
+                    self.get_fingerprints(
+                        mesh,
+                        "left",
+                        subject_indices[rows],
+                        voxel_indices[is_left],
+                    )
+                )
+                fingerprints[np.ix_(rows, np.flatnonzero(~is_left))] = (
+                    self.get_fingerprints(
+                        mesh,
+                        "right",
+                        subject_indices[rows],
+                        voxel_indices[~is_left] - n,
+                    )
+                )
+        elif not self.has_hemi(mesh, hemi):
+            fingerprints = np.full(
+                (len(subject_indices), len(voxel_indices), self.n_contrasts),
+                np.nan,
+                dtype=np.float32,
+            )
+        else:
+            fingerprints = self._get_fingerprints(
+                mesh, hemi, subject_indices, voxel_indices
+            )
+
+        if roi_mean:
+            return _aggregate(np.moveaxis(fingerprints, 1, 0))["mean"]
+
+        return fingerprints
+
+    def _concatenate_hemis(self, get_hemi, get_n_vertices):
+        """Concatenate left and right hemisphere arrays.
+
+        A missing hemisphere is filled with NaN values.
+        Returns None if both hemispheres are missing.
+        """
+        arrays = [get_hemi(hemi) for hemi in HEMIS]
+        if all(a is None for a in arrays):
+            return None
+
+        return np.concatenate(
+            [
+                (
+                    a
+                    if a is not None
+                    else np.full(get_n_vertices(hemi), np.nan, np.float32)
+                )
+                for a, hemi in zip(arrays, HEMIS)
+            ]
+        )
+
+
+class FeaturesStore(BaseFeaturesStore):
+    """Contiguous in-memory storage of all maps of a Features dataset.
+
+    For each mesh and hemisphere, maps are held in one float32 array
+    of shape ``(n_subjects, n_contrasts, n_vertices)``.
+    Missing maps are filled with NaN and flagged in a boolean mask
+    of shape ``(n_subjects, n_contrasts)``.
+    Individual meshes can have a different number of vertices
+    for each subject: the vertex axis is then padded to the largest mesh
+    and the actual vertex count of each subject is stored alongside.
+    Mean, standard deviation and count of available values
+    across subjects are precomputed for each contrast
+    with ``FeaturesStore.compute_aggregates``.
+    Optionally, ``FeaturesStore.compute_vertex_major`` builds
+    transposed copies of these arrays in which all values
+    of a given vertex are contiguous, so that fingerprints
+    are read in one go.
+
+    Parameters
+    ----------
+    subjects: list of str
+        Subjects of the dataset, in the order used by endpoints
+    tasks_contrasts: list of (str, str)
+        (task, contrast) tuples of the dataset,
+        in the order used by endpoints
+    """
+
+    def __init__(self, subjects, tasks_contrasts):
+        super().__init__(subjects, tasks_contrasts)
+
+        # maps[mesh][hemi] is a float32 array of shape
+        # (n_subjects, n_contrasts, n_vertices)
+        self.maps = dict()
+        # vertex_major_maps[mesh][hemi] is an optional float32 array
+        # of shape (n_vertices, n_subjects, n_contrasts)
+        self.vertex_major_maps = dict()
+        # vertex_major_aggregates[statistic][mesh][hemi] is an optional
+        # float32 array of shape (n_vertices, n_contrasts)
+        self.vertex_major_aggregates = {
+            statistic: dict() for statistic in STATISTICS
+        }
+
+    def _fields(self):
+        """Return all dictionaries of arrays of the store, by name."""
+        fields = {
+            "maps": self.maps,
+            **super()._fields(),
+            "vertex_major_maps": self.vertex_major_maps,
+        }
+        for statistic in STATISTICS:
+            fields[f"{statistic}_vertex_major_aggregates"] = (
+                self.vertex_major_aggregates[statistic]
+            )
+
+        return fields
+
+    def _allocate(self, mesh, hemi, n_vertices):
+        """Allocate (or widen) arrays of a given (mesh, hemi)."""
+        if not self.has_hemi(mesh, hemi):
+            self.maps.setdefault(mesh, dict())[hemi] = np.full(
+                (self.n_subjects, self.n_contrasts, n_vertices),
+                np.nan,
+                dtype=np.float32,
+            )
+            self.masks.setdefault(mesh, dict())[hemi] = np.zeros(
+                (self.n_subjects, self.n_contrasts), dtype=bool
+            )
+            self.n_vertices.setdefault(mesh, dict())[hemi] = np.zeros(
+                self.n_subjects, dtype=np.int64
+            )
+        elif self.maps[mesh][hemi].shape[2] < n_vertices:
+            # This only happens with individual meshes
+            # of different sizes
+            m = self.maps[mesh][hemi]
+            self.maps[mesh][hemi] = np.pad(
+                m,
+                ((0, 0), (0, 0), (0, n_vertices - m.shape[2])),
+                constant_values=np.nan,
+            )
+
+    def set_map(self, mesh, hemi, subject_index, contrast_index, values):
+        """Store one map."""
+        values = np.asarray(values, dtype=np.float32).ravel()
+        self._allocate(mesh, hemi, values.shape[0])
+
+        self.maps[mesh][hemi][
+            subject_index, contrast_index, : values.shape[0]
+        ] = values
+        self.masks[mesh][hemi][subject_index, contrast_index] = True
+        self.n_vertices[mesh][hemi][subject_index] = values.shape[0]
+
+    def compute_aggregates(self):
+        """Compute statistics of all maps across subjects.
+
+        This should be called once all maps have been set.
+        """
+        for mesh, maps in self.maps.items():
+            for hemi, m in maps.items():
+                aggregates = {
+                    statistic: np.full(
+                        (self.n_contrasts, m.shape[2]),
+                        np.nan,
+                        dtype=np.float32,
+                    )
+                    for statistic in STATISTICS
+                }
+                # Process one contrast at a time to avoid
+                # allocating temporary arrays as large as the whole mesh
+                for contrast_index in range(self.n_contrasts):
+                    for statistic, values in _aggregate(
+                        m[:, contrast_index, :]
+                    ).items():
+                        aggregates[statistic][contrast_index] = values
+
+                for statistic in STATISTICS:
+                    self.aggregates[statistic].setdefault(mesh, dict())[
+                        hemi
+                    ] = aggregates[statistic]
+
+    @property
+    def has_vertex_major(self):
+        return len(self.vertex_major_maps) > 0
+
+    def compute_vertex_major(self, chunk_size=10000):
+        """Build vertex-major copies of maps and aggregates.
+
+        This should be called once maps and aggregates are computed.
+        Vertices are transposed by chunks of ``chunk_size``
+        so that memory-mapped maps are read sequentially.
+        """
+        for mesh, maps in self.maps.items():
+            for hemi, m in maps.items():
+                n_vertices = m.shape[2]
+                vertex_major_maps = np.empty(
+                    (n_vertices, self.n_subjects, self.n_contrasts),
+                    dtype=np.float32,
+                )
+                for start in range(0, n_vertices, chunk_size):
+                    stop = min(start + chunk_size, n_vertices)
+                    vertex_major_maps[start:stop] = np.transpose(
+                        m[:, :, start:stop], (2, 0, 1)
+                    )
+                self.vertex_major_maps.setdefault(mesh, dict())[
+                    hemi
+                ] = vertex_major_maps
+
+                for statistic in STATISTICS:
+                    self.vertex_major_aggregates[statistic].setdefault(
+                        mesh, dict()
+                    )[hemi] = np.ascontiguousarray(
+                        self.aggregates[statistic][mesh][hemi].T
+                    )
+
+    def get_n_vertices(self, mesh, hemi, subject_index=None):
+        """Return number of vertices of a given hemisphere.
+
+        If ``subject_index`` is None, returns the number of vertices
+        of the largest mesh available for this hemisphere.
+        """
+        if not self.has_hemi(mesh, hemi):
+            return 0
+        if subject_index is None:
+            return self.maps[mesh][hemi].shape[2]
+        return int(self.n_vertices[mesh][hemi][subject_index])
+
+    def _get_map(self, mesh, hemi, subject_index, contrast_index):
+        """Return one available map."""
+        n = self.n_vertices[mesh][hemi][subject_index]
+        return self.maps[mesh][hemi][subject_index, contrast_index, :n]
+
+    def get_subject_maps(self, mesh, hemi, subject_index):
+        """Return maps of all contrasts of a subject for one hemisphere.
+
+        Returns
+        -------
+        maps: np.ndarray of size (n_contrasts, n_vertices)
+            Missing maps are filled with NaN values
+        """
+        n = self.get_n_vertices(mesh, hemi, subject_index)
+        if n == 0:
+            return np.full((self.n_contrasts, 0), np.nan, dtype=np.float32)
+
+        # Missing maps are already filled with NaN values
+        return np.array(self.maps[mesh][hemi][subject_index, :, :n])
+
+    def get_fingerprint(self, mesh, hemi, subject_index, voxel_index):
+        """Return values of all contrasts for one voxel of one subject.
+
+        Missing maps yield NaN values.
+        """
+        if not self.has_hemi(mesh, hemi):
+            return np.full(self.n_contrasts, np.nan, dtype=np.float32)
+
+        if mesh in self.vertex_major_maps:
+            return self.vertex_major_maps[mesh][hemi][
+                voxel_index, subject_index
+            ]
+
+        return self.maps[mesh][hemi][subject_index, :, voxel_index]
+
+    def get_fingerprint_statistic(
+        self, mesh, hemi, voxel_index, statistic="mean"
+    ):
+        if (
+            self.has_hemi(mesh, hemi)
+            and mesh in self.vertex_major_aggregates[statistic]
+        ):
+            return self.vertex_major_aggregates[statistic][mesh][hemi][
+                voxel_index
+            ]
+
+        return super().get_fingerprint_statistic(
+            mesh, hemi, voxel_index, statistic=statistic
+        )
+
+    def _get_fingerprints(self, mesh, hemi, subject_indices, voxel_indices):
+        """Gather fingerprints of one hemisphere."""
+        if mesh in self.vertex_major_maps:
+            # Only rows of requested voxels are read
+            return np.transpose(
+                self.vertex_major_maps[mesh][hemi][voxel_indices][
+                    :, subject_indices
+                ],
+                (1, 0, 2),
+            )
+
+        # Advanced indexing only gathers requested values,
+        # which matters when maps are memory-mapped
+        return self.maps[mesh][hemi][
+            subject_indices[:, None, None],
+            np.arange(self.n_contrasts)[None, None, :],
+            voxel_indices[None, :, None],
+        ]
+
+
+class LazyFeaturesStore(BaseFeaturesStore):
+    """Features store decoding maps on first access.
+
+    Only paths to map files are held by this store.
+    Decoded maps are kept in a ``ByteLRUCache``,
+    which can be shared between several datasets
+    so that they all fit in a common memory budget.
+    Statistics of maps across subjects are computed once
+    with ``LazyFeaturesStore.compute_aggregates``, which also
+    sets vertex counts, and can then be saved with the store.
+
+    Parameters
+    ----------
+    subjects: list of str
+        Subjects of the dataset, in the order used by endpoints
+    tasks_contrasts: list of (str, str)
+        (task, contrast) tuples of the dataset,
+        in the order used by endpoints
+    cache: brain_cockpit.utils.ByteLRUCache
+        Cache in which decoded maps are held
+    load_map: callable
+        Function returning the values of a map from its path
+    cache_prefix: hashable
+        Prefix of cache keys, used to tell datasets apart
+        when they share the same cache
+    """
+
+    def __init__(
+        self, subjects, tasks_contrasts, cache, load_map, cache_prefix=None
+    ):
+        super().__init__(subjects, tasks_contrasts)
+        self.cache = cache
+        self.load_map = load_map
+        self.cache_prefix = cache_prefix
+
+        # paths[mesh][hemi] is an object array of shape
+        # (n_subjects, n_contrasts) holding paths to map files
+        self.paths = dict()
+
+    def set_path(self, mesh, hemi, subject_index, contrast_index, path):
+        """Reference the file from which one map can be loaded."""
+        if not self.has_hemi(mesh, hemi):
+            self.paths.setdefault(mesh, dict())[hemi] = np.full(
+                (self.n_subjects, self.n_contrasts), None, dtype=object
+            )
+            self.masks.setdefault(mesh, dict())[hemi] = np.zeros(
+                (self.n_subjects, self.n_contrasts), dtype=bool
+            )
+            # Vertex counts are set once aggregates are computed
+            self.n_vertices.setdefault(mesh, dict())[hemi] = np.zeros(
+                self.n_subjects, dtype=np.int64
+            )
+
+        self.paths[mesh][hemi][subject_index, contrast_index] = path
+        self.masks[mesh][hemi][subject_index, contrast_index] = True
+
+    def compute_aggregates(self, n_workers=1):
+        """Compute statistics of all maps across subjects.
+
+        Maps are decoded (possibly in ``n_workers`` processes)
+        without going through the cache, so that cached maps
+        are not evicted, and only maps of one contrast
+        are held in memory at a time.
+        This should be called once all paths have been set.
+        """
+        # Maps are listed by contrast, so that they can be aggregated
+        # as soon as all maps of a contrast are decoded
+        locations = [
+            (mesh, hemi, contrast_index, subject_index)
+            for mesh, masks in self.masks.items()
+            for hemi, mask in masks.items()
+            for contrast_index, subject_index in np.argwhere(mask.T)
+        ]
+        decoded_maps = zip(
+            locations,
+            parallel_map(
+                self.load_map,
+                [self.paths[m][h][s, c] for m, h, c, s in locations],
+                n_workers=n_workers,
+            ),
+        )
+
+        for (mesh, hemi), hemi_maps in groupby(
+            decoded_maps, key=lambda item: item[0][:2]
+        ):
+            n_vertices = self.n_vertices[mesh][hemi]
+            contrast_aggregates = dict()
+            for contrast_index, contrast_maps in groupby(
+                hemi_maps, key=lambda item: item[0][2]
+            ):
+                maps = []
+                for (_, _, _, subject_index), values in contrast_maps:
+                    values = np.asarray(values, dtype=np.float32).ravel()
+                    n_vertices[subject_index] = values.shape[0]
+                    maps.append(values)
+                contrast_aggregates[contrast_index] = _aggregate(_stack(maps))
+
+            for statistic in STATISTICS:
+                # Vertices without any value have a count of 0
+                # and NaN other statistics, as in ``FeaturesStore``
+                aggregates = np.full(
+                    (self.n_contrasts, n_vertices.max()),
+                    0 if statistic == "count" else np.nan,
+                    dtype=np.float32,
+                )
+                for contrast_index, values in contrast_aggregates.items():
+                    values = values[statistic]
+                    aggregates[contrast_index, : values.shape[0]] = values
+                self.aggregates[statistic].setdefault(mesh, dict())[
+                    hemi
+                ] = aggregates
+
+    def _load(self, mesh, hemi, subject_index, contrast_index):
+        """Return one available map, decoding it if it is not cached."""
+        return self.cache.get_or_compute(
+            (
+                self.cache_prefix,
+                mesh,
+                hemi,
+                int(subject_index),
+                int(contrast_index),
+            ),
+            lambda: np.asarray(
+                self.load_map(
+                    self.paths[mesh][hemi][subject_index, contrast_index]
+                ),
+                dtype=np.float32,
+            ).ravel(),
+        )
+
+    def get_n_vertices(self, mesh, hemi, subject_index=None):
+        """Return number of vertices of a given hemisphere.
+
+        If ``subject_index`` is None, returns the number of vertices
+        of the largest mesh available for this hemisphere.
+        """
+        if not self.has_hemi(mesh, hemi):
+            return 0
+        if subject_index is None:
+            return int(self.n_vertices[mesh][hemi].max())
+        return int(self.n_vertices[mesh][hemi][subject_index])
+
+    def _get_map(self, mesh, hemi, subject_index, contrast_index):
+        """Return one available map."""
+        return self._load(mesh, hemi, subject_index, contrast_index)
+
+    def get_subject_maps(self, mesh, hemi, subject_index):
+        n = self.get_n_vertices(mesh, hemi, subject_index)
+        maps = np.full((self.n_contrasts, n), np.nan, dtype=np.float32)
+        for contrast_index in range(self.n_contrasts):
+            m = self.get_map(mesh, hemi, subject_index, contrast_index)
+            if m is not None:
+                maps[contrast_index] = m
+
+        return maps
+
+    def get_fingerprint(self, mesh, hemi, subject_index, voxel_index):
+        """Return values of all contrasts for one voxel of one subject.
+
+        Missing maps yield NaN values.
+        """
+        fingerprint = np.full(self.n_contrasts, np.nan, dtype=np.float32)
+        if not self.has_hemi(mesh, hemi):
+            return fingerprint
+
+        for contrast_index in np.flatnonzero(
+            self.masks[mesh][hemi][subject_index]
+        ):
+            fingerprint[contrast_index] = self._load(
+                mesh, hemi, subject_index, contrast_index
+            )[voxel_index]
+
+        return fingerprint
+
+    def _get_fingerprints(self, mesh, hemi, subject_indices, voxel_indices):
+        """Gather fingerprints of one hemisphere from decoded maps."""
+        fingerprints = np.full(
+            (len(subject_indices), len(voxel_indices), self.n_contrasts),
+            np.nan,
+            dtype=np.float32,
+        )
+        for i, subject_index in enumerate(subject_indices):
+            for contrast_index in np.flatnonzero(
+                self.masks[mesh][hemi][subject_index]
+            ):
+                fingerprints[i, :, contrast_index] = self._load(
+                    mesh, hemi, subject_index, contrast_index
+                )[voxel_indices]
+
+        return fingerprints
+
+
+def _stack(arrays):
+    """Stack 1D arrays, padding shorter ones with NaN values."""
+    n = max(a.shape[0] for a in arrays)
+    stacked = np.full((len(arrays), n), np.nan, dtype=np.float32)
+    for i, a in enumerate(arrays):
+        stacked[i, : a.shape[0]] = a
+
+    return stacked
+
+
+def _aggregate(values):
+    """Compute statistics of an array along its first axis.
+
+    NaN values are ignored. Statistics are computed explicitly
+    rather than with ``numpy.nanmean`` and ``numpy.nanstd``
+    to avoid warnings about columns without any available value.
+
+    Returns
+    -------
+    aggregates: dict
+        Dictionary mapping each statistic of ``STATISTICS``
+        to a float32 array
+    """
+    available = ~np.isnan(values)
+    count = available.sum(axis=0)
+    values = np.where(available, values, 0).astype(np.float64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = values.sum(axis=0) / count
+        std = np.sqrt(
+            np.where(available, (values - mean) ** 2, 0).sum(axis=0) / count
+        )
+
+    return {
+        "mean": mean.astype(np.float32),
+        "std": std.astype(np.float32),
+        "count": count.astype(np.float32),
+    }
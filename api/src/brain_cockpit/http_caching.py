@@ -0,0 +1,186 @@
+"""HTTP caching and compression of brain-cockpit responses.
+
+Endpoints whose responses only depend on their query parameters
+and on the version of the dataset they serve can be registered with
+``register_versioned_endpoints``. They are then served with ETags
+derived from this version, and conditional requests
+are answered with 304 responses before any computation happens.
+Independently, large responses are compressed
+when clients accept it.
+"""
+
+import gzip
+import hashlib
+import json
+import zlib
+
+from flask import g, request
+
+from brain_cockpit.metrics import timer
+
+DEFAULT_HTTP_CONFIG = {
+    # Value of the Cache-Control header of versioned endpoints.
+    # By default, clients revalidate cached responses at each request,
+    # which is cheap since it is answered with an empty 304 response
+    "cache_control": "no-cache",
+    "compression": {
+        "enabled": True,
+        # Responses smaller than this number of bytes are not compressed
+        "min_size": 1024,
+        "level": 6,
+    },
+}
+
+# Besides these, all text/* and model/* (such as GLTF meshes)
+# mimetypes are compressed
+COMPRESSIBLE_MIMETYPES = [
+    "application/json",
+    "application/octet-stream",
+]
+
+
+def get_http_config(bc):
+    """Return HTTP config, completed with default values."""
+    config = bc.config.get("http", None) or dict()
+    compression = {
+        **DEFAULT_HTTP_CONFIG["compression"],
+        **(config.get("compression", None) or dict()),
+    }
+
+    return {**DEFAULT_HTTP_CONFIG, **config, "compression": compression}
+
+
+def register_versioned_endpoints(bc, endpoints, version):
+    """Serve given endpoints with ETags derived from a dataset version.
+
+    Parameters
+    ----------
+    endpoints: list of str
+        Names of flask endpoints
+    version: str
+        String which changes whenever data served
+        by these endpoints changes
+    """
+    for endpoint in endpoints:
+        bc.endpoint_versions[endpoint] = version
+
+
+def get_config_version(version, dataset, **options):
+    """Combine a dataset version with the config serving the dataset.
+
+    Responses also depend on the config of their dataset
+    (such as its unit or mesh types) and on options resolved
+    from the whole config (such as the mesh format),
+    hence versions derived with this function change along with them.
+
+    Parameters
+    ----------
+    version: str
+        Version of the content of the dataset
+    dataset: dict
+        Config of the dataset
+    options: dict
+        Options resolved from the config which responses depend on
+    """
+    h = hashlib.sha1()
+    h.update(version.encode())
+    h.update(
+        json.dumps(
+            {"dataset": dataset, "options": options},
+            sort_keys=True,
+            default=str,
+        ).encode()
+    )
+
+    return h.hexdigest()
+
+
+def compute_etag(version):
+    """Compute ETag of the current request for a given dataset version."""
+    h = hashlib.sha1()
+    h.update(version.encode())
+    h.update(request.path.encode())
+    h.update(request.query_string)
+    # JSON and binary representations of arrays have different ETags
+    h.update(str(request.accept_mimetypes).encode())
+
+    return h.hexdigest()
+
+
+def compress(response, config):
+    """Compress response body if the client accepts it."""
+    is_compressible = (
+        response.mimetype in COMPRESSIBLE_MIMETYPES
+        or response.mimetype.startswith("text/")
+        or response.mimetype.startswith("model/")
+    )
+    if (
+        not config["enabled"]
+        or not is_compressible
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    encodings = request.accept_encodings
+    if encodings["gzip"]:
+        encoding = "gzip"
+    elif encodings["deflate"]:
+        encoding = "deflate"
+    else:
+        return response
+
+    # Files sent with send_from_directory are streamed,
+    # hence their content needs to be read first
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < config["min_size"]:
+        return response
+
+    if encoding == "gzip":
+        data = gzip.compress(data, compresslevel=config["level"])
+    else:
+        data = zlib.compress(data, config["level"])
+
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+
+    # Compressed and uncompressed bodies differ,
+    # so ETags can only be weak
+    etag, is_weak = response.get_etag()
+    if etag is not None and not is_weak:
+        response.set_etag(etag, weak=True)
+
+    return response
+
+
+def init_app(bc):
+    """Register request hooks handling HTTP caching and compression."""
+    bc.endpoint_versions = dict()
+    http_config = get_http_config(bc)
+
+    @bc.app.before_request
+    def check_etag():
+        version = bc.endpoint_versions.get(request.endpoint, None)
+        if version is None or request.method not in ["GET", "HEAD"]:
+            return None
+
+        g.etag = compute_etag(version)
+        if request.if_none_match.contains_weak(g.etag):
+            response = bc.app.response_class(status=304)
+            response.set_etag(g.etag, weak=True)
+            response.headers["Cache-Control"] = http_config["cache_control"]
+            return response
+
+        return None
+
+    @bc.app.after_request
+    def set_cache_headers(response):
+        if "etag" in g and response.status_code == 200:
+            response.set_etag(g.etag, weak=True)
+            response.headers["Cache-Control"] = http_config["cache_control"]
+            response.vary.add("Accept")
+
+        with timer("compress"):
+            return compress(response, http_config["compression"])
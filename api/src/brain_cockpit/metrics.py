@@ -0,0 +1,249 @@
+"""Latency, size and error metrics of brain-cockpit endpoints.
+
+Requests are timed by request hooks, and aggregated by route template
+(such as ``/datasets/<id>/contrast``) rather than by url.
+Metrics are served in the Prometheus text format,
+and each response tells how long it took to compute in its
+``Server-Timing`` header. Steps of a request which are not
+computations specific to an endpoint, such as serializing arrays
+or compressing responses, are timed with ``timer`` so that
+they appear separately in this header.
+When serving with several worker processes,
+each worker holds its own metrics.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+# Upper bounds of histogram buckets
+LATENCY_BUCKETS = [
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+]
+SIZE_BUCKETS = [2**n for n in range(8, 29, 2)]
+
+
+class Histogram:
+    """Cumulative histogram in the sense of Prometheus."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_prometheus(self, name, labels):
+        lines = []
+        cumulative_count = 0
+        for bound, count in zip([*self.buckets, "+Inf"], self.counts):
+            cumulative_count += count
+            lines.append(
+                f"{name}_bucket"
+                f"{format_labels({**labels, 'le': bound})} "
+                f"{cumulative_count}"
+            )
+        lines.append(f"{name}_sum{format_labels(labels)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labels)} {self.count}")
+
+        return lines
+
+
+class RequestMetrics:
+    """Thread-safe metrics of requests, aggregated by route."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.sizes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.responses = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def record(self, route, method, status, duration, size):
+        """Record a request.
+
+        Parameters
+        ----------
+        route: str
+            Route template of the request
+        method: str
+        status: int
+            Status code of the response
+        duration: float
+            Time spent serving the request, in seconds
+        size: int
+            Size of the response body, in bytes
+        """
+        key = (route, method)
+        with self._lock:
+            self.latencies[key].observe(duration)
+            self.sizes[key].observe(size)
+            self.responses[(*key, status)] += 1
+            if status >= 500:
+                self.errors[key] += 1
+
+    def to_prometheus(self):
+        """Return metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            lines.extend(
+                [
+                    "# HELP brain_cockpit_request_duration_seconds "
+                    "Time spent serving requests",
+                    "# TYPE brain_cockpit_request_duration_seconds histogram",
+                ]
+            )
+            for (route, method), histogram in sorted(self.latencies.items()):
+                lines.extend(
+                    histogram.to_prometheus(
+                        "brain_cockpit_request_duration_seconds",
+                        {"route": route, "method": method},
+                    )
+                )
+
+            lines.extend(
+                [
+                    "# HELP brain_cockpit_response_size_bytes "
+                    "Size of response bodies",
+                    "# TYPE brain_cockpit_response_size_bytes histogram",
+                ]
+            )
+            for (route, method), histogram in sorted(self.sizes.items()):
+                lines.extend(
+                    histogram.to_prometheus(
+                        "brain_cockpit_response_size_bytes",
+                        {"route": route, "method": method},
+                    )
+                )
+
+            lines.extend(
+                [
+                    "# HELP brain_cockpit_responses_total "
+                    "Number of responses by status code",
+                    "# TYPE brain_cockpit_responses_total counter",
+                ]
+            )
+            for (route, method, status), count in sorted(
+                self.responses.items()
+            ):
+                labels = {"route": route, "method": method, "status": status}
+                lines.append(
+                    f"brain_cockpit_responses_total{format_labels(labels)} "
+                    f"{count}"
+                )
+
+            lines.extend(
+                [
+                    "# HELP brain_cockpit_request_errors_total "
+                    "Number of requests which failed with a server error",
+                    "# TYPE brain_cockpit_request_errors_total counter",
+                ]
+            )
+            for (route, method), count in sorted(self.errors.items()):
+                labels = {"route": route, "method": method}
+                lines.append(
+                    f"brain_cockpit_request_errors_total"
+                    f"{format_labels(labels)} {count}"
+                )
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    """Format labels of a Prometheus sample."""
+    formatted_labels = ",".join(
+        f'{name}="{escape_label_value(value)}"'
+        for name, value in labels.items()
+    )
+
+    return f"{{{formatted_labels}}}"
+
+
+def escape_label_value(value):
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\n", "\\n")
+        .replace('"', '\\"')
+    )
+
+
+@contextmanager
+def timer(name):
+    """Time a step of the current request, reported in Server-Timing.
+
+    Outside of requests, the enclosed block is simply executed.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context() and "server_timings" in g:
+            g.server_timings[name] = (
+                g.server_timings.get(name, 0) + time.perf_counter() - start
+            )
+
+
+def init_app(bc):
+    """Register request hooks recording metrics of all requests.
+
+    Hooks should be registered before other hooks
+    (such as those of ``http_caching``) so that
+    the time spent in other hooks is recorded as well.
+    """
+    bc.metrics = RequestMetrics()
+
+    @bc.app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+        g.server_timings = dict()
+
+    @bc.app.after_request
+    def record_metrics(response):
+        if "request_start" not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_start
+        route = (
+            request.url_rule.rule
+            if request.url_rule is not None
+            else "unmatched"
+        )
+        bc.metrics.record(
+            route,
+            request.method,
+            response.status_code,
+            duration,
+            response.content_length or 0,
+        )
+
+        # Time not spent in timed steps is spent computing the response
+        timings = {
+            "compute": duration - sum(g.server_timings.values()),
+            **g.server_timings,
+            "total": duration,
+        }
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={1000 * seconds:.2f}"
+            for name, seconds in timings.items()
+        )
+
+        return response
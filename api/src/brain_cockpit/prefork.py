@@ -0,0 +1,123 @@
+"""Serve brain-cockpit with several worker processes.
+
+Datasets are loaded once in a parent process,
+which then forks worker processes sharing a listening socket.
+Each worker serves requests with waitress. Memory of loaded
+datasets is shared copy-on-write between workers,
+and memory-mapped datasets are shared through the page cache,
+so that adding workers does not duplicate datasets in memory.
+Caches filled while serving requests (such as caches of lazily loaded
+maps or alignment models) are however specific to each worker.
+"""
+
+import gc
+import os
+import signal
+import socket
+
+from waitress import serve
+
+from brain_cockpit.utils import console
+
+
+def create_socket(host, port, backlog=1024):
+    """Create socket listening on a given host and port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+
+    return sock
+
+
+def run_worker(app, sock, threads):
+    """Serve app in the current (forked) process."""
+    # Workers are stopped by the parent process
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    try:
+        serve(app, sockets=[sock], threads=threads)
+    finally:
+        os._exit(0)
+
+
+def fork_worker(app, sock, threads):
+    """Fork a worker process and return its pid."""
+    pid = os.fork()
+    if pid == 0:
+        run_worker(app, sock, threads)
+
+    return pid
+
+
+def serve_prefork(app, sock, workers=2, threads=4):
+    """Serve app with several processes sharing a socket.
+
+    Workers which exit unexpectedly are replaced.
+    All workers are stopped when the parent process
+    receives SIGINT or SIGTERM.
+
+    Parameters
+    ----------
+    app: flask.Flask
+        Application, whose data should be loaded
+        before calling this function
+    sock: socket.socket
+        Listening socket, for instance created with ``create_socket``
+    workers: int
+        Number of worker processes
+    threads: int
+        Number of threads of each worker process
+    """
+    if not hasattr(os, "fork"):
+        console.log(
+            "Forking processes is not supported on this platform, "
+            "serving with a single process",
+            style="yellow",
+        )
+        serve(app, sockets=[sock], threads=threads)
+        return
+
+    # Objects created so far are never collected,
+    # so that garbage collection in workers
+    # doesn't copy pages shared with the parent process
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    pids = set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        pids.add(fork_worker(app, sock, threads))
+    console.log(f"Serving with {workers} worker processes")
+
+    while len(pids) > 0:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        pids.discard(pid)
+        if not stopping:
+            console.log(
+                f"Worker {pid} exited with status {status}, restarting it",
+                style="yellow",
+            )
+            pids.add(fork_worker(app, sock, threads))
+
+    sock.close()
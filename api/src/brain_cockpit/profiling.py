@@ -0,0 +1,175 @@
+"""Opt-in profiling of brain-cockpit requests and startup.
+
+Profiling is configured in the ``profiling`` section of the config.
+A fraction of requests to selected routes are profiled with cProfile,
+and their profiles are saved as ``.prof`` files which can be read
+with ``pstats`` or tools such as snakeviz.
+Requests can also be profiled on demand by passing
+``profile=<token>`` in their query string, where ``token``
+is set in the config, so that only administrators can do so.
+"""
+
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from pathlib import Path
+from urllib.parse import urlencode
+
+from flask import g, request
+
+from brain_cockpit.utils import console
+
+DEFAULT_PROFILING_CONFIG = {
+    "enabled": False,
+    # Folder in which .prof files are saved
+    "folder": "/tmp/brain-cockpit-profiles",
+    # Fraction of requests to selected routes which are profiled
+    "sample_rate": 0.0,
+    # Patterns of route templates of profiled requests
+    # (such as /datasets/*/contrast_mean), all routes if empty
+    "routes": [],
+    # Requests with profile=<token> in their query string are profiled,
+    # whatever the sample rate. Disabled if empty
+    "token": None,
+    # Profile loading of datasets when the server starts
+    "startup": False,
+}
+
+# Length of query strings beyond which they are cut in filenames
+MAX_PARAMS_LENGTH = 100
+
+
+def get_profiling_config(bc):
+    """Return profiling config, completed with default values."""
+    config = bc.config.get("profiling", None) or dict()
+
+    return {**DEFAULT_PROFILING_CONFIG, **config}
+
+
+def to_filename(s):
+    """Turn a string into a safe filename fragment."""
+    return re.sub(r"[^A-Za-z0-9_.=-]+", "_", s).strip("_")
+
+
+def get_profile_path(folder, name, params=""):
+    """Return path of a profile named after a route and its parameters."""
+    now = time.time()
+    filename = "_".join(
+        fragment
+        for fragment in [
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(now))
+            + f".{int(now * 1000) % 1000:03d}",
+            str(os.getpid()),
+            to_filename(name),
+            to_filename(params)[:MAX_PARAMS_LENGTH],
+        ]
+        if fragment != ""
+    )
+
+    return Path(folder) / f"{filename}.prof"
+
+
+@contextmanager
+def profile(path):
+    """Profile the enclosed block and save its profile at ``path``."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(path)
+        console.log(f"Saved profile {path}")
+
+
+@contextmanager
+def profile_startup(bc, name="startup"):
+    """Profile the enclosed block if startup profiling is enabled."""
+    config = get_profiling_config(bc)
+    if not (config["enabled"] and config["startup"]):
+        yield
+        return
+
+    with profile(get_profile_path(config["folder"], name)):
+        yield
+
+
+def should_profile(config):
+    """Return whether the current request should be profiled.
+
+    Requests which don't match any route are never profiled.
+    """
+    if request.url_rule is None:
+        return False
+
+    token = request.args.get("profile", default=None, type=str)
+    if token is not None and config["token"]:
+        return hmac.compare_digest(token, str(config["token"]))
+
+    route = request.url_rule.rule
+    if len(config["routes"]) > 0 and not any(
+        fnmatch(route, pattern) for pattern in config["routes"]
+    ):
+        return False
+
+    return random.random() < config["sample_rate"]
+
+
+def init_app(bc):
+    """Register request hooks profiling requests, if enabled.
+
+    Hooks should be registered after other hooks, so that
+    requests answered by other hooks (such as 304 responses)
+    are not profiled.
+    """
+    config = get_profiling_config(bc)
+    if not config["enabled"]:
+        return
+
+    # Only one profiler can be active at a time in recent Python versions,
+    # hence concurrent requests are not profiled
+    lock = threading.Lock()
+
+    @bc.app.before_request
+    def start_profiler():
+        if not should_profile(config) or not lock.acquire(blocking=False):
+            return
+
+        g.profiler = cProfile.Profile()
+        try:
+            g.profiler.enable()
+        except ValueError:
+            g.pop("profiler")
+            lock.release()
+
+    # Profiles are saved on teardown,
+    # which also happens when requests fail
+    @bc.app.teardown_request
+    def save_profile(exception=None):
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return
+
+        try:
+            profiler.disable()
+            params = urlencode(
+                [
+                    (name, value)
+                    for name, value in request.args.items(multi=True)
+                    if name != "profile"
+                ]
+            )
+            path = get_profile_path(
+                config["folder"], request.url_rule.rule, params
+            )
+            path.parent.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(path)
+        finally:
+            lock.release()
@@ -0,0 +1,63 @@
+"""Util functions to serialize endpoint responses."""
+
+import numpy as np
+from flask import current_app, jsonify, request
+
+from brain_cockpit.metrics import timer
+
+BINARY_MIMETYPE = "application/octet-stream"
+
+# Headers describing binary arrays,
+# which should be readable by the front-end
+ARRAY_HEADERS = [
+    "X-Array-Dtype",
+    "X-Array-Shape",
+    "X-Array-Nan-Count",
+]
+
+
+def wants_binary_response():
+    """Return whether the current request asks for a binary response.
+
+    Clients can either pass ``format=f32`` in the query string,
+    or prefer ``application/octet-stream`` in their ``Accept`` header.
+    """
+    response_format = request.args.get("format", default=None, type=str)
+    if response_format is not None:
+        return response_format == "f32"
+
+    return (
+        request.accept_mimetypes.best_match(
+            ["application/json", BINARY_MIMETYPE]
+        )
+        == BINARY_MIMETYPE
+    )
+
+
+def array_response(array):
+    """Serialize a numpy array according to the current request.
+
+    By default, arrays are returned as JSON lists.
+    Binary responses contain the raw little-endian float32 buffer
+    of the array, whose shape and number of NaN values
+    are described in headers. Missing arrays (None)
+    yield an empty response with status 204.
+    """
+    with timer("serialize"):
+        if not wants_binary_response():
+            return jsonify(array)
+
+        if array is None:
+            return "", 204
+
+        array = np.ascontiguousarray(array, dtype="<f4")
+        response = current_app.response_class(
+            array.tobytes(), mimetype=BINARY_MIMETYPE
+        )
+        response.headers["X-Array-Dtype"] = "float32"
+        response.headers["X-Array-Shape"] = ",".join(map(str, array.shape))
+        response.headers["X-Array-Nan-Count"] = str(
+            int(np.count_nonzero(np.isnan(array)))
+        )
+
+        return response
@@ -1,13 +1,19 @@
 import gzip
+import hashlib
+import json
 import nibabel as nib
 import numpy as np
-import operator
 import os
-import struct
 
 from pathlib import Path
 
-from brain_cockpit.utils import console, get_progress
+from brain_cockpit.utils import (
+    console,
+    get_dataset_option,
+    get_n_workers,
+    get_progress,
+    parallel_map,
+)
 from gltflib import (
     GLTF,
     GLTFModel,
@@ -24,10 +30,22 @@ from gltflib import (
     BufferTarget,
     ComponentType,
     FileResource,
+    GLBResource,
 )
 from nilearn import surface
 from scipy.sparse import coo_matrix
 
+# Name of the file describing sources of GLTF files of a folder
+GLTF_MANIFEST_FILENAME = ".gltf_manifest.json"
+
+# Meshes can either be exported as a GLTF file referencing
+# separate binary buffers, or as a single binary GLB file
+# with quantized positions
+MESH_FORMATS = ["gltf", "glb"]
+
+# Quantized positions are stored as int16 values in [-32767, 32767]
+QUANTIZATION_RANGE = 32767
+
 
 def read_freesurfer(freesurfer_file):
     """Read freesurfer file"""
@@ -89,6 +107,141 @@ def mesh_to_graph(mesh):
     return connectivity
 
 
+def read_mesh(mesh_path):
+    """Read vertices and triangles of a gifti or freesurfer mesh."""
+    if mesh_path[-3:] == "gii" or mesh_path[-6:] == "gii.gz":
+        vertices, triangles = read_gii(mesh_path)
+    else:
+        vertices, triangles = read_freesurfer(mesh_path)
+
+    return np.asarray(vertices), np.asarray(triangles)
+
+
+def quantize_positions(vertices):
+    """Quantize vertex positions as int16 values.
+
+    Positions are mapped to ``[-32767, 32767]`` along each axis
+    so that ``vertices ~= quantized * scale + translation``.
+
+    Returns
+    -------
+    quantized: np.ndarray of size (n_vertices, 3)
+    translation: list of 3 float
+    scale: list of 3 float
+    """
+    mins = vertices.min(axis=0)
+    maxs = vertices.max(axis=0)
+    translation = (mins + maxs) / 2
+    scale = (maxs - mins) / (2 * QUANTIZATION_RANGE)
+    # Avoid dividing by zero for flat meshes
+    scale[scale == 0] = 1
+
+    quantized = np.clip(
+        np.rint((vertices - translation) / scale),
+        -QUANTIZATION_RANGE,
+        QUANTIZATION_RANGE,
+    ).astype(np.int16)
+
+    return quantized, translation.tolist(), scale.tolist()
+
+
+def compute_glb_from_gifti(mesh_path, output_folder, output_filename):
+    """
+    Builds a single binary GLB file from a given gifti file.
+    Vertex positions are quantized as int16 values
+    (as allowed by the KHR_mesh_quantization extension),
+    and the node holding the mesh scales them back to their
+    original coordinates. Triangles are stored as uint16 values
+    when the mesh has few enough vertices.
+
+    Parameters
+    ----------
+    mesh_path: string
+        Path to input gifti file
+    output_folder: string
+        Folder in which the GLB file is written
+    output_filename: string
+        Name of the GLB file, without extension
+    """
+    mesh_output_folder = Path(output_folder)
+    if not os.path.exists(mesh_output_folder):
+        os.mkdir(mesh_output_folder)
+
+    vertices, triangles = read_mesh(mesh_path)
+    quantized, translation, scale = quantize_positions(vertices)
+
+    # Each vertex attribute should be aligned on 4 bytes,
+    # hence quantized positions are padded with a 4th component
+    positions = np.zeros((len(quantized), 4), dtype="<i2")
+    positions[:, :3] = quantized
+    positions_bytearray = positions.tobytes()
+
+    # 65535 is reserved for primitive restart
+    if len(vertices) < 65535:
+        indices_dtype = "<u2"
+        indices_component_type = ComponentType.UNSIGNED_SHORT.value
+    else:
+        indices_dtype = "<u4"
+        indices_component_type = ComponentType.UNSIGNED_INT.value
+    triangles_bytearray = triangles.astype(indices_dtype).tobytes()
+
+    data = positions_bytearray + triangles_bytearray
+    # Buffer views should be aligned on 4 bytes
+    data += b"\x00" * (-len(data) % 4)
+
+    model = GLTFModel(
+        asset=Asset(version="2.0"),
+        extensionsUsed=["KHR_mesh_quantization"],
+        extensionsRequired=["KHR_mesh_quantization"],
+        scenes=[Scene(nodes=[0])],
+        nodes=[Node(mesh=0, translation=translation, scale=scale)],
+        meshes=[
+            Mesh(
+                primitives=[
+                    Primitive(attributes=Attributes(POSITION=0), indices=1)
+                ]
+            )
+        ],
+        buffers=[Buffer(byteLength=len(data))],
+        bufferViews=[
+            BufferView(
+                buffer=0,
+                byteOffset=0,
+                byteLength=len(positions_bytearray),
+                byteStride=positions.strides[0],
+                target=BufferTarget.ARRAY_BUFFER.value,
+            ),
+            BufferView(
+                buffer=0,
+                byteOffset=len(positions_bytearray),
+                byteLength=len(triangles_bytearray),
+                target=BufferTarget.ELEMENT_ARRAY_BUFFER.value,
+            ),
+        ],
+        accessors=[
+            Accessor(
+                bufferView=0,
+                byteOffset=0,
+                componentType=ComponentType.SHORT.value,
+                count=len(vertices),
+                type=AccessorType.VEC3.value,
+                min=quantized.min(axis=0).tolist(),
+                max=quantized.max(axis=0).tolist(),
+            ),
+            Accessor(
+                bufferView=1,
+                byteOffset=0,
+                componentType=indices_component_type,
+                count=3 * len(triangles),
+                type=AccessorType.SCALAR.value,
+            ),
+        ],
+    )
+
+    gltf = GLTF(model=model, resources=[GLBResource(data)])
+    gltf.export(os.path.join(mesh_output_folder, f"{output_filename}.glb"))
+
+
 def compute_gltf_from_gifti(mesh_path, output_folder, output_filename):
     """
     Builds GLTF files optimized for webGL from a given gifti file.
@@ -109,33 +262,15 @@ def compute_gltf_from_gifti(mesh_path, output_folder, output_filename):
     if not os.path.exists(mesh_output_folder):
         os.mkdir(mesh_output_folder)
 
-    vertices, triangles = [], []
-    if mesh_path[-3:] == "gii" or mesh_path[-6:] == "gii.gz":
-        vertices, triangles = read_gii(mesh_path)
-    else:
-        vertices, triangles = read_freesurfer(mesh_path)
-
-    vertices = vertices.tolist()
-    triangles = triangles.tolist()
+    vertices, triangles = read_mesh(mesh_path)
 
-    vertex_bytearray = bytearray()
-    for vertex in vertices:
-        for value in vertex:
-            vertex_bytearray.extend(struct.pack("f", value))
+    # Encode buffers as little-endian float32 and uint32 values,
+    # as expected by the GLTF specification
+    vertex_bytearray = vertices.astype("<f4").tobytes()
+    triangles_bytearray = triangles.astype("<u4").tobytes()
 
-    mins = [
-        min([operator.itemgetter(i)(vertex) for vertex in vertices])
-        for i in range(3)
-    ]
-    maxs = [
-        max([operator.itemgetter(i)(vertex) for vertex in vertices])
-        for i in range(3)
-    ]
-
-    triangles_bytearray = bytearray()
-    for triangle in triangles:
-        for vertex_index in triangle:
-            triangles_bytearray.extend(struct.pack("I", vertex_index))
+    mins = vertices.min(axis=0).tolist()
+    maxs = vertices.max(axis=0).tolist()
 
     model = GLTFModel(
         asset=Asset(version="2.0"),
@@ -202,66 +337,235 @@ def compute_gltf_from_gifti(mesh_path, output_folder, output_filename):
     gltf.export(os.path.join(mesh_output_folder, f"{output_filename}.gltf"))
 
 
-def create_dataset_glft_files(bc, dataset, mesh_paths):
-    dataset_folder = Path(dataset["path"]).parent
+def hash_file(path):
+    """Return sha256 digest of the content of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
 
-    with get_progress(console=console) as progress:
-        task_mesh = progress.add_task(
-            "Generate GLTF meshes", total=len(mesh_paths)
+    return h.hexdigest()
+
+
+def load_manifest(output_folder):
+    """Load manifest describing sources of GLTF files of a folder.
+
+    Returns
+    -------
+    manifest: dict
+        Dictionary mapping output filenames (with their extension)
+        to the path, size,
+        modification time and hash of the mesh they were computed from
+    """
+    try:
+        with open(Path(output_folder) / GLTF_MANIFEST_FILENAME, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def save_manifest(output_folder, manifest):
+    with open(Path(output_folder) / GLTF_MANIFEST_FILENAME, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def describe_source(mesh_path, compute_hash=True):
+    """Describe mesh file from which a GLTF file is computed."""
+    stat = os.stat(mesh_path)
+    return {
+        "source": str(Path(mesh_path).resolve()),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": hash_file(mesh_path) if compute_hash else None,
+    }
+
+
+def is_up_to_date(entry, mesh_path, output_path):
+    """Return whether a GLTF file was computed from the current mesh.
+
+    Sizes and modification times are compared first,
+    and file contents are only hashed if they differ,
+    so that touched but unchanged meshes are not converted again.
+    In this case, ``entry`` is updated with the new modification time.
+    Existing GLTF files whose mesh was removed are kept as they are.
+    """
+    if not Path(output_path).exists():
+        return False
+    if not Path(mesh_path).exists():
+        console.log(
+            f"Mesh {mesh_path} not found, using existing {output_path}",
+            style="yellow",
         )
-        for mesh_path in mesh_paths:
-            mesh_stem = mesh_path.stem.split(".")[0]
-            if mesh_path.is_absolute():
-                mesh_absolute_path = mesh_path
-                output_folder = mesh_path.parent
-            elif dataset_folder.is_absolute():
-                mesh_absolute_path = dataset_folder / mesh_path
-                output_folder = dataset_folder / mesh_path.parent
-            else:
-                mesh_absolute_path = (
-                    Path(bc.config_path).parent / dataset_folder / mesh_path
-                )
-                output_folder = (
-                    Path(bc.config_path).parent
-                    / dataset_folder
-                    / mesh_path.parent
-                )
-            output_filename = mesh_stem
-
-            if not (output_folder / f"{output_filename}.gltf").exists():
-                compute_gltf_from_gifti(
-                    str(mesh_absolute_path),
-                    str(output_folder),
-                    output_filename,
-                )
-
-            if "mesh_types" in dataset:
-                if (
-                    "default" in dataset["mesh_types"]
-                    and "other" in dataset["mesh_types"]
-                ):
-                    mesh_absolute_path = Path(mesh_absolute_path)
-                    default_mesh_type = dataset["mesh_types"]["default"]
-                    other_mesh_types = dataset["mesh_types"]["other"]
-
-                    for other_mesh_type in other_mesh_types:
-                        other_mesh_stem = mesh_stem.replace(
+        return True
+    if entry is None:
+        return False
+
+    source = describe_source(mesh_path, compute_hash=False)
+    if entry["source"] != source["source"]:
+        return False
+    if (
+        entry["size"] == source["size"]
+        and entry["mtime_ns"] == source["mtime_ns"]
+    ):
+        return True
+
+    if entry["sha256"] != hash_file(mesh_path):
+        return False
+
+    # Record new modification time to avoid hashing this file again
+    entry.update(size=source["size"], mtime_ns=source["mtime_ns"])
+    return True
+
+
+def convert_mesh(job):
+    """Convert one mesh to GLTF or GLB and describe its source.
+
+    Defined at the top level of this module
+    so that it can be run in a process pool.
+    """
+    mesh_path, output_folder, output_filename, mesh_format = job
+    if mesh_format == "glb":
+        compute_glb_from_gifti(
+            str(mesh_path), str(output_folder), output_filename
+        )
+    else:
+        compute_gltf_from_gifti(
+            str(mesh_path), str(output_folder), output_filename
+        )
+
+    return describe_source(mesh_path)
+
+
+def list_dataset_meshes(bc, dataset, mesh_paths):
+    """List meshes of a dataset which should be converted to GLTF.
+
+    Returns
+    -------
+    jobs: list of (mesh_path, output_folder, output_filename)
+        One tuple per mesh path and mesh type
+    """
+    dataset_folder = Path(dataset["path"]).parent
+
+    jobs = []
+    for mesh_path in mesh_paths:
+        mesh_stem = mesh_path.stem.split(".")[0]
+        if mesh_path.is_absolute():
+            mesh_absolute_path = mesh_path
+            output_folder = mesh_path.parent
+        elif dataset_folder.is_absolute():
+            mesh_absolute_path = dataset_folder / mesh_path
+            output_folder = dataset_folder / mesh_path.parent
+        else:
+            mesh_absolute_path = (
+                Path(bc.config_path).parent / dataset_folder / mesh_path
+            )
+            output_folder = (
+                Path(bc.config_path).parent / dataset_folder / mesh_path.parent
+            )
+
+        jobs.append((mesh_absolute_path, output_folder, mesh_stem))
+
+        if "mesh_types" in dataset:
+            if (
+                "default" in dataset["mesh_types"]
+                and "other" in dataset["mesh_types"]
+            ):
+                default_mesh_type = dataset["mesh_types"]["default"]
+                other_mesh_types = dataset["mesh_types"]["other"]
+
+                for other_mesh_type in other_mesh_types:
+                    other_mesh_stem = mesh_stem.replace(
+                        default_mesh_type, other_mesh_type
+                    )
+                    other_mesh_absolute_path = (
+                        mesh_absolute_path.parent
+                        / mesh_absolute_path.name.replace(
                             default_mesh_type, other_mesh_type
                         )
-                        other_mesh_absolute_path = (
-                            mesh_absolute_path.parent
-                            / mesh_absolute_path.name.replace(
-                                default_mesh_type, other_mesh_type
-                            )
+                    )
+                    jobs.append(
+                        (
+                            other_mesh_absolute_path,
+                            output_folder,
+                            other_mesh_stem,
                         )
+                    )
+
+    return jobs
+
+
+def get_mesh_format(bc, dataset):
+    """Return format in which meshes of a dataset are exported.
+
+    It is set with ``mesh_format`` in the config,
+    either for all datasets or for a given dataset.
+    """
+    mesh_format = get_dataset_option(bc, dataset, "mesh_format", "gltf")
+    if mesh_format not in MESH_FORMATS:
+        raise ValueError(
+            f"Unknown mesh format {mesh_format}, "
+            f"should be one of {MESH_FORMATS}"
+        )
+
+    return mesh_format
 
-                        if not (
-                            output_folder / f"{other_mesh_stem}.gltf"
-                        ).exists():
-                            compute_gltf_from_gifti(
-                                str(other_mesh_absolute_path),
-                                str(output_folder),
-                                other_mesh_stem,
-                            )
 
+def create_dataset_glft_files(bc, dataset, mesh_paths):
+    """Create GLTF (or GLB) files for all meshes of a dataset.
+
+    Only meshes which changed since their GLTF file was computed
+    are converted, in parallel if ``loading_workers`` is set
+    in the config. Sources of GLTF files are recorded in a manifest
+    stored in each output folder.
+    """
+    mesh_format = get_mesh_format(bc, dataset)
+    jobs = [
+        (mesh_path, output_folder, output_filename, mesh_format)
+        for mesh_path, output_folder, output_filename in list_dataset_meshes(
+            bc, dataset, mesh_paths
+        )
+    ]
+
+    # Several mesh paths can point to the same file
+    jobs = list(dict.fromkeys(jobs))
+
+    manifests = {
+        output_folder: load_manifest(output_folder)
+        for _, output_folder, _, _ in jobs
+    }
+    stale_jobs = [
+        job
+        for job in jobs
+        if not is_up_to_date(
+            manifests[job[1]].get(f"{job[2]}.{mesh_format}", None),
+            job[0],
+            job[1] / f"{job[2]}.{mesh_format}",
+        )
+    ]
+
+    # Meshes which can't be found are skipped rather than failing
+    for job in stale_jobs:
+        if not Path(job[0]).exists():
+            console.log(f"Mesh {job[0]} not found", style="yellow")
+    stale_jobs = [job for job in stale_jobs if Path(job[0]).exists()]
+
+    with get_progress(console=console) as progress:
+        task_mesh = progress.add_task("Generate GLTF meshes", total=len(jobs))
+        progress.update(task_mesh, advance=len(jobs) - len(stale_jobs))
+
+        for job, source in zip(
+            stale_jobs,
+            parallel_map(
+                convert_mesh, stale_jobs, n_workers=get_n_workers(bc)
+            ),
+        ):
+            _, output_folder, output_filename, _ = job
+            manifests[output_folder][
+                f"{output_filename}.{mesh_format}"
+            ] = source
             progress.update(task_mesh, advance=1)
+
+    # Only write manifests which changed
+    for output_folder, manifest in manifests.items():
+        if manifest != load_manifest(output_folder):
+            save_manifest(output_folder, manifest)
@@ -0,0 +1,422 @@
+"""Transport plans of alignment models.
+
+Alignment models such as fugw models map vertices of a source mesh
+onto vertices of a target mesh through a transport plan ``pi``
+of shape (n_source_vertices, n_target_vertices).
+Transporting a few vertices only requires reading
+the corresponding rows or columns of this plan,
+rather than multiplying it with dense one-hot maps.
+"""
+
+import threading
+import zipfile
+
+import numpy as np
+from scipy import sparse
+
+# Version of the format in which plans are saved,
+# which should be incremented whenever this format changes
+TRANSPORT_PLAN_VERSION = 1
+
+# Meshes onto which voxels can be transported
+ROLES = ["source", "target"]
+
+
+class TransportPlan:
+    """Transport plan between a source and a target mesh.
+
+    Transporting source vertices yields the same maps
+    as ``model.transform`` with one-hot inputs,
+    and transporting target vertices
+    the same maps as ``model.inverse_transform``.
+
+    Parameters
+    ----------
+    pi: np.ndarray or scipy.sparse matrix
+        Transport plan of size (n_source_vertices, n_target_vertices)
+    source_mass: np.ndarray of size (n_source_vertices,) or None
+        Sums of rows of ``pi``, computed if None
+    target_mass: np.ndarray of size (n_target_vertices,) or None
+        Sums of columns of ``pi``, computed if None
+    """
+
+    def __init__(self, pi, source_mass=None, target_mass=None):
+        if sparse.issparse(pi):
+            pi = sparse.csr_matrix(pi)
+        self.pi = pi
+        self.source_mass = (
+            np.asarray(pi.sum(axis=1)).ravel()
+            if source_mass is None
+            else source_mass
+        )
+        self.target_mass = (
+            np.asarray(pi.sum(axis=0)).ravel()
+            if target_mass is None
+            else target_mass
+        )
+        # Transposed copy of sparse plans, built on first use
+        self._pi_t = None
+        self._pi_t_lock = threading.Lock()
+
+    @classmethod
+    def from_model(cls, model):
+        """Extract transport plan of an alignment model.
+
+        Plans stored as torch tensors, either dense or sparse,
+        are converted without copying when possible.
+        """
+        pi = model.pi
+        if hasattr(pi, "layout") and "sparse_csr" in str(pi.layout):
+            pi = sparse.csr_matrix(
+                (
+                    pi.values().numpy(),
+                    pi.col_indices().numpy(),
+                    pi.crow_indices().numpy(),
+                ),
+                shape=tuple(pi.shape),
+            )
+        elif hasattr(pi, "is_sparse") and pi.is_sparse:
+            pi = pi.coalesce()
+            pi = sparse.csr_matrix(
+                (pi.values().numpy(), tuple(pi.indices().numpy())),
+                shape=tuple(pi.shape),
+            )
+        elif hasattr(pi, "detach"):
+            pi = pi.detach().cpu().numpy()
+
+        return cls(pi)
+
+    def sparsify(self, threshold=0, max_per_row=None):
+        """Return a sparse copy of this plan.
+
+        Parameters
+        ----------
+        threshold: float
+            Entries smaller than this fraction of the largest entry
+            of their row are dropped
+        max_per_row: int or None
+            If set, only the largest ``max_per_row`` entries
+            of each row are kept
+
+        Returns
+        -------
+        plan: TransportPlan
+            Plan with CSR matrix, whose masses are those
+            of the remaining entries
+        """
+        pi = sparse.csr_matrix(self.pi, dtype=np.float32)
+        pi.eliminate_zeros()
+
+        keep = np.ones(pi.nnz, dtype=bool)
+        row_lengths = np.diff(pi.indptr)
+        rows = np.repeat(np.arange(pi.shape[0]), row_lengths)
+        if threshold > 0 and pi.nnz > 0:
+            row_max = np.asarray(pi.max(axis=1).todense()).ravel()
+            keep &= pi.data >= threshold * row_max[rows]
+        if max_per_row is not None:
+            # Rank entries of each row by decreasing value
+            order = np.lexsort((-pi.data, rows))
+            ranks = np.empty(pi.nnz, dtype=np.int64)
+            ranks[order] = np.arange(pi.nnz) - np.repeat(
+                pi.indptr[:-1], row_lengths
+            )
+            keep &= ranks < max_per_row
+
+        pi = sparse.coo_matrix(
+            (pi.data[keep], (rows[keep], pi.indices[keep])), shape=pi.shape
+        ).tocsr()
+
+        return TransportPlan(pi)
+
+    def save(self, path):
+        """Save plan in an uncompressed .npz file.
+
+        Arrays are stored uncompressed so that
+        they can be memory-mapped when loading the plan.
+        """
+        pi = sparse.csr_matrix(self.pi)
+        # Use the same index type as scipy to avoid copies when loading
+        index_dtype = (
+            np.int32
+            if max(pi.nnz, *pi.shape) < np.iinfo(np.int32).max
+            else np.int64
+        )
+        np.savez(
+            path,
+            version=np.array(TRANSPORT_PLAN_VERSION),
+            shape=np.array(pi.shape),
+            data=pi.data,
+            indices=pi.indices.astype(index_dtype),
+            indptr=pi.indptr.astype(index_dtype),
+            source_mass=self.source_mass,
+            target_mass=self.target_mass,
+        )
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load plan saved with ``save``.
+
+        If ``mmap`` is True, arrays are memory-mapped
+        rather than read in memory.
+        """
+        arrays = _load_npz(path, mmap=mmap)
+        if int(arrays["version"]) != TRANSPORT_PLAN_VERSION:
+            raise ValueError(
+                f"{path} was saved with another version of brain-cockpit"
+            )
+
+        shape = tuple(int(n) for n in arrays["shape"])
+        pi = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=shape,
+        )
+
+        return cls(
+            pi,
+            source_mass=arrays["source_mass"],
+            target_mass=arrays["target_mass"],
+        )
+
+    @property
+    def n_source(self):
+        return self.pi.shape[0]
+
+    @property
+    def n_target(self):
+        return self.pi.shape[1]
+
+    @property
+    def nbytes(self):
+        if sparse.issparse(self.pi):
+            # Sparse plans are counted twice, to account for
+            # their transposed copy built by ``get_pi_t``
+            nbytes = 2 * (
+                self.pi.data.nbytes
+                + self.pi.indices.nbytes
+                + self.pi.indptr.nbytes
+            )
+        else:
+            nbytes = self.pi.nbytes
+
+        return nbytes + self.source_mass.nbytes + self.target_mass.nbytes
+
+    def get_n_vertices(self, mesh):
+        """Return number of vertices of the source or target mesh."""
+        return self.n_source if mesh == "source" else self.n_target
+
+    def get_pi_t(self):
+        """Return the transposed plan.
+
+        Slicing columns of a CSR matrix requires scanning
+        all its values, hence a CSR copy of the transposed plan
+        is built once and then sliced by rows.
+        """
+        if not sparse.issparse(self.pi):
+            return self.pi.T
+
+        with self._pi_t_lock:
+            if self._pi_t is None:
+                self._pi_t = sparse.csr_matrix(self.pi.T)
+            return self._pi_t
+
+    def get_weights(self, voxel_indices, onto="target"):
+        """Return rows of the plan used to transport vertices.
+
+        Returns
+        -------
+        weights: np.ndarray or scipy.sparse.csr_matrix
+            Matrix of size (n_voxels, n_vertices),
+            sparse if the plan is sparse
+        mass: np.ndarray of size (n_vertices,)
+            Mass of vertices of the ``onto`` mesh
+        """
+        voxel_indices = np.asarray(voxel_indices, dtype=np.int64)
+        if onto == "target":
+            return self.pi[voxel_indices], self.target_mass
+
+        return self.get_pi_t()[voxel_indices], self.source_mass
+
+    def transport(self, voxel_indices, onto="target"):
+        """Transport vertices of one mesh onto the other mesh.
+
+        Parameters
+        ----------
+        voxel_indices: array of int of size (n_voxels,)
+            Indices of vertices of the source mesh if ``onto``
+            is ``"target"``, and of the target mesh otherwise
+        onto: str in ["source", "target"]
+            Mesh onto which vertices are transported
+
+        Returns
+        -------
+        maps: np.ndarray of size (n_voxels, n_vertices)
+            Maps on the ``onto`` mesh, one for each voxel
+        """
+        weights, mass = self.get_weights(voxel_indices, onto=onto)
+        if sparse.issparse(weights):
+            weights = weights.toarray()
+
+        # Vertices which receive no mass yield NaN values,
+        # as with fugw models
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.asarray(weights) / mass
+
+    def transport_mean(self, voxel_indices, onto="target"):
+        """Return the mean of maps of transported vertices.
+
+        Rows of sparse plans are summed without being densified,
+        so that large sets of vertices can be transported.
+
+        Returns
+        -------
+        mean_map: np.ndarray of size (n_vertices,)
+        """
+        weights, mass = self.get_weights(voxel_indices, onto=onto)
+        total = np.asarray(weights.sum(axis=0)).ravel()
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return total / mass / max(weights.shape[0], 1)
+
+    def transport_top_k(self, voxel_indices, k, onto="target"):
+        """Return the k largest values of maps of transported vertices.
+
+        Values are only computed for non-zero entries of sparse plans,
+        so that maps are never densified. Rows with fewer
+        than ``k`` non-zero entries therefore yield fewer values.
+
+        Returns
+        -------
+        indices: list of np.ndarray
+            For each vertex, indices of the largest values,
+            sorted by decreasing value
+        values: list of np.ndarray
+        """
+        weights, mass = self.get_weights(voxel_indices, onto=onto)
+        if not sparse.issparse(weights):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                indices, values = top_k(np.asarray(weights) / mass, k)
+            return list(indices), list(values)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            values = weights.data / mass[weights.indices]
+        row_lengths = np.diff(weights.indptr)
+        rows = np.repeat(np.arange(weights.shape[0]), row_lengths)
+
+        # Rank entries of each row by decreasing value, NaN values last
+        order = np.lexsort(
+            (-np.where(np.isnan(values), -np.inf, values), rows)
+        )
+        ranks = np.empty(len(values), dtype=np.int64)
+        ranks[order] = np.arange(len(values)) - np.repeat(
+            weights.indptr[:-1], row_lengths
+        )
+        kept = order[ranks[order] < k]
+        splits = np.cumsum(np.minimum(row_lengths, k))[:-1]
+
+        return (
+            np.split(weights.indices[kept], splits),
+            np.split(values[kept], splits),
+        )
+
+    def transport_maps(self, maps, onto="target"):
+        """Transport maps of one mesh onto the other mesh.
+
+        All maps are transported with one matrix multiplication,
+        and yield the same results as ``model.transform``
+        (or ``model.inverse_transform`` if ``onto`` is ``"source"``).
+
+        Parameters
+        ----------
+        maps: np.ndarray of size (n_maps, n_vertices)
+            Maps on the source mesh if ``onto`` is ``"target"``,
+            and on the target mesh otherwise
+        onto: str in ["source", "target"]
+            Mesh onto which maps are transported
+
+        Returns
+        -------
+        transported_maps: np.ndarray of size (n_maps, n_vertices)
+        """
+        if onto == "target":
+            transported = self.pi.T @ maps.T
+            mass = self.target_mass
+        else:
+            transported = self.pi @ maps.T
+            mass = self.source_mass
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.asarray(transported).T / mass
+
+
+def top_k(maps, k):
+    """Return the k largest values of maps and their indices.
+
+    Parameters
+    ----------
+    maps: np.ndarray of size (..., n_vertices)
+    k: int
+
+    Returns
+    -------
+    indices: np.ndarray of size (..., k)
+        Indices of the largest values, sorted by decreasing value
+    values: np.ndarray of size (..., k)
+    """
+    k = min(k, maps.shape[-1])
+    # NaN values are ranked last
+    ranked = np.where(np.isnan(maps), -np.inf, maps)
+    indices = np.argpartition(-ranked, k - 1, axis=-1)[..., :k]
+    order = np.argsort(
+        -np.take_along_axis(ranked, indices, axis=-1), axis=-1, kind="stable"
+    )
+    indices = np.take_along_axis(indices, order, axis=-1)
+
+    return indices, np.take_along_axis(maps, indices, axis=-1)
+
+
+def _load_npz(path, mmap=True):
+    """Load all arrays of an .npz file.
+
+    Uncompressed arrays are memory-mapped if ``mmap`` is True,
+    which ``np.load`` does not support for .npz files.
+    """
+    if not mmap:
+        with np.load(path) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    arrays = dict()
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            name = info.filename[: -len(".npy")]
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as array_file:
+                    arrays[name] = np.lib.format.read_array(array_file)
+                continue
+
+            # Skip local header of the file in the archive,
+            # whose size is given by its last two fields
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), "<u2")
+            f.seek(int(name_length) + int(extra_length), 1)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                header = np.lib.format.read_array_header_1_0(f)
+            else:
+                header = np.lib.format.read_array_header_2_0(f)
+            shape, fortran_order, dtype = header
+            if dtype.hasobject or len(shape) == 0 or 0 in shape:
+                with archive.open(info) as array_file:
+                    arrays[name] = np.lib.format.read_array(array_file)
+                continue
+
+            arrays[name] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+
+    return arrays
@@ -1,12 +1,14 @@
 """Util functions used throughout brain-cockpit."""
 
-import functools
+import hashlib
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import pandas as pd
 import yaml
-from joblib import Memory
 from rich.console import Console
 from rich.progress import (
     BarColumn,
@@ -22,6 +24,9 @@ from rich.progress import (
 # `rich` console used throughout the codebase
 console = Console()
 
+# Size of caches (in megabytes) whose budget is not set in the config
+DEFAULT_CACHE_BUDGET_MB = 4096
+
 
 # `rich` progress bar used throughout the codebase
 def get_progress(**kwargs):
@@ -39,32 +44,220 @@ def get_progress(**kwargs):
     )
 
 
-def get_memory(bc):
-    """Return joblib memory."""
-    return Memory(bc.config["cache_folder"], verbose=0)
+class ByteLRUCache:
+    """Thread-safe least-recently-used cache bounded by a number of bytes.
+
+    Parameters
+    ----------
+    max_bytes: int or None
+        Maximum total size of cached values.
+        Least recently used values are evicted when it is exceeded.
+        If None, values are never evicted.
+    get_size: callable
+        Function returning the size in bytes of a cached value.
+        Defaults to the ``nbytes`` attribute of values.
+    """
+
+    def __init__(self, max_bytes=None, get_size=None):
+        self.max_bytes = max_bytes
+        self.get_size = (
+            get_size
+            if get_size is not None
+            else (lambda value: getattr(value, "nbytes", 0))
+        )
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        # Locks of keys whose value is being computed
+        self._key_locks = dict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
 
+    def get(self, key, default=None):
+        """Return cached value and mark it as recently used."""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+            return default
 
-def bc_cache(bc):
-    """Cache functions with brain-cockpit cache."""
+    def put(self, key, value):
+        """Cache value, evicting least recently used values if needed."""
+        size = self.get_size(value)
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.current_bytes += size
 
-    def _inner_decorator(func):
-        @functools.wraps(func)
-        def wrapped(*args, **kwargs):
-            # Use joblib cache if and only if cache_folder is defined
-            if (
-                bc.config["cache_folder"] is not None
-                and bc.config["cache_folder"] != ""
+            # Evict least recently used values,
+            # but always keep the value which was just added
+            while (
+                self.max_bytes is not None
+                and self.current_bytes > self.max_bytes
+                and len(self._items) > 1
             ):
-                console.log(f"Using cache {bc.config['cache_folder']}")
-                mem = get_memory(bc)
-                return mem.cache(func)(*args, **kwargs)
-            else:
-                console.log("Not using cache for dataset")
-                return func(*args, **kwargs)
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+                self.evicted_bytes += evicted_size
+
+    def get_or_compute(self, key, compute):
+        """Return cached value, computing and caching it if missing.
+
+        ``compute`` is called outside of the cache lock,
+        so that slow computations don't block other threads.
+        Threads missing the same key at the same time
+        wait for the first one to compute its value,
+        rather than computing it again.
+        """
+        sentinel = object()
+        value = self.get(key, sentinel)
+        if value is not sentinel:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # The value might have been computed by another thread
+                # while this one was waiting
+                with self._lock:
+                    value = self._items.get(key, (sentinel,))[0]
+                if value is sentinel:
+                    value = compute()
+                    self.put(key, value)
+        finally:
+            with self._lock:
+                if self._key_locks.get(key) is key_lock:
+                    del self._key_locks[key]
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Return usage statistics of the cache."""
+        with self._lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "current_bytes": self.current_bytes,
+                "n_items": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+            }
+
+
+def get_cache_folder(bc):
+    """Return brain-cockpit cache folder, or None if caching is disabled."""
+    # Use cache if and only if cache_folder is defined
+    cache_folder = bc.config.get("cache_folder", None)
+    if cache_folder is None or cache_folder == "":
+        return None
+
+    return Path(cache_folder)
+
+
+def create_cache(config, budget_name):
+    """Create cache whose size is bounded by a budget set in the config.
+
+    Budgets are given in megabytes, and default to
+    ``DEFAULT_CACHE_BUDGET_MB``. Caches are only unbounded
+    if their budget is explicitly set to -1.
+    """
+    budget_mb = config.get(budget_name, None)
+    if budget_mb is None:
+        budget_mb = DEFAULT_CACHE_BUDGET_MB
+
+    return ByteLRUCache(
+        max_bytes=None if budget_mb == -1 else int(budget_mb * 1024**2)
+    )
+
+
+def get_dataset_option(bc, dataset, name, default=None):
+    """Return option set for a dataset, or for all datasets in config."""
+    return dataset.get(name, bc.config.get(name, default))
+
 
-        return wrapped
+def get_n_workers(bc):
+    """Return number of worker processes used to prepare data.
 
-    return _inner_decorator
+    It is set with ``loading_workers`` in the config,
+    where -1 means using all available cores.
+    """
+    n_workers = bc.config.get("loading_workers", None)
+    if n_workers is None:
+        return 1
+    elif n_workers < 0:
+        return os.cpu_count() or 1
+
+    return max(n_workers, 1)
+
+
+def parallel_map(func, iterable, n_workers=1):
+    """Lazily apply a function to all items of an iterable.
+
+    Items are processed in a pool of ``n_workers`` processes
+    when ``n_workers > 1``. Results are yielded in the order of items
+    as soon as they are available, so that callers can consume them
+    without holding all of them in memory.
+    ``func`` should be defined at the top level of a module
+    so that it can be pickled.
+    """
+    items = list(iterable)
+    if n_workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield func(item)
+    else:
+        chunksize = max(1, min(64, len(items) // (4 * n_workers)))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            yield from executor.map(func, items, chunksize=chunksize)
+
+
+def compute_dataset_version(df, file_paths, salt=""):
+    """Compute a string identifying the content of a dataset.
+
+    The returned string changes whenever the dataset description
+    changes, or whenever one of the given files is modified.
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        Dataset description
+    file_paths: list of pathlib.Path
+        Files referenced by the dataset
+    salt: str
+        Additional string to take into account,
+        such as the version of a cache format
+    """
+    h = hashlib.sha256()
+    h.update(str(salt).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            h.update(
+                f"{file_path}:{stat.st_size}:{stat.st_mtime_ns};".encode()
+            )
+        except OSError:
+            h.update(f"{file_path}:missing;".encode())
+
+    return h.hexdigest()
 
 
 def load_config(config_path=None, verbose=False):
@@ -86,6 +279,43 @@ def load_config(config_path=None, verbose=False):
     return config
 
 
+def copy_config(config_path, output_folder, **options):
+    """Copy a brain-cockpit config into another folder.
+
+    Relative dataset paths are made absolute,
+    so that the copy serves the same datasets.
+
+    Parameters
+    ----------
+    config_path: str or pathlib.Path
+        Path to the copied config
+    output_folder: str or pathlib.Path
+        Folder in which the copy is written
+    options: dict
+        Options of the copy overriding those of the config
+
+    Returns
+    -------
+    copied_config_path: pathlib.Path
+    """
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f) or dict()
+
+    for kind in ["features", "alignments"]:
+        datasets = (config.get(kind) or dict()).get("datasets") or dict()
+        for dataset in datasets.values():
+            dataset["path"] = str(
+                Path(config_path).parent.absolute() / dataset["path"]
+            )
+    config.update(options)
+
+    copied_config_path = Path(output_folder) / "config.yaml"
+    with open(copied_config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    return copied_config_path
+
+
 def load_dataset_description(config_path=None, dataset_path=None):
     """Load dataset CSV file.
 
@@ -1,13 +1,40 @@
 import pytest
 
 from brain_cockpit import BrainCockpit
+from brain_cockpit.utils import copy_config
 
 TEST_CONFIG_PATH = "./api/tests/dummy_data/config.yaml"
 
 
 @pytest.fixture
-def client(scope="session", autouse=True):
-    bc = BrainCockpit(config_path=TEST_CONFIG_PATH)
+def bc():
+    return BrainCockpit(config_path=TEST_CONFIG_PATH)
 
+
+@pytest.fixture
+def client(bc, scope="session", autouse=True):
     with bc.app.test_client() as client:
         yield client
+
+
+@pytest.fixture
+def create_bc(tmp_path):
+    """Return function creating a BrainCockpit instance
+    serving test datasets with other config options."""
+
+    def create(**options):
+        return BrainCockpit(
+            config_path=copy_config(TEST_CONFIG_PATH, tmp_path, **options)
+        )
+
+    return create
+
+
+@pytest.fixture
+def contrast_query():
+    return {
+        "mesh": "fsaverage3",
+        "subject_index": 0,
+        "contrast_index": 0,
+        "hemi": "left",
+    }
@@ -1,5 +1,17 @@
 from pathlib import Path
 
+import numpy as np
+
+from brain_cockpit.transport_plan import TransportPlan
+
+MODEL_PATH = "./api/tests/dummy_data/alignments_dataset/mapping.pkl"
+
+
+# The dummy model can't be unpickled without fugw and torch,
+# hence its plan is directly set in cache
+def set_transport_plan(bc, pi):
+    bc.models_cache.put(str(Path(MODEL_PATH).absolute()), TransportPlan(pi))
+
 
 def test_alignment_models(client):
     models = client.get("/alignments/dummy_alignment/models").get_json()
@@ -40,3 +52,131 @@ def test_alignment_model_info(client):
 #     print(dir(info))
 #     print(info.get_data())
 #     assert False
+
+
+def test_align_voxels(bc, client):
+    rng = np.random.default_rng(0)
+    pi = rng.random((642, 642)).astype(np.float32)
+    set_transport_plan(bc, pi)
+
+    m = client.get(
+        "/alignments/dummy_alignment/single_voxel",
+        query_string={"model_id": 0, "voxel": 10, "role": "target"},
+    ).get_json()
+    np.testing.assert_allclose(m, pi[10] / pi.sum(axis=0), rtol=1e-6)
+
+    top = client.get(
+        "/alignments/dummy_alignment/single_voxel",
+        query_string={
+            "model_id": 0,
+            "voxel": 10,
+            "role": "source",
+            "top_k": 5,
+        },
+    ).get_json()
+    m = pi[:, 10] / pi.sum(axis=1)
+    assert top["indices"] == np.argsort(-m)[:5].tolist()
+    np.testing.assert_allclose(top["weights"], np.sort(m)[::-1][:5])
+
+    # Invalid voxels and top_k values are rejected
+    for query_string in [
+        {"model_id": 0, "voxel": 642, "role": "target"},
+        {"model_id": 0, "voxel": -1, "role": "target"},
+        {"model_id": 0, "role": "target"},
+        {"model_id": 0, "voxel": 10, "role": "target", "top_k": 0},
+        {"model_id": 1, "voxel": 10, "role": "target"},
+    ]:
+        res = client.get(
+            "/alignments/dummy_alignment/single_voxel",
+            query_string=query_string,
+        )
+        assert res.status_code == 400
+
+    maps = client.post(
+        "/alignments/dummy_alignment/voxels",
+        json={"model_id": 0, "role": "target", "voxel_indices": [1, 2]},
+    ).get_json()
+    assert np.array(maps).shape == (2, 642)
+
+    roi_mask = np.zeros(642, dtype=bool)
+    roi_mask[[1, 2]] = True
+    top = client.post(
+        "/alignments/dummy_alignment/voxels",
+        json={
+            "model_id": 0,
+            "role": "target",
+            "roi_mask": roi_mask.tolist(),
+            "roi_mean": True,
+            "top_k": 3,
+        },
+    ).get_json()
+    m = np.mean(maps, axis=0)
+    assert top["indices"] == np.argsort(-m)[:3].tolist()
+
+    res = client.post(
+        "/alignments/dummy_alignment/voxels",
+        json={"model_id": 0, "role": "target", "voxel_indices": [642]},
+    )
+    assert res.status_code == 400
+
+    # Maps of too many voxels are not returned at once
+    res = client.post(
+        "/alignments/dummy_alignment/voxels",
+        json={"model_id": 0, "role": "target", "roi_mask": [True] * 642},
+    )
+    assert res.status_code == 400
+
+    roi_mean = client.post(
+        "/alignments/dummy_alignment/voxels",
+        json={
+            "model_id": 0,
+            "role": "source",
+            "roi_mask": [True] * 642,
+            "roi_mean": True,
+        },
+    ).get_json()
+    np.testing.assert_allclose(
+        roi_mean, np.mean(pi / pi.sum(axis=1)[:, None], axis=1), rtol=1e-5
+    )
+
+
+def test_project_contrast(bc, client):
+    rng = np.random.default_rng(0)
+    pi = rng.random((642, 642)).astype(np.float32)
+    set_transport_plan(bc, pi)
+    query = {
+        "model_id": 0,
+        "dataset": "dummy_surface",
+        "subject_index": 0,
+        "mesh": "fsaverage3",
+        "hemi": "left",
+    }
+
+    maps = client.get(
+        "/alignments/dummy_alignment/project_contrast", query_string=query
+    ).get_json()
+    m = client.get(
+        "/alignments/dummy_alignment/project_contrast",
+        query_string={**query, "contrast_index": 1},
+    ).get_json()
+    contrast = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={
+            "mesh": "fsaverage3",
+            "subject_index": 0,
+            "contrast_index": 1,
+            "hemi": "left",
+        },
+    ).get_json()
+
+    assert np.array(maps).shape == (2, 642)
+    np.testing.assert_allclose(
+        m, (np.array(contrast) @ pi) / pi.sum(axis=0), atol=1e-5
+    )
+    np.testing.assert_array_equal(maps[1], m)
+
+    res = client.get(
+        "/alignments/dummy_alignment/project_contrast",
+        query_string={**query, "dataset": "unknown"},
+    )
+    assert res.status_code == 400
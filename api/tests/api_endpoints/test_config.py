@@ -18,3 +18,27 @@ def test_server_config(client):
     assert ds["name"] == "Dummy surface data"
     assert ds["path"] == "features_dataset/dataset.csv"
     assert ds["unit"] == "z-score"
+    assert "cache_folder" not in config
+
+
+def test_server_config_etag(bc, client):
+    res = client.get("/config")
+    assert res.status_code == 200
+
+    res = client.get("/config", headers={"If-None-Match": res.headers["ETag"]})
+    assert res.status_code == 304
+
+    # Dataset descriptions are parsed once, when the server starts
+    assert bc.datasets.features["dummy_surface"].subjects == [
+        "sub-01",
+        "sub-02",
+    ]
+    assert len(bc.datasets.alignments["dummy_alignment"].df) == 1
+
+
+def test_cache_stats(client):
+    stats = client.get("/cache_stats").get_json()
+
+    assert stats["maps"]["n_items"] == 0
+    assert stats["maps"]["evictions"] == 0
+    assert stats["alignment_models"]["n_items"] == 0
@@ -29,6 +29,28 @@ def test_dataset_mesh_url(client):
 
     assert res == "meshes/pial_left.gltf"
 
+    res = client.get(
+        "/datasets/dummy_surface/mesh_url",
+        query_string={
+            "subject": 1,
+            "meshSupport": "fsaverage3",
+            "meshType": "infl",
+            "hemi": "left",
+        },
+    ).get_json()
+    assert res == "meshes/infl_left.gltf"
+
+    res = client.get(
+        "/datasets/dummy_surface/mesh_url",
+        query_string={
+            "subject": 0,
+            "meshSupport": "fsaverage5",
+            "meshType": "pial",
+            "hemi": "left",
+        },
+    )
+    assert res.status_code == 404
+
 
 def test_dataset_fingerprint(client):
     res = client.get(
@@ -101,20 +123,33 @@ def test_dataset_contrast(client):
 
     assert res is None
 
-    # TODO: fix
-    # API should probably take multiple hemispheres instead of "both"
-    # res = client.get(
-    #     "/datasets/dummy_surface/contrast",
-    #     query_string={
-    #         "mesh": "fsaverage3",
-    #         "subject_index": 0,
-    #         "contrast_index": 0,
-    #         "hemi": "both",
-    #     },
-    # ).get_json()
+    # Get both hemispheres
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={
+            "mesh": "fsaverage3",
+            "subject_index": 0,
+            "contrast_index": 0,
+            "hemi": "both",
+        },
+    ).get_json()
 
-    # assert len(res) == 2 * 642
-    # assert np.all(list(map(lambda x: x is None or isinstance(x, float), res))
+    assert len(res) == 2 * 642
+    assert np.all(list(map(lambda x: x is None or isinstance(x, float), res)))
+
+    # Missing hemisphere is filled with null values
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={
+            "mesh": "fsaverage3",
+            "subject_index": 1,
+            "contrast_index": 0,
+            "hemi": "both",
+        },
+    ).get_json()
+
+    assert len(res) == 2 * 642
+    assert np.all(list(map(lambda x: x is None, res[642:])))
 
 
 def test_dataset_contrast_mean(client):
@@ -129,3 +164,137 @@ def test_dataset_contrast_mean(client):
 
     assert len(res) == 642
     assert np.all(list(map(lambda x: x is None or isinstance(x, float), res)))
+
+    res = client.get(
+        "/datasets/dummy_surface/contrast_mean",
+        query_string={
+            "mesh": "fsaverage3",
+            "contrast_index": 0,
+            "hemi": "both",
+        },
+    ).get_json()
+
+    assert len(res) == 2 * 642
+    assert np.all(list(map(lambda x: x is None or isinstance(x, float), res)))
+
+
+def test_dataset_contrast_binary(client):
+    query_string = {
+        "mesh": "fsaverage3",
+        "subject_index": 0,
+        "contrast_index": 0,
+        "hemi": "left",
+    }
+    res_json = client.get(
+        "/datasets/dummy_surface/contrast", query_string=query_string
+    ).get_json()
+
+    # Binary format can be requested with a query parameter...
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={**query_string, "format": "f32"},
+    )
+    assert res.mimetype == "application/octet-stream"
+    assert res.headers["X-Array-Shape"] == "642"
+    assert res.headers["X-Array-Dtype"] == "float32"
+    m = np.frombuffer(res.get_data(), dtype="<f4")
+    np.testing.assert_array_equal(m, np.array(res_json, dtype=np.float32))
+
+    # ... or with the Accept header
+    res = client.get(
+        "/datasets/dummy_surface/voxel_fingerprint",
+        query_string={
+            "mesh": "fsaverage3",
+            "subject_index": 1,
+            "voxel_index": 10,
+            "hemi": "right",
+        },
+        headers={"Accept": "application/octet-stream"},
+    )
+    assert res.headers["X-Array-Shape"] == "2"
+    # sub-02 has no map for the right hemisphere
+    assert res.headers["X-Array-Nan-Count"] == "2"
+
+    # Missing maps yield empty responses
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={**query_string, "subject_index": 1, "hemi": "right"},
+        headers={"Accept": "application/octet-stream"},
+    )
+    assert res.status_code == 204
+
+
+def test_dataset_contrast_statistics(client):
+    res = client.get(
+        "/datasets/dummy_surface/contrast_mean",
+        query_string={
+            "mesh": "fsaverage3",
+            "contrast_index": 0,
+            "hemi": "right",
+            "statistic": "count",
+        },
+    ).get_json()
+
+    # Only sub-01 has a map for the right hemisphere
+    assert res == [1] * 642
+
+    res = client.get(
+        "/datasets/dummy_surface/voxel_fingerprint_mean",
+        query_string={
+            "mesh": "fsaverage3",
+            "voxel_index": 10,
+            "hemi": "left",
+            "statistic": "std",
+        },
+    ).get_json()
+
+    assert len(res) == 2
+
+
+def test_dataset_fingerprints(client):
+    voxel_indices = [10, 700]
+    res = client.post(
+        "/datasets/dummy_surface/voxel_fingerprints",
+        json={
+            "mesh": "fsaverage3",
+            "hemi": "both",
+            "voxel_indices": voxel_indices,
+        },
+    ).get_json()
+
+    # Fingerprints are returned for all subjects by default
+    assert np.array(res, dtype=np.float32).shape == (2, 2, 2)
+    for subject_index in range(2):
+        for i, voxel_index in enumerate(voxel_indices):
+            fingerprint = client.get(
+                "/datasets/dummy_surface/voxel_fingerprint",
+                query_string={
+                    "mesh": "fsaverage3",
+                    "subject_index": subject_index,
+                    "voxel_index": voxel_index,
+                    "hemi": "both",
+                },
+            ).get_json()
+            assert res[subject_index][i] == fingerprint
+
+    roi_mask = np.zeros(642, dtype=bool)
+    roi_mask[voxel_indices[0]] = True
+    roi_mask[20] = True
+    res = client.post(
+        "/datasets/dummy_surface/voxel_fingerprints",
+        json={
+            "mesh": "fsaverage3",
+            "hemi": "left",
+            "subject_indices": [1],
+            "roi_mask": roi_mask.tolist(),
+            "roi_mean": True,
+        },
+    ).get_json()
+
+    assert np.array(res).shape == (1, 2)
+
+    res = client.post(
+        "/datasets/dummy_surface/voxel_fingerprints",
+        json={"mesh": "fsaverage3", "hemi": "left", "voxel_indices": [642]},
+    )
+    assert res.status_code == 400
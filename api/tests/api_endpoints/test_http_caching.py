@@ -0,0 +1,111 @@
+import gzip
+
+import numpy as np
+
+
+def test_etag(client, contrast_query):
+    res = client.get(
+        "/datasets/dummy_surface/contrast", query_string=contrast_query
+    )
+    etag = res.headers["ETag"]
+
+    assert res.status_code == 200
+    assert res.headers["Cache-Control"] == "no-cache"
+
+    # Unchanged data is not sent again
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string=contrast_query,
+        headers={"If-None-Match": etag},
+    )
+    assert res.status_code == 304
+    assert res.get_data() == b""
+
+    # Other query parameters and representations have other ETags
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={**contrast_query, "contrast_index": 1},
+        headers={"If-None-Match": etag},
+    )
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string=contrast_query,
+        headers={
+            "If-None-Match": etag,
+            "Accept": "application/octet-stream",
+        },
+    )
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+
+
+def test_etag_config(create_bc):
+    client = create_bc().app.test_client()
+    query = {
+        "subject": 0,
+        "meshSupport": "fsaverage3",
+        "meshType": "pial",
+        "hemi": "left",
+    }
+    res = client.get("/datasets/dummy_surface/mesh_url", query_string=query)
+    etag = res.headers["ETag"]
+    alignment_etag = client.get("/alignments/dummy_alignment/0/info").headers[
+        "ETag"
+    ]
+
+    # Responses served with another config have other ETags
+    glb_client = create_bc(mesh_format="glb").app.test_client()
+    res = glb_client.get(
+        "/datasets/dummy_surface/mesh_url",
+        query_string=query,
+        headers={"If-None-Match": etag},
+    )
+    assert res.status_code == 200
+    assert res.get_json().endswith(".glb")
+    res = glb_client.get(
+        "/alignments/dummy_alignment/0/info",
+        headers={"If-None-Match": alignment_etag},
+    )
+    assert res.status_code == 200
+
+
+def test_compression(client, contrast_query):
+    res = client.get(
+        "/datasets/dummy_surface/contrast", query_string=contrast_query
+    )
+    assert "Content-Encoding" not in res.headers
+
+    res_gzip = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string=contrast_query,
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert res_gzip.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in res_gzip.headers["Vary"]
+    assert gzip.decompress(res_gzip.get_data()) == res.get_data()
+
+    # Small responses are not compressed
+    res = client.get(
+        "/datasets/dummy_surface/voxel_fingerprint",
+        query_string={
+            "mesh": "fsaverage3",
+            "subject_index": 0,
+            "voxel_index": 10,
+            "hemi": "left",
+        },
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert "Content-Encoding" not in res.headers
+    assert len(res.get_json()) == 2
+
+    # Meshes are compressed too
+    res = client.get(
+        "/datasets/dummy_surface/mesh/meshes/vertices_pial_left.bin",
+        headers={"Accept-Encoding": "gzip"},
+    )
+    assert res.headers["Content-Encoding"] == "gzip"
+    vertices = np.frombuffer(gzip.decompress(res.get_data()), dtype="<f4")
+    assert vertices.shape == (642 * 3,)
@@ -0,0 +1,41 @@
+def test_server_timing(client, contrast_query):
+    res = client.get(
+        "/datasets/dummy_surface/contrast", query_string=contrast_query
+    )
+    timings = dict(
+        timing.split(";dur=")
+        for timing in res.headers["Server-Timing"].split(", ")
+    )
+
+    assert {"compute", "serialize", "total"} <= set(timings)
+    assert float(timings["total"]) >= float(timings["serialize"])
+
+
+def test_metrics(client, contrast_query):
+    for _ in range(2):
+        client.get(
+            "/datasets/dummy_surface/contrast", query_string=contrast_query
+        )
+    client.get("/unknown")
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.mimetype == "text/plain"
+
+    metrics = res.get_data(as_text=True)
+    labels = 'route="/datasets/dummy_surface/contrast",method="GET"'
+    assert f"brain_cockpit_request_duration_seconds_count{{{labels}}} 2" in (
+        metrics
+    )
+    assert (
+        f'brain_cockpit_request_duration_seconds_bucket{{{labels},le="+Inf"}}'
+        " 2"
+    ) in metrics
+    assert f"brain_cockpit_response_size_bytes_count{{{labels}}} 2" in metrics
+    assert (
+        f'brain_cockpit_responses_total{{{labels},status="200"}} 2' in metrics
+    )
+    assert (
+        'brain_cockpit_responses_total{route="unmatched",method="GET",'
+        'status="404"} 1'
+    ) in metrics
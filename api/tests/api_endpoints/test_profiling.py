@@ -0,0 +1,74 @@
+import pstats
+
+
+def profiling_options(tmp_path, **profiling):
+    return {
+        "profiling": {
+            "enabled": True,
+            "folder": str(tmp_path / "profiles"),
+            **profiling,
+        }
+    }
+
+
+def test_profile_startup(create_bc, tmp_path):
+    create_bc(**profiling_options(tmp_path, startup=True))
+
+    (profile_path,) = (tmp_path / "profiles").glob("*.prof")
+    assert "startup" in profile_path.name
+    stats = pstats.Stats(str(profile_path))
+    assert any(
+        function_name == "create_dataset_glft_files"
+        for _, _, function_name in stats.stats
+    )
+
+
+def test_profile_requests(create_bc, tmp_path, contrast_query):
+    bc = create_bc(**profiling_options(tmp_path, token="secret"))
+    client = bc.app.test_client()
+
+    # Requests are not sampled by default
+    client.get("/datasets/dummy_surface/contrast", query_string=contrast_query)
+    client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={**contrast_query, "profile": "wrong"},
+    )
+    assert not (tmp_path / "profiles").exists()
+
+    res = client.get(
+        "/datasets/dummy_surface/contrast",
+        query_string={**contrast_query, "profile": "secret"},
+    )
+    assert res.status_code == 200
+
+    # Unknown urls are not profiled
+    res = client.get("/unknown", query_string={"profile": "secret"})
+    assert res.status_code == 404
+
+    (profile_path,) = (tmp_path / "profiles").glob("*.prof")
+    assert "datasets_dummy_surface_contrast" in profile_path.name
+    assert "subject_index=0" in profile_path.name
+    assert "secret" not in profile_path.name
+    pstats.Stats(str(profile_path))
+
+
+def test_profile_sampled_routes(create_bc, tmp_path, contrast_query):
+    bc = create_bc(
+        **profiling_options(
+            tmp_path, sample_rate=1, routes=["/datasets/*/contrast"]
+        )
+    )
+    client = bc.app.test_client()
+
+    client.get("/config")
+    client.get("/datasets/dummy_surface/contrast", query_string=contrast_query)
+
+    assert len(list((tmp_path / "profiles").glob("*.prof"))) == 1
+
+
+def test_profiling_config_not_served(create_bc, tmp_path):
+    bc = create_bc(**profiling_options(tmp_path, token="secret"))
+    config = bc.app.test_client().get("/config").get_json()
+
+    assert "profiling" not in config
+    assert "secret" not in str(config)
@@ -0,0 +1,189 @@
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+from scipy import sparse
+
+from brain_cockpit.cli import main
+from brain_cockpit.endpoints import alignments_explorer
+from brain_cockpit.endpoints.alignments_explorer import (
+    get_transport_plan,
+    resolve_model_file,
+)
+from brain_cockpit.transport_plan import TransportPlan, top_k
+from brain_cockpit.utils import ByteLRUCache
+
+
+def save_model(path, pi):
+    with open(path, "wb") as f:
+        pickle.dump(SimpleNamespace(pi=pi), f)
+
+
+def test_transport_plan():
+    rng = np.random.default_rng(0)
+    pi = rng.random((10, 20))
+    pi[:, 3] = 0
+
+    for plan in [TransportPlan(pi), TransportPlan(sparse.csr_matrix(pi))]:
+        # Same maps as fugw transform and inverse_transform
+        # of one-hot inputs
+        maps = plan.transport([2, 5], onto="target")
+        assert maps.shape == (2, 20)
+        with np.errstate(invalid="ignore"):
+            np.testing.assert_allclose(maps[1], pi[5] / pi.sum(axis=0))
+        assert np.isnan(maps[0, 3])
+
+        maps = plan.transport([4], onto="source")
+        np.testing.assert_allclose(maps[0], pi[:, 4] / pi.sum(axis=1))
+
+        # Transporting one-hot maps amounts to transporting voxels
+        np.testing.assert_allclose(
+            plan.transport_maps(np.eye(10)[[2, 5]], onto="target"),
+            plan.transport([2, 5], onto="target"),
+        )
+        np.testing.assert_allclose(
+            plan.transport_maps(np.eye(20)[[4]], onto="source"),
+            plan.transport([4], onto="source"),
+        )
+
+    assert TransportPlan(pi).nbytes == pi.nbytes + 30 * 8
+
+
+def test_transport_plan_sparse():
+    rng = np.random.default_rng(0)
+    pi = rng.random((30, 40))
+    pi[pi < 0.8] = 0
+    pi[:, 3] = 0
+    pi[7] = 0
+    dense_plan = TransportPlan(pi)
+    sparse_plan = TransportPlan(sparse.csr_matrix(pi))
+    voxel_indices = [2, 7, 5, 2]
+
+    for plan in [dense_plan, sparse_plan]:
+        for onto in ["target", "source"]:
+            maps = dense_plan.transport(voxel_indices, onto=onto)
+
+            np.testing.assert_allclose(
+                plan.transport(voxel_indices, onto=onto), maps
+            )
+            np.testing.assert_allclose(
+                plan.transport_mean(voxel_indices, onto=onto),
+                maps.mean(axis=0),
+            )
+
+            indices, values = plan.transport_top_k(voxel_indices, 3, onto=onto)
+            expected_indices, expected_values = top_k(maps, 3)
+            for i, m in enumerate(maps):
+                # Sparse plans only yield vertices with non-zero weights
+                n = 3 if plan is dense_plan else min(np.sum(m > 0), 3)
+                np.testing.assert_array_equal(
+                    indices[i], expected_indices[i, :n]
+                )
+                np.testing.assert_allclose(values[i], expected_values[i, :n])
+
+    # The transposed copy is built once
+    assert sparse_plan.get_pi_t() is sparse_plan.get_pi_t()
+
+
+def test_top_k():
+    maps = np.array([[0.1, np.nan, 0.5, 0.3], [1, 2, 3, 4]])
+    indices, values = top_k(maps, 2)
+
+    np.testing.assert_array_equal(indices, [[2, 3], [3, 2]])
+    np.testing.assert_array_equal(values, [[0.5, 0.3], [4, 3]])
+    assert top_k(maps[0], 10)[0].tolist() == [2, 3, 0, 1]
+
+
+def test_get_transport_plan(tmp_path):
+    pis = [np.full((10, 20), i + 1.0) for i in range(3)]
+    for i, pi in enumerate(pis):
+        save_model(tmp_path / f"model_{i}.pkl", pi)
+    plan_nbytes = TransportPlan(pis[0]).nbytes
+
+    # Cache can only hold 2 plans
+    bc = SimpleNamespace(models_cache=ByteLRUCache(max_bytes=2 * plan_nbytes))
+    for i in [0, 1, 0, 2, 0]:
+        plan = get_transport_plan(bc, tmp_path / f"model_{i}.pkl")
+        np.testing.assert_array_equal(plan.pi, pis[i])
+
+    stats = bc.models_cache.stats()
+    assert stats["n_items"] == 2
+    assert stats["hits"] == 2
+    assert stats["misses"] == 3
+    assert stats["evictions"] == 1
+    assert get_transport_plan(
+        bc, tmp_path / "model_0.pkl"
+    ) is get_transport_plan(bc, tmp_path / "model_0.pkl")
+
+
+def test_get_transport_plan_concurrently(tmp_path, monkeypatch):
+    save_model(tmp_path / "model.pkl", np.ones((10, 20)))
+    n_loads = 0
+    lock = threading.Lock()
+
+    def load_transport_plan(model_path):
+        nonlocal n_loads
+        with lock:
+            n_loads += 1
+        time.sleep(0.1)
+        return TransportPlan(np.ones((10, 20)))
+
+    monkeypatch.setattr(
+        alignments_explorer, "load_transport_plan", load_transport_plan
+    )
+    bc = SimpleNamespace(models_cache=ByteLRUCache())
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        plans = list(
+            executor.map(
+                lambda _: get_transport_plan(bc, tmp_path / "model.pkl"),
+                range(8),
+            )
+        )
+
+    # The plan is loaded once, other threads wait for it
+    assert n_loads == 1
+    assert all(plan is plans[0] for plan in plans)
+
+
+def test_sparse_transport_plan(tmp_path):
+    rng = np.random.default_rng(0)
+    pi = rng.random((10, 20)).astype(np.float32)
+    plan = TransportPlan(pi).sparsify(threshold=0.5, max_per_row=3)
+
+    assert sparse.issparse(plan.pi)
+    assert np.diff(plan.pi.indptr).max() <= 3
+    for row in range(10):
+        kept = np.argsort(-pi[row])[:3]
+        kept = kept[pi[row, kept] >= 0.5 * pi[row].max()]
+        np.testing.assert_array_equal(plan.pi[row].indices, np.sort(kept))
+
+    plan.save(tmp_path / "plan.npz")
+    loaded = TransportPlan.load(tmp_path / "plan.npz")
+    assert not loaded.pi.data.flags.writeable
+    np.testing.assert_array_equal(loaded.pi.toarray(), plan.pi.toarray())
+    np.testing.assert_array_equal(loaded.target_mass, plan.target_mass)
+
+
+def test_convert_alignments(tmp_path):
+    rng = np.random.default_rng(0)
+    pi = rng.random((10, 20))
+    save_model(tmp_path / "model.pkl", pi)
+
+    assert resolve_model_file(tmp_path / "model.pkl") == (
+        tmp_path / "model.pkl"
+    )
+    main(["convert-alignments", str(tmp_path / "model.pkl")])
+    assert resolve_model_file(tmp_path / "model.pkl") == (
+        tmp_path / "model.npz"
+    )
+
+    bc = SimpleNamespace(models_cache=ByteLRUCache())
+    plan = get_transport_plan(bc, tmp_path / "model.pkl")
+    np.testing.assert_allclose(
+        plan.transport([1, 2]),
+        TransportPlan(pi).transport([1, 2]),
+        rtol=1e-6,
+    )
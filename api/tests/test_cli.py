@@ -0,0 +1,87 @@
+from pathlib import Path
+
+import yaml
+
+from brain_cockpit.cli import main
+from brain_cockpit.endpoints.features_explorer import (
+    get_dataset_cache_key,
+    get_store_folder,
+)
+from brain_cockpit.features_store import BaseFeaturesStore, FeaturesStore
+from brain_cockpit.utils import load_dataset_description
+
+DUMMY_DATA = Path("./api/tests/dummy_data").absolute()
+
+
+def test_build(tmp_path):
+    config_path = tmp_path / "config.yaml"
+    dataset_path = DUMMY_DATA / "features_dataset" / "dataset.csv"
+    with open(config_path, "w") as f:
+        yaml.safe_dump(
+            {
+                "cache_folder": str(tmp_path / "cache"),
+                "features": {
+                    "datasets": {
+                        "dummy_surface": {
+                            "path": str(dataset_path),
+                            "vertex_major": True,
+                        },
+                        "dummy_lazy": {
+                            "path": str(dataset_path),
+                            "lazy_loading": True,
+                        },
+                    }
+                },
+                "alignments": {
+                    "datasets": {
+                        "dummy_alignment": {
+                            "path": str(
+                                DUMMY_DATA / "alignments_dataset/dataset.csv"
+                            )
+                        }
+                    }
+                },
+            },
+            f,
+        )
+
+    main(["build", "--config", str(config_path), "--workers", "2"])
+
+    # The server would open the store built ahead of time
+    df, _ = load_dataset_description(dataset_path=dataset_path)
+    key = get_dataset_cache_key(df, dataset_path=dataset_path)
+    store = FeaturesStore.open(
+        get_store_folder(tmp_path / "cache", "dummy_surface", dataset_path),
+        key=key,
+    )
+    assert store is not None
+    assert store.has_vertex_major
+    # Only statistics of lazy datasets are built
+    assert (
+        BaseFeaturesStore.open(
+            get_store_folder(
+                tmp_path / "cache", "dummy_lazy", dataset_path, lazy=True
+            ),
+            key=key,
+        )
+        is not None
+    )
+    assert (DUMMY_DATA / "features_dataset/meshes/pial_left.gltf").exists()
+    assert (DUMMY_DATA / "alignments_dataset/meshes/pial_left.gltf").exists()
+
+
+def test_get_store_folder(tmp_path):
+    dataset_path = DUMMY_DATA / "features_dataset" / "dataset.csv"
+    folder = get_store_folder(tmp_path, "dummy_surface", dataset_path)
+
+    # Relative paths are resolved from the config folder
+    assert folder == get_store_folder(
+        tmp_path,
+        "dummy_surface",
+        "features_dataset/dataset.csv",
+        config_path=DUMMY_DATA / "config.yaml",
+    )
+    # Datasets with the same id but different paths don't share stores
+    assert folder != get_store_folder(
+        tmp_path, "dummy_surface", tmp_path / "dataset.csv"
+    )
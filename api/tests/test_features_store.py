@@ -0,0 +1,431 @@
+import os
+
+import numpy as np
+
+from brain_cockpit.endpoints import features_explorer
+from brain_cockpit.endpoints.features_explorer import (
+    create_lazy_store,
+    exist,
+    get_cached_map_path,
+    list_map_files,
+    load_cached_map,
+    load_data,
+    prune_cached_maps,
+    resolve_map_paths,
+)
+from brain_cockpit.features_store import FeaturesStore
+from brain_cockpit.utils import (
+    DEFAULT_CACHE_BUDGET_MB,
+    ByteLRUCache,
+    create_cache,
+    load_dataset_description,
+)
+
+
+def create_store():
+    store = FeaturesStore(
+        ["sub-01", "sub-02"], [["task", "c0"], ["task", "c1"]]
+    )
+    store.set_map("fsaverage3", "left", 0, 0, np.arange(4))
+    store.set_map("fsaverage3", "left", 1, 1, np.ones(4))
+    store.set_map("fsaverage3", "right", 0, 1, np.zeros(5))
+
+    return store
+
+
+def test_store_slices():
+    store = create_store()
+
+    assert store.maps["fsaverage3"]["left"].shape == (2, 2, 4)
+    assert store.maps["fsaverage3"]["left"].dtype == np.float32
+    assert store.get_map("fsaverage3", "left", 1, 0) is None
+    np.testing.assert_array_equal(
+        store.get_map("fsaverage3", "left", 0, 0), np.arange(4)
+    )
+    np.testing.assert_array_equal(
+        store.get_fingerprint("fsaverage3", "left", 0, 2), [2, np.nan]
+    )
+    assert store.split_voxel_index("fsaverage3", 6, subject_index=0) == (
+        "right",
+        2,
+    )
+    assert len(store.get_map("fsaverage3", "both", 0, 1)) == 9
+    np.testing.assert_array_equal(
+        store.get_subject_maps("fsaverage3", "left", 1),
+        [[np.nan] * 4, np.ones(4)],
+    )
+
+
+def test_store_aggregates():
+    store = create_store()
+    store.set_map("fsaverage3", "left", 1, 0, [np.nan, 1, 2, 3])
+    store.compute_aggregates()
+
+    np.testing.assert_array_equal(
+        store.get_map_statistic("fsaverage3", "left", 0, statistic="count"),
+        [1, 2, 2, 2],
+    )
+    np.testing.assert_array_equal(
+        store.get_map_statistic("fsaverage3", "left", 0, statistic="mean"),
+        [0, 1, 2, 3],
+    )
+    np.testing.assert_allclose(
+        store.get_map_statistic("fsaverage3", "left", 0, statistic="std"),
+        np.nanstd([np.arange(4), [np.nan, 1, 2, 3]], axis=0),
+    )
+    assert store.get_map_statistic("fsaverage3", "right", 0) is None
+    np.testing.assert_array_equal(
+        store.get_fingerprint_statistic("fsaverage3", "left", 1),
+        [1, 1],
+    )
+
+
+def test_store_vertex_major():
+    store = create_store()
+    store.compute_aggregates()
+    fingerprints = [
+        store.get_fingerprint("fsaverage3", "left", 0, 2),
+        store.get_fingerprint_statistic("fsaverage3", "left", 2),
+    ]
+    store.compute_vertex_major(chunk_size=3)
+
+    assert store.vertex_major_maps["fsaverage3"]["left"].shape == (4, 2, 2)
+    np.testing.assert_array_equal(
+        store.get_fingerprint("fsaverage3", "left", 0, 2), fingerprints[0]
+    )
+    np.testing.assert_array_equal(
+        store.get_fingerprint_statistic("fsaverage3", "left", 2),
+        fingerprints[1],
+    )
+
+
+def test_store_save_open(tmp_path):
+    store = create_store()
+    store.compute_aggregates()
+    store.compute_vertex_major()
+    store.save(tmp_path / "store", key="abc")
+
+    assert FeaturesStore.open(tmp_path / "store", key="other") is None
+    assert FeaturesStore.open(tmp_path / "missing", key="abc") is None
+
+    loaded = FeaturesStore.open(tmp_path / "store", key="abc")
+    assert isinstance(loaded.maps["fsaverage3"]["left"], np.memmap)
+    assert loaded.has_vertex_major
+    assert loaded.tasks_contrasts == [("task", "c0"), ("task", "c1")]
+    for hemi in ["left", "right"]:
+        np.testing.assert_array_equal(
+            loaded.maps["fsaverage3"][hemi], store.maps["fsaverage3"][hemi]
+        )
+        np.testing.assert_array_equal(
+            loaded.aggregates["std"]["fsaverage3"][hemi],
+            store.aggregates["std"]["fsaverage3"][hemi],
+        )
+        np.testing.assert_array_equal(
+            loaded.masks["fsaverage3"][hemi], store.masks["fsaverage3"][hemi]
+        )
+
+
+def test_load_data_parallel():
+    config_path = "./api/tests/dummy_data/config.yaml"
+    dataset_path = "features_dataset/dataset.csv"
+    df, _ = load_dataset_description(
+        config_path=config_path, dataset_path=dataset_path
+    )
+
+    store = load_data(df, config_path=config_path, dataset_path=dataset_path)
+    store_parallel = load_data(
+        df, config_path=config_path, dataset_path=dataset_path, n_workers=2
+    )
+
+    assert store.masks["fsaverage3"]["left"].all()
+    assert store.masks["fsaverage3"]["right"].sum() == 2
+    for hemi in ["left", "right"]:
+        np.testing.assert_array_equal(
+            store.maps["fsaverage3"][hemi],
+            store_parallel.maps["fsaverage3"][hemi],
+        )
+
+
+def test_load_data_cached_maps(tmp_path, monkeypatch):
+    config_path = "./api/tests/dummy_data/config.yaml"
+    dataset_path = "features_dataset/dataset.csv"
+    df, _ = load_dataset_description(
+        config_path=config_path, dataset_path=dataset_path
+    )
+    _, file_paths = list_map_files(
+        df, config_path=config_path, dataset_path=dataset_path
+    )
+
+    store = load_data(
+        df,
+        config_path=config_path,
+        dataset_path=dataset_path,
+        maps_cache_folder=tmp_path,
+    )
+    assert len(list(tmp_path.glob("*.npy"))) == len(file_paths)
+
+    # Cached maps are not decoded again
+    original_load_map = features_explorer.load_map
+
+    def load_map(file_path):
+        raise AssertionError(f"{file_path} should not be decoded")
+
+    monkeypatch.setattr(features_explorer, "load_map", load_map)
+    cached_store = load_data(
+        df,
+        config_path=config_path,
+        dataset_path=dataset_path,
+        maps_cache_folder=tmp_path,
+    )
+    for hemi in ["left", "right"]:
+        np.testing.assert_array_equal(
+            store.maps["fsaverage3"][hemi],
+            cached_store.maps["fsaverage3"][hemi],
+        )
+
+    # Modified files are decoded again
+    decoded_paths = []
+
+    def load_map(file_path):
+        decoded_paths.append(file_path)
+        return original_load_map(file_path)
+
+    monkeypatch.setattr(features_explorer, "load_map", load_map)
+    map_path = tmp_path / "map.gii"
+    map_path.write_bytes(file_paths[0].read_bytes())
+    load_cached_map((map_path, tmp_path))
+    cache_path = get_cached_map_path(map_path, tmp_path)
+    assert prune_cached_maps(tmp_path, [*file_paths, map_path], "a") == 0
+
+    stat = os.stat(map_path)
+    os.utime(map_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    load_cached_map((map_path, tmp_path))
+    assert decoded_paths == [map_path, map_path]
+    assert get_cached_map_path(map_path, tmp_path) != cache_path
+
+    # Stale entries are removed, unless another config
+    # sharing the cache folder references them
+    assert prune_cached_maps(tmp_path, file_paths, "b") == 0
+    assert prune_cached_maps(tmp_path, [map_path], "a") == 1
+    assert not cache_path.exists()
+    assert get_cached_map_path(map_path, tmp_path).exists()
+    assert len(list(tmp_path.glob("*.npy"))) == len(file_paths) + 1
+
+    # So are temporary files left by interrupted writes
+    old_tmp_path = tmp_path / "old.1.tmp"
+    recent_tmp_path = tmp_path / "recent.1.tmp"
+    old_tmp_path.touch()
+    recent_tmp_path.touch()
+    os.utime(old_tmp_path, (0, 0))
+    prune_cached_maps(tmp_path, [map_path], "a")
+    assert not old_tmp_path.exists()
+    assert recent_tmp_path.exists()
+
+
+def test_list_map_files(tmp_path):
+    (tmp_path / "a.gii").touch()
+    paths = resolve_map_paths(
+        ["a.gii", "b.gii", str(tmp_path / "a.gii")],
+        dataset_path=tmp_path / "dataset.csv",
+    )
+    assert paths[0] == paths[2] == str(tmp_path / "a.gii")
+    np.testing.assert_array_equal(exist(paths), [True, False, True])
+
+    # Symbolic links exist as long as they are not broken
+    (tmp_path / "link.gii").symlink_to(tmp_path / "a.gii")
+    (tmp_path / "broken.gii").symlink_to(tmp_path / "missing.gii")
+    np.testing.assert_array_equal(
+        exist([str(tmp_path / "link.gii"), str(tmp_path / "broken.gii")]),
+        [True, False],
+    )
+
+    config_path = "./api/tests/dummy_data/config.yaml"
+    dataset_path = "features_dataset/dataset.csv"
+    df, _ = load_dataset_description(
+        config_path=config_path, dataset_path=dataset_path
+    )
+    locations, file_paths = list_map_files(
+        df, config_path=config_path, dataset_path=dataset_path
+    )
+
+    assert len(locations) == len(file_paths)
+    assert len(set(locations)) == len(locations)
+    assert all(path.exists() for path in file_paths)
+
+    # Rows with missing labels are dropped
+    df = df.astype({"subject": object, "contrast": object})
+    df.loc[0, "contrast"] = np.nan
+    df.loc[1, "subject"] = np.nan
+    nan_locations, _ = list_map_files(
+        df, config_path=config_path, dataset_path=dataset_path
+    )
+    assert len(nan_locations) == len(locations) - 2
+    assert all(
+        subject_index >= 0 and contrast_index >= 0
+        for _, _, subject_index, contrast_index in nan_locations
+    )
+
+
+def test_lazy_store(tmp_path, monkeypatch):
+    config_path = "./api/tests/dummy_data/config.yaml"
+    dataset_path = "features_dataset/dataset.csv"
+    df, _ = load_dataset_description(
+        config_path=config_path, dataset_path=dataset_path
+    )
+
+    store = load_data(df, config_path=config_path, dataset_path=dataset_path)
+    # Cache can only hold 2 maps of fsaverage3
+    cache = ByteLRUCache(max_bytes=2 * 642 * 4)
+    lazy_store = create_lazy_store(
+        df,
+        cache,
+        config_path=config_path,
+        dataset_path=dataset_path,
+        store_folder=tmp_path / "aggregates",
+        key="key",
+    )
+
+    # Maps decoded to compute statistics are not cached
+    assert len(cache) == 0
+    assert lazy_store.get_n_vertices("fsaverage3", "left", 1) == 642
+    assert lazy_store.get_map("fsaverage3", "right", 1, 0) is None
+    for hemi in ["left", "right", "both"]:
+        np.testing.assert_array_equal(
+            lazy_store.get_map("fsaverage3", hemi, 0, 1),
+            store.get_map("fsaverage3", hemi, 0, 1),
+        )
+    np.testing.assert_array_equal(
+        lazy_store.get_subject_maps("fsaverage3", "right", 0),
+        store.get_subject_maps("fsaverage3", "right", 0),
+    )
+    np.testing.assert_array_equal(
+        lazy_store.get_fingerprint("fsaverage3", "right", 1, 10),
+        store.get_fingerprint("fsaverage3", "right", 1, 10),
+    )
+    np.testing.assert_array_equal(
+        lazy_store.get_fingerprints("fsaverage3", "both", [0, 1], [10, 700]),
+        store.get_fingerprints("fsaverage3", "both", [0, 1], [10, 700]),
+    )
+    for statistic in ["mean", "std", "count"]:
+        for hemi in ["left", "right", "both"]:
+            np.testing.assert_allclose(
+                lazy_store.get_map_statistic(
+                    "fsaverage3", hemi, 0, statistic=statistic
+                ),
+                store.get_map_statistic(
+                    "fsaverage3", hemi, 0, statistic=statistic
+                ),
+                rtol=1e-6,
+            )
+        np.testing.assert_allclose(
+            lazy_store.get_fingerprint_statistic(
+                "fsaverage3", "left", 10, statistic=statistic
+            ),
+            store.get_fingerprint_statistic(
+                "fsaverage3", "left", 10, statistic=statistic
+            ),
+            rtol=1e-6,
+        )
+
+    stats = cache.stats()
+    assert stats["n_items"] == 2
+    assert stats["current_bytes"] <= stats["max_bytes"]
+    assert stats["evictions"] > 0
+
+    # Statistics are saved, and reused as long as the key is unchanged
+    def load_map(file_path):
+        raise AssertionError("Maps should not be decoded")
+
+    monkeypatch.setattr(features_explorer, "load_map", load_map)
+    reopened_store = create_lazy_store(
+        df,
+        ByteLRUCache(),
+        config_path=config_path,
+        dataset_path=dataset_path,
+        store_folder=tmp_path / "aggregates",
+        key="key",
+    )
+    assert reopened_store.get_n_vertices("fsaverage3", "left", 1) == 642
+    np.testing.assert_array_equal(
+        reopened_store.get_map_statistic("fsaverage3", "both", 0),
+        lazy_store.get_map_statistic("fsaverage3", "both", 0),
+    )
+
+
+def test_create_cache():
+    assert create_cache({}, "budget_mb").max_bytes == (
+        DEFAULT_CACHE_BUDGET_MB * 1024**2
+    )
+    assert create_cache({"budget_mb": None}, "budget_mb").max_bytes == (
+        DEFAULT_CACHE_BUDGET_MB * 1024**2
+    )
+    assert create_cache({"budget_mb": 2}, "budget_mb").max_bytes == 2 * 1024**2
+    # Unbounded caches are an explicit opt-in
+    assert create_cache({"budget_mb": -1}, "budget_mb").max_bytes is None
+
+
+def test_store_fingerprints():
+    store = create_store()
+    store.compute_aggregates()
+
+    fingerprints = store.get_fingerprints("fsaverage3", "both", [1, 0], [3, 6])
+    assert fingerprints.shape == (2, 2, 2)
+    np.testing.assert_array_equal(
+        fingerprints[1, 0], store.get_fingerprint("fsaverage3", "left", 0, 3)
+    )
+    np.testing.assert_array_equal(
+        fingerprints[1, 1], store.get_fingerprint("fsaverage3", "right", 0, 2)
+    )
+
+    store.compute_vertex_major()
+    np.testing.assert_array_equal(
+        store.get_fingerprints("fsaverage3", "both", [1, 0], [3, 6]),
+        fingerprints,
+    )
+    np.testing.assert_array_equal(
+        store.get_fingerprints(
+            "fsaverage3", "left", [0, 1], [0, 1], roi_mean=True
+        ),
+        [[0.5, np.nan], [np.nan, 1]],
+    )
+
+
+def test_store_fingerprints_individual_meshes():
+    store = FeaturesStore(
+        ["sub-01", "sub-02"], [["task", "c0"], ["task", "c1"]]
+    )
+    rng = np.random.default_rng(0)
+    # Left hemisphere meshes of both subjects have different sizes
+    for subject_index, n_vertices in enumerate([4, 6]):
+        for contrast_index in range(2):
+            store.set_map(
+                "individual",
+                "left",
+                subject_index,
+                contrast_index,
+                rng.random(n_vertices),
+            )
+            store.set_map(
+                "individual",
+                "right",
+                subject_index,
+                contrast_index,
+                rng.random(5),
+            )
+    store.compute_aggregates()
+
+    voxel_indices = [1, 4, 5, 8]
+    fingerprints = store.get_fingerprints(
+        "individual", "both", [1, 0], voxel_indices
+    )
+    for i, subject_index in enumerate([1, 0]):
+        for j, voxel_index in enumerate(voxel_indices):
+            hemi, index = store.split_voxel_index(
+                "individual", voxel_index, subject_index
+            )
+            np.testing.assert_array_equal(
+                fingerprints[i, j],
+                store.get_fingerprint(
+                    "individual", hemi, subject_index, index
+                ),
+            )
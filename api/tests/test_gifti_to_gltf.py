@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+from pathlib import Path
+from types import SimpleNamespace
+
+import gltflib
+
+import numpy as np
+
+from brain_cockpit.scripts.gifti_to_gltf import (
+    GLTF_MANIFEST_FILENAME,
+    compute_glb_from_gifti,
+    compute_gltf_from_gifti,
+    create_dataset_glft_files,
+    read_gii,
+)
+
+MESH_PATH = "./api/tests/dummy_data/features_dataset/meshes/pial_left.gii.gz"
+
+
+def test_compute_gltf_from_gifti(tmp_path):
+    vertices, triangles = read_gii(MESH_PATH)
+    compute_gltf_from_gifti(MESH_PATH, str(tmp_path), "pial_left")
+
+    with open(tmp_path / "pial_left.gltf", "r") as f:
+        gltf = json.load(f)
+
+    gltf_vertices = np.fromfile(
+        tmp_path / "vertices_pial_left.bin", dtype="<f4"
+    ).reshape(-1, 3)
+    gltf_triangles = np.fromfile(
+        tmp_path / "triangles_pial_left.bin", dtype="<u4"
+    ).reshape(-1, 3)
+
+    np.testing.assert_array_equal(gltf_vertices, vertices)
+    np.testing.assert_array_equal(gltf_triangles, triangles)
+    assert gltf["accessors"][0]["count"] == len(vertices)
+    assert gltf["accessors"][0]["min"] == vertices.min(axis=0).tolist()
+    assert gltf["accessors"][0]["max"] == vertices.max(axis=0).tolist()
+    assert gltf["accessors"][1]["count"] == 3 * len(triangles)
+
+
+def test_create_dataset_glft_files_incremental(tmp_path):
+    shutil.copy(MESH_PATH, tmp_path / "pial_left.gii.gz")
+    shutil.copy(
+        MESH_PATH.replace("pial", "infl"), tmp_path / "infl_left.gii.gz"
+    )
+    bc = SimpleNamespace(config={"loading_workers": 2}, config_path=None)
+    dataset = {
+        "path": str(tmp_path / "dataset.csv"),
+        "mesh_types": {"default": "pial", "other": ["infl"]},
+    }
+    mesh_paths = [Path("pial_left.gii.gz")]
+
+    create_dataset_glft_files(bc, dataset, mesh_paths)
+
+    with open(tmp_path / GLTF_MANIFEST_FILENAME, "r") as f:
+        manifest = json.load(f)
+    assert set(manifest.keys()) == {"pial_left.gltf", "infl_left.gltf"}
+    mtimes = {name: os.stat(tmp_path / name).st_mtime_ns for name in manifest}
+
+    # Touched but unchanged meshes are not converted again
+    os.utime(tmp_path / "pial_left.gii.gz", ns=(0, 0))
+    # Changed meshes are
+    shutil.copy(
+        MESH_PATH.replace("left", "right"), tmp_path / "infl_left.gii.gz"
+    )
+    create_dataset_glft_files(bc, dataset, mesh_paths)
+
+    assert os.stat(tmp_path / "pial_left.gltf").st_mtime_ns == (
+        mtimes["pial_left.gltf"]
+    )
+    assert os.stat(tmp_path / "infl_left.gltf").st_mtime_ns != (
+        mtimes["infl_left.gltf"]
+    )
+    vertices, _ = read_gii(MESH_PATH.replace("left", "right"))
+    np.testing.assert_array_equal(
+        np.fromfile(tmp_path / "vertices_infl_left.bin", dtype="<f4").reshape(
+            -1, 3
+        ),
+        vertices,
+    )
+
+
+def test_create_dataset_glft_files_missing_mesh(tmp_path):
+    shutil.copy(MESH_PATH, tmp_path / "pial_left.gii.gz")
+    bc = SimpleNamespace(config=dict(), config_path=None)
+    dataset = {"path": str(tmp_path / "dataset.csv")}
+    mesh_paths = [Path("pial_left.gii.gz"), Path("pial_right.gii.gz")]
+
+    create_dataset_glft_files(bc, dataset, mesh_paths)
+    assert (tmp_path / "pial_left.gltf").exists()
+    assert not (tmp_path / "pial_right.gltf").exists()
+
+    # Converted meshes are kept once their source is removed
+    (tmp_path / "pial_left.gii.gz").unlink()
+    create_dataset_glft_files(bc, dataset, mesh_paths)
+    assert (tmp_path / "pial_left.gltf").exists()
+
+
+def test_compute_glb_from_gifti(tmp_path):
+    vertices, triangles = read_gii(MESH_PATH)
+    compute_glb_from_gifti(MESH_PATH, str(tmp_path), "pial_left")
+    compute_gltf_from_gifti(MESH_PATH, str(tmp_path), "pial_left")
+
+    glb = gltflib.GLTF.load(str(tmp_path / "pial_left.glb"))
+    model = glb.model
+    data = glb.get_glb_resource().data
+    positions_view, indices_view = model.bufferViews
+
+    assert model.extensionsRequired == ["KHR_mesh_quantization"]
+    assert model.accessors[1].componentType == (
+        gltflib.ComponentType.UNSIGNED_SHORT.value
+    )
+
+    positions = np.frombuffer(
+        data[: positions_view.byteLength], dtype="<i2"
+    ).reshape(-1, 4)[:, :3]
+    node = model.nodes[0]
+    np.testing.assert_allclose(
+        positions * np.array(node.scale) + np.array(node.translation),
+        vertices,
+        atol=np.ptp(vertices, axis=0).max() / 2**15,
+    )
+    np.testing.assert_array_equal(
+        np.frombuffer(
+            data[
+                indices_view.byteOffset : indices_view.byteOffset
+                + indices_view.byteLength
+            ],
+            dtype="<u2",
+        ).reshape(-1, 3),
+        triangles,
+    )
+
+    gltf_size = sum(
+        os.path.getsize(tmp_path / name)
+        for name in [
+            "pial_left.gltf",
+            "vertices_pial_left.bin",
+            "triangles_pial_left.bin",
+        ]
+    )
+    assert os.path.getsize(tmp_path / "pial_left.glb") < gltf_size
@@ -0,0 +1,66 @@
+import json
+import os
+import signal
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, jsonify
+
+from brain_cockpit.prefork import create_socket, serve_prefork
+
+
+def test_serve_prefork():
+    app = Flask(__name__)
+
+    @app.route("/pid")
+    def get_pid():
+        # Keep workers busy so that requests are spread across them
+        time.sleep(0.05)
+        return jsonify(os.getpid())
+
+    sock = create_socket("127.0.0.1", 0)
+    port = sock.getsockname()[1]
+
+    parent_pid = os.fork()
+    if parent_pid == 0:
+        try:
+            serve_prefork(app, sock, workers=2, threads=1)
+        finally:
+            os._exit(0)
+    sock.close()
+
+    try:
+
+        def get_worker_pid(_):
+            try:
+                with urllib.request.urlopen(
+                    f"http://127.0.0.1:{port}/pid", timeout=5
+                ) as response:
+                    return json.loads(response.read())
+            except OSError:
+                time.sleep(0.05)
+                return None
+
+        pids = set()
+        deadline = time.time() + 10
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            while len(pids) < 2 and time.time() < deadline:
+                pids.update(executor.map(get_worker_pid, range(8)))
+                pids.discard(None)
+
+        # Requests are served by forked workers
+        assert len(pids) == 2
+        assert parent_pid not in pids
+    finally:
+        os.kill(parent_pid, signal.SIGTERM)
+        _, status = os.waitpid(parent_pid, 0)
+
+    assert os.WIFEXITED(status)
+    for pid in pids:
+        # Workers are stopped with the parent process
+        try:
+            os.kill(pid, 0)
+            assert False, f"Worker {pid} is still running"
+        except ProcessLookupError:
+            pass
@@ -106,6 +106,30 @@ class Scene extends Component<SceneProps, IState> {
     });
   }
 
+  // Extract geometry of a loaded GLTF node in world coordinates.
+  // Quantized positions (KHR_mesh_quantization) are stored
+  // as integers which the node transform scales back,
+  // hence they are converted to floats before applying it.
+  static getNodeGeometry(node: THREE.Mesh): THREE.BufferGeometry {
+    const geometry = node.geometry;
+    const position = geometry.attributes.position;
+
+    if (!(position.array instanceof Float32Array)) {
+      const array = new Float32Array(3 * position.count);
+      for (let i = 0; i < position.count; i++) {
+        array[3 * i] = position.getX(i);
+        array[3 * i + 1] = position.getY(i);
+        array[3 * i + 2] = position.getZ(i);
+      }
+      geometry.setAttribute("position", new THREE.BufferAttribute(array, 3));
+    }
+
+    node.updateMatrix();
+    geometry.applyMatrix4(node.matrix);
+
+    return geometry;
+  }
+
   // Load BufferGeometry object from backend
   static async loadGeometry(
     meshUrls?: string[]
@@ -117,7 +141,9 @@ class Scene extends Component<SceneProps, IState> {
       return Promise.all(promises).then((values: any) => {
         const mergedBufferGeometries =
           BufferGeometryUtils.mergeBufferGeometries(
-            values.map((value: any) => value.scene.children[0].geometry)
+            values.map((value: any) =>
+              Scene.getNodeGeometry(value.scene.children[0])
+            )
           );
 
         return mergedBufferGeometries;